@@ -0,0 +1,331 @@
+import logging
+import os
+import re
+import struct
+import threading
+import zipfile
+from collections import OrderedDict, namedtuple
+
+import py7zr
+import rarfile
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from config import ARCHIVE_INDEX_CACHE_SIZE
+from database import SessionLocal, ArchiveIndexRecord
+from image_info import image_dimensions, read_dimensions, HEADER_BYTES
+from metrics import span
+
+logger = logging.getLogger("uvicorn.info")
+
+ARCHIVE_EXTENSIONS = ('.zip', '.rar', '.7z')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+# 成员信息：offset 为 ZIP 成员数据在文件中的起始位置（其他格式为 0），
+# position 为自然排序后的序号，宽高尚未读取时为 0，读过但无法识别时为 UNKNOWN_DIMENSION
+ArchiveMember = namedtuple("ArchiveMember", ["name", "offset", "compress_size", "file_size", "crc",
+                                             "method", "position", "width", "height"])
+
+# 二进制索引格式：魔数 + 成员数，之后每个成员一条定长记录紧跟 UTF-8 文件名
+INDEX_MAGIC = b"MIX1"
+_HEADER = struct.Struct("<4sI")
+_RECORD = struct.Struct("<QQQIHIIIH")
+
+_LOCAL_HEADER_SIZE = 30
+
+# 图片头无法识别时记下的宽高，避免每次请求清单都重新读取
+UNKNOWN_DIMENSION = 0xffffffff
+
+
+class ArchiveIndexError(Exception):
+    """扫描时已确认无法读取的压缩包（文件未变化），不再重复尝试打开。"""
+
+
+def is_archive(file_path):
+    return file_path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def natural_sort_key(name):
+    # "page2" 排在 "page10" 前面；拆分后字符串与数字交替出现，类型一一对应
+    return [int(part) if part.isdigit() else part.casefold() for part in re.split(r'(\d+)', name)]
+
+
+def pack_members(members):
+    parts = [_HEADER.pack(INDEX_MAGIC, len(members))]
+    for m in members:
+        name = m.name.encode('utf-8')
+        parts.append(_RECORD.pack(m.offset, m.compress_size, m.file_size, m.crc & 0xffffffff, m.method,
+                                  m.position, m.width, m.height, len(name)))
+        parts.append(name)
+    return b"".join(parts)
+
+
+def unpack_members(data):
+    magic, count = _HEADER.unpack_from(data, 0)
+    if magic != INDEX_MAGIC:
+        raise ValueError("Unknown archive index format")
+    members = []
+    pos = _HEADER.size
+    for _ in range(count):
+        offset, compress_size, file_size, crc, method, position, width, height, name_len = \
+            _RECORD.unpack_from(data, pos)
+        pos += _RECORD.size
+        name = data[pos:pos + name_len].decode('utf-8')
+        pos += name_len
+        members.append(ArchiveMember(name, offset, compress_size, file_size, crc,
+                                     method, position, width, height))
+    return members
+
+
+def _zip_members(archive_path):
+    rows = []
+    with zipfile.ZipFile(archive_path, 'r') as z, open(archive_path, 'rb') as raw:
+        for info in z.infolist():
+            if info.is_dir():
+                continue
+            # 本地文件头之后才是成员数据，记录真实偏移以便直接从文件读取
+            raw.seek(info.header_offset)
+            header = raw.read(_LOCAL_HEADER_SIZE)
+            name_len, extra_len = struct.unpack('<HH', header[26:30])
+            offset = info.header_offset + _LOCAL_HEADER_SIZE + name_len + extra_len
+            width = height = 0
+            if info.filename.lower().endswith(IMAGE_EXTENSIONS) and not info.flag_bits & 0x1:
+                try:
+                    if info.compress_type == zipfile.ZIP_STORED:
+                        dims = read_dimensions(raw, offset, info.file_size)
+                    else:
+                        with z.open(info) as member:
+                            dims = image_dimensions(member.read(HEADER_BYTES))
+                    width, height = dims or (UNKNOWN_DIMENSION, UNKNOWN_DIMENSION)
+                except Exception as e:
+                    logger.warning(f"Failed to read image header {info.filename} in {archive_path}: {e}")
+            rows.append((info.filename, offset, info.compress_size, info.file_size, info.CRC,
+                         info.compress_type, width, height))
+    return rows
+
+
+def _rar_members(archive_path):
+    with rarfile.RarFile(archive_path, 'r') as r:
+        return [(info.filename, 0, info.compress_size or 0, info.file_size or 0, info.CRC or 0,
+                 info.compress_type or 0, 0, 0)
+                for info in r.infolist() if not info.isdir()]
+
+
+def _7z_members(archive_path):
+    # 7z 读取文件头需要解压，尺寸留给清单接口按需补齐
+    with py7zr.SevenZipFile(archive_path, mode='r') as z:
+        return [(info.filename, 0, info.compressed or 0, info.uncompressed or 0, info.crc32 or 0, 0, 0, 0)
+                for info in z.list() if not info.is_directory]
+
+
+def read_archive_members(archive_path):
+    lower = archive_path.lower()
+    if lower.endswith('.zip'):
+        rows = _zip_members(archive_path)
+    elif lower.endswith('.rar'):
+        rows = _rar_members(archive_path)
+    elif lower.endswith('.7z'):
+        rows = _7z_members(archive_path)
+    else:
+        return []
+    order = sorted(range(len(rows)), key=lambda i: natural_sort_key(rows[i][0]))
+    positions = {i: pos for pos, i in enumerate(order)}
+    return [ArchiveMember(name, offset, compress_size, file_size, crc, method, positions[i], width, height)
+            for i, (name, offset, compress_size, file_size, crc, method, width, height) in enumerate(rows)]
+
+
+def read_folder_members(folder_path):
+    # 文件夹里的图片也按同样的格式建索引，offset/CRC 为 0，大小即文件大小
+    rows = []
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                size = entry.stat().st_size
+                with open(entry.path, 'rb') as f:
+                    width, height = read_dimensions(f, 0, size) or (UNKNOWN_DIMENSION, UNKNOWN_DIMENSION)
+            except OSError as e:
+                logger.warning(f"Failed to read image header {entry.path}: {e}")
+                continue
+            rows.append((entry.name, size, width, height))
+    order = sorted(range(len(rows)), key=lambda i: natural_sort_key(rows[i][0]))
+    positions = {i: pos for pos, i in enumerate(order)}
+    return [ArchiveMember(name, 0, size, size, 0, 0, positions[i], width, height)
+            for i, (name, size, width, height) in enumerate(rows)]
+
+
+class ArchiveIndexCache:
+    """已解码索引的内存 LRU，按路径存放，大小或 mtime 变化即视为过期。"""
+
+    def __init__(self, max_entries=ARCHIVE_INDEX_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, size, mtime_ns):
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is None or cached[0] != (size, mtime_ns):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return cached[1]
+
+    def put(self, path, size, mtime_ns, loaded):
+        with self._lock:
+            self._entries[path] = ((size, mtime_ns), loaded)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+index_cache = ArchiveIndexCache()
+
+
+# 内存中的索引：按自然顺序排列的成员列表，以及按名称查找的字典
+LoadedIndex = namedtuple("LoadedIndex", ["members", "by_name"])
+
+
+def _loaded(members):
+    members = sorted(members, key=lambda m: m.position)
+    return LoadedIndex(members, {m.name: m for m in members})
+
+
+def _load_index(path, size, mtime_ns, read_members, db: Session = None):
+    loaded = index_cache.get(path, size, mtime_ns)
+    if loaded is not None:
+        return loaded
+
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
+    try:
+        record = db.query(ArchiveIndexRecord).filter(ArchiveIndexRecord.path == path).first()
+        if record is not None and record.size == size and record.mtime_ns == mtime_ns:
+            if record.error:
+                raise ArchiveIndexError(record.error)
+            loaded = _loaded(unpack_members(record.data))
+        else:
+            with span("index_build"):
+                loaded = _loaded(read_members(path))
+            if record is None:
+                record = ArchiveIndexRecord(path=path)
+                db.add(record)
+            record.size = size
+            record.mtime_ns = mtime_ns
+            record.member_count = len(loaded.members)
+            record.data = pack_members(loaded.members)
+            record.error = None
+            if own_session:
+                try:
+                    db.commit()
+                except OperationalError as e:
+                    # 扫描任务长时间持有写锁时不阻塞读图，索引留到下次再写入
+                    db.rollback()
+                    logger.warning(f"Failed to store archive index for {path}: {e}")
+            else:
+                db.flush()
+    finally:
+        if own_session:
+            db.close()
+    index_cache.put(path, size, mtime_ns, loaded)
+    return loaded
+
+
+def build_archive_index(archive_path):
+    """在子进程中读取压缩包成员表，返回 (路径, 大小, mtime, 成员数, 打包后的数据)。
+
+    先取 stat 再读内容：读取过程中文件被替换时记录的是旧的 mtime，下次扫描会重建。
+    """
+    path = os.path.abspath(archive_path)
+    stat = os.stat(path)
+    members = read_archive_members(path)
+    return path, stat.st_size, stat.st_mtime_ns, len(members), pack_members(members)
+
+
+def load_archive_index(archive_path, db: Session = None):
+    """确保压缩包在索引库中有与当前大小、mtime 一致的记录，返回 LoadedIndex。
+
+    传入 db 时只写入会话，由调用方统一提交；否则自行开会话并提交。
+    """
+    path = os.path.abspath(archive_path)
+    stat = os.stat(path)
+    return _load_index(path, stat.st_size, stat.st_mtime_ns, read_archive_members, db)
+
+
+def load_folder_index(folder_path, db: Session = None):
+    """文件夹的图片索引，以目录 mtime 判断是否过期（大小记为 0）。"""
+    path = os.path.abspath(folder_path)
+    stat = os.stat(path)
+    return _load_index(path, 0, stat.st_mtime_ns, read_folder_members, db)
+
+
+def update_index_dimensions(index_path, size, mtime_ns, dimensions):
+    """把按需补算出的图片尺寸写回索引；dimensions 为 {成员名: (宽, 高)}。索引已过期时不写。"""
+    path = os.path.abspath(index_path)
+    db = SessionLocal()
+    try:
+        record = db.query(ArchiveIndexRecord).filter(ArchiveIndexRecord.path == path).first()
+        if record is None or record.size != size or record.mtime_ns != mtime_ns or record.error:
+            return None
+        members = [m._replace(width=dimensions[m.name][0], height=dimensions[m.name][1])
+                   if m.name in dimensions else m
+                   for m in unpack_members(record.data)]
+        record.data = pack_members(members)
+        db.commit()
+    finally:
+        db.close()
+    loaded = _loaded(members)
+    index_cache.put(path, size, mtime_ns, loaded)
+    return loaded
+
+
+def create_archive_index(archive_path, db: Session = None):
+    load_archive_index(archive_path, db)
+
+
+def get_archive_index(archive_path):
+    return load_archive_index(archive_path).members
+
+
+def get_archive_member(archive_path, name):
+    return load_archive_index(archive_path).by_name.get(name)
+
+
+def get_archive_contents(archive_path):
+    return [m.name for m in get_archive_index(archive_path)]
+
+
+def member_etag(member, stat):
+    # 成员 CRC + 压缩包 mtime/大小：压缩包不变时同一页的 ETag 永远不变
+    return f'"{member.crc:08x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def remove_archive_indexes(db: Session, paths):
+    paths = [os.path.abspath(p) for p in paths]
+    for i in range(0, len(paths), 500):
+        batch = paths[i:i + 500]
+        db.query(ArchiveIndexRecord).filter(ArchiveIndexRecord.path.in_(batch)).delete(synchronize_session=False)
+    for path in paths:
+        index_cache.discard(path)
+
+
+def remove_archive_indexes_under(db: Session, root):
+    prefix = os.path.join(os.path.abspath(root), '')
+    db.query(ArchiveIndexRecord).filter(
+        ArchiveIndexRecord.path.startswith(prefix, autoescape=True)
+    ).delete(synchronize_session=False)
@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from archive_index import build_archive_index, index_cache
+from config import INDEX_WORKERS, INDEX_MAX_PENDING, INDEX_COMMIT_BATCH
+from database import SessionLocal, ArchiveIndexRecord
+from metrics import span
+
+logger = logging.getLogger("uvicorn.info")
+
+# 按路径批量查询索引记录时每条语句的参数数量
+QUERY_BATCH_SIZE = 500
+
+
+class ArchiveIndexer:
+    """扫描时把压缩包索引分发到进程池并行构建，结果分批写入数据库。
+
+    在途任务数不超过 max_pending，主线程写库跟不上时自然停止提交新任务；
+    单个压缩包失败只在它的索引记录里写下错误，不影响整个扫描。
+    """
+
+    def __init__(self, workers=INDEX_WORKERS, max_pending=INDEX_MAX_PENDING, batch_size=INDEX_COMMIT_BATCH):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.batch_size = max(1, batch_size)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _reset_executor(self, broken=None):
+        # broken 为出错的那个进程池；已经换成新进程池时不再重复关闭
+        with self._lock:
+            executor = self._executor
+            if broken is not None and executor is not broken:
+                return
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _known_records(self, db, paths):
+        known = {}
+        for i in range(0, len(paths), QUERY_BATCH_SIZE):
+            batch = paths[i:i + QUERY_BATCH_SIZE]
+            rows = db.query(ArchiveIndexRecord.path, ArchiveIndexRecord.size, ArchiveIndexRecord.mtime_ns) \
+                .filter(ArchiveIndexRecord.path.in_(batch)).all()
+            known.update((row.path, (row.size, row.mtime_ns)) for row in rows)
+        return known
+
+    def _stale_paths(self, db, paths):
+        # 大小和 mtime 与记录一致的跳过（包括之前失败过的），只重建变化了的
+        known = self._known_records(db, paths)
+        stale = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if known.get(path) != (stat.st_size, stat.st_mtime_ns):
+                stale.append((path, stat))
+        return stale
+
+    def _write(self, db, results):
+        if not results:
+            return
+        paths = [r[0] for r in results]
+        records = {}
+        for i in range(0, len(paths), QUERY_BATCH_SIZE):
+            batch = paths[i:i + QUERY_BATCH_SIZE]
+            records.update((r.path, r) for r in
+                           db.query(ArchiveIndexRecord).filter(ArchiveIndexRecord.path.in_(batch)))
+        for path, size, mtime_ns, member_count, data, error in results:
+            record = records.get(path)
+            if record is None:
+                record = ArchiveIndexRecord(path=path)
+                db.add(record)
+                records[path] = record
+            record.size = size
+            record.mtime_ns = mtime_ns
+            record.member_count = member_count
+            record.data = data
+            record.error = error
+        db.commit()
+        for path in paths:
+            index_cache.discard(path)
+
+    def index_archives(self, paths, job=None):
+        """为一组压缩包建索引，返回 (成功数, [(路径, 错误)])。job 不为空时汇报进度并响应取消。"""
+        paths = list(dict.fromkeys(os.path.abspath(p) for p in paths))
+        if not paths:
+            return 0, []
+        db = SessionLocal()
+        pending = {}
+        indexed = 0
+        failures = []
+        batch = []
+
+        def collect(done):
+            nonlocal indexed
+            for future in done:
+                path, stat, executor = pending.pop(future)
+                try:
+                    batch.append(future.result() + (None,))
+                    indexed += 1
+                    if job is not None:
+                        job.advance(archives_indexed=1)
+                except BrokenProcessPool:
+                    # 子进程崩溃时无法知道是哪个压缩包导致的，不记录错误，下次扫描重试
+                    logger.warning(f"Index worker crashed while indexing {path}")
+                    self._reset_executor(executor)
+                except Exception as e:
+                    logger.warning(f"Failed to index archive {path}: {e}")
+                    failures.append((path, str(e)))
+                    batch.append((path, stat.st_size, stat.st_mtime_ns, 0, b"", str(e) or type(e).__name__))
+                    if job is not None:
+                        job.advance(archives_failed=1)
+
+        try:
+            stale = self._stale_paths(db, paths)
+            if not stale:
+                return 0, []
+            with span("index_scan"):
+                for path, stat in stale:
+                    if job is not None:
+                        job.check_cancelled()
+                    while len(pending) >= self.max_pending:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    executor = self._get_executor()
+                    pending[executor.submit(build_archive_index, path)] = (path, stat, executor)
+                    if len(batch) >= self.batch_size:
+                        self._write(db, batch)
+                        batch.clear()
+                while pending:
+                    if job is not None:
+                        job.check_cancelled()
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                    if len(batch) >= self.batch_size:
+                        self._write(db, batch)
+                        batch.clear()
+                self._write(db, batch)
+        except Exception:
+            # 取消或出错：放弃尚未开始的任务，已提交的批次保留（索引只是缓存）
+            for future in pending:
+                future.cancel()
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        logger.info(f"Indexed {indexed} archives ({len(failures)} failed)")
+        return indexed, failures
+
+    def shutdown(self):
+        self._reset_executor()
+
+
+archive_indexer = ArchiveIndexer()
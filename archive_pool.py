@@ -0,0 +1,234 @@
+import logging
+import os
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import py7zr
+import rarfile
+
+from config import ARCHIVE_POOL_SIZE, ARCHIVE_POOL_IDLE_SECONDS
+from metrics import span
+
+logger = logging.getLogger("uvicorn.info")
+
+
+def open_archive(archive_path):
+    lower = archive_path.lower()
+    if lower.endswith('.zip'):
+        return zipfile.ZipFile(archive_path, 'r')
+    elif lower.endswith('.rar'):
+        return rarfile.RarFile(archive_path, 'r')
+    elif lower.endswith('.7z'):
+        return py7zr.SevenZipFile(archive_path, mode='r')
+    raise ValueError(f"Unsupported archive type: {archive_path}")
+
+
+class PooledArchive:
+    """一个已打开的压缩包句柄，目录只解析一次，读取时加锁。"""
+
+    def __init__(self, path, key, handle):
+        self.path = path
+        self.key = key
+        self.handle = handle
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.users = 0
+        self.evicted = False
+        try:
+            if isinstance(handle, py7zr.SevenZipFile):
+                self.names = frozenset(handle.getnames())
+            else:
+                self.names = frozenset(handle.namelist())
+        except Exception:
+            # 目录读取失败时句柄不会进入池子，这里关闭以免泄漏文件描述符
+            self.close()
+            raise
+
+    def read(self, member):
+        with self.lock, span("decompress"):
+            if isinstance(self.handle, py7zr.SevenZipFile):
+                # py7zr 每次读取后需要 reset 才能再次读取
+                try:
+                    data = self.handle.read([member])
+                    return data[member].read()
+                finally:
+                    self.handle.reset()
+            return self.handle.read(member)
+
+    def read_head(self, member, size):
+        # 只解压成员开头的 size 字节，用来读图片头；ZIP/RAR 可以流式读取，7z 只能整个成员解压，返回 None
+        if isinstance(self.handle, py7zr.SevenZipFile):
+            return None
+        with self.lock, span("decompress"):
+            with self.handle.open(member) as f:
+                return f.read(size)
+
+    def solid_info(self):
+        # 返回 (是否固实压缩, 解压后总大小)，ZIP 永远不是固实的
+        with self.lock:
+            if isinstance(self.handle, py7zr.SevenZipFile):
+                info = self.handle.archiveinfo()
+                return bool(info.solid), info.uncompressed
+            if isinstance(self.handle, rarfile.RarFile):
+                return self.handle.is_solid(), sum(i.file_size for i in self.handle.infolist())
+            return False, 0
+
+    def close(self):
+        try:
+            self.handle.close()
+        except Exception as e:
+            logger.warning(f"Failed to close archive {self.path}: {e}")
+
+
+class ArchivePool:
+    """按 路径+mtime+大小 缓存已打开的压缩包句柄（LRU，线程安全，空闲自动关闭）。"""
+
+    def __init__(self, max_size=ARCHIVE_POOL_SIZE, idle_seconds=ARCHIVE_POOL_IDLE_SECONDS):
+        self.max_size = max(1, max_size)
+        self.idle_seconds = idle_seconds
+        self._entries = OrderedDict()
+        self._keys_by_path = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _make_key(archive_path):
+        path = os.path.abspath(archive_path)
+        st = os.stat(path)
+        return (path, st.st_mtime_ns, st.st_size)
+
+    @contextmanager
+    def acquire(self, archive_path):
+        entry = self._checkout(archive_path)
+        try:
+            yield entry
+        finally:
+            self._release(entry)
+
+    def read(self, archive_path, member):
+        with self.acquire(archive_path) as entry:
+            return entry.read(member)
+
+    def read_head(self, archive_path, member, size):
+        with self.acquire(archive_path) as entry:
+            return entry.read_head(member, size)
+
+    def names(self, archive_path):
+        with self.acquire(archive_path) as entry:
+            return entry.names
+
+    def _checkout(self, archive_path):
+        key = self._make_key(archive_path)
+        to_close = []
+        with self._lock:
+            to_close.extend(self._evict_idle_locked())
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.users += 1
+                entry.last_used = time.monotonic()
+                self.hits += 1
+        self._close_entries(to_close)
+        if entry is not None:
+            return entry
+
+        # 在池锁之外打开压缩包，避免慢速打开阻塞其他读者
+        with span("archive_open"):
+            handle = open_archive(key[0])
+        new_entry = PooledArchive(key[0], key, handle)
+        new_entry.users = 1
+        to_close = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                # 其他线程已抢先打开同一个压缩包
+                entry.users += 1
+                entry.last_used = time.monotonic()
+                self._entries.move_to_end(key)
+                self.hits += 1
+                to_close.append(new_entry)
+            else:
+                self.misses += 1
+                old_key = self._keys_by_path.get(key[0])
+                if old_key is not None and old_key != key:
+                    # 文件已被修改，旧句柄作废
+                    to_close.extend(self._remove_locked(old_key))
+                self._entries[key] = new_entry
+                self._keys_by_path[key[0]] = key
+                entry = new_entry
+                while len(self._entries) > self.max_size:
+                    oldest_key = next(iter(self._entries))
+                    to_close.extend(self._remove_locked(oldest_key))
+        self._close_entries(to_close)
+        return entry
+
+    def _release(self, entry):
+        close_now = False
+        with self._lock:
+            entry.users -= 1
+            entry.last_used = time.monotonic()
+            if entry.evicted and entry.users == 0:
+                close_now = True
+        if close_now:
+            entry.close()
+
+    def _remove_locked(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return []
+        if self._keys_by_path.get(entry.path) == key:
+            del self._keys_by_path[entry.path]
+        entry.evicted = True
+        # 仍在使用中的句柄由最后一个使用者关闭
+        return [entry] if entry.users == 0 else []
+
+    def _evict_idle_locked(self):
+        if self.idle_seconds <= 0:
+            return []
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items()
+                   if entry.users == 0 and now - entry.last_used > self.idle_seconds]
+        closed = []
+        for key in expired:
+            closed.extend(self._remove_locked(key))
+        return closed
+
+    @staticmethod
+    def _close_entries(entries):
+        for entry in entries:
+            entry.close()
+
+    def evict_idle(self):
+        with self._lock:
+            to_close = self._evict_idle_locked()
+        self._close_entries(to_close)
+
+    def invalidate(self, archive_path):
+        path = os.path.abspath(archive_path)
+        with self._lock:
+            key = self._keys_by_path.get(path)
+            to_close = self._remove_locked(key) if key is not None else []
+        self._close_entries(to_close)
+
+    def close_all(self):
+        with self._lock:
+            to_close = []
+            for key in list(self._entries):
+                to_close.extend(self._remove_locked(key))
+        self._close_entries(to_close)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+archive_pool = ArchivePool()
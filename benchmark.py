@@ -0,0 +1,430 @@
+"""性能基准：生成合成漫画库，测量扫描、列表和页面读取的耗时，结果输出为 JSON 便于前后对比。
+
+用法：
+    python benchmark.py --output results.json
+    python benchmark.py --series 20 --chapters 10 --pages 30 --readers 8 --compare baseline.json
+
+默认在临时目录里运行（数据库、缓存、漫画库都在那里），不影响当前目录下的数据。
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+LIBRARY_NAME = "bench"
+
+
+# ---- 合成漫画库 ----
+
+def make_page_templates(width, height, count=4, quality=85):
+    # 只生成少量带噪点的模板图反复使用，避免生成数据本身耗时过长
+    from PIL import Image
+
+    templates = []
+    rng = random.Random(42)
+    for i in range(count):
+        img = Image.effect_noise((width, height), 40 + i * 10).convert("RGB")
+        overlay = Image.new("RGB", (width, height), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        img = Image.blend(img, overlay, 0.3)
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=quality)
+        templates.append(buffer.getvalue())
+    return templates
+
+
+def generate_library(root, series=10, chapters=5, pages=20, nested=True, stored_zips=5, deflated_zips=5,
+                     solid_7z=2, page_width=1200, page_height=1700):
+    """在 root 下生成一个资料库，返回各类漫画的数量统计。"""
+    import py7zr
+
+    templates = make_page_templates(page_width, page_height)
+    os.makedirs(root, exist_ok=True)
+
+    def page_bytes(n):
+        return templates[n % len(templates)]
+
+    for s in range(series):
+        series_dir = os.path.join(root, f"Series {s:03d}")
+        for c in range(chapters):
+            chapter_dir = os.path.join(series_dir, f"Volume {c // 10 + 1}", f"Chapter {c + 1}") if nested \
+                else os.path.join(series_dir, f"Chapter {c + 1}")
+            os.makedirs(chapter_dir, exist_ok=True)
+            for p in range(pages):
+                with open(os.path.join(chapter_dir, f"{p + 1}.jpg"), "wb") as f:
+                    f.write(page_bytes(p))
+
+    for kind, count, compression in (("stored", stored_zips, zipfile.ZIP_STORED),
+                                     ("deflated", deflated_zips, zipfile.ZIP_DEFLATED)):
+        for v in range(count):
+            with zipfile.ZipFile(os.path.join(root, f"{kind} {v:03d}.cbz.zip"), "w", compression) as z:
+                for p in range(pages):
+                    z.writestr(f"{p + 1}.jpg", page_bytes(p))
+
+    for v in range(solid_7z):
+        with py7zr.SevenZipFile(os.path.join(root, f"solid {v:03d}.7z"), "w") as z:
+            for p in range(pages):
+                z.writestr(page_bytes(p), f"{p + 1}.jpg")
+
+    return {
+        "series": series,
+        "chapters_per_series": chapters,
+        "pages_per_volume": pages,
+        "nested": nested,
+        "stored_zips": stored_zips,
+        "deflated_zips": deflated_zips,
+        "solid_7z": solid_7z,
+        "page_size": [page_width, page_height],
+        "page_bytes": len(templates[0]),
+    }
+
+
+# ---- 统计 ----
+
+def summarize(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 3),
+        "p50_ms": round(pct(50) * 1000, 3),
+        "p95_ms": round(pct(95) * 1000, 3),
+        "p99_ms": round(pct(99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+# ---- 本地服务 ----
+
+class LocalServer:
+    """在后台线程里启动 uvicorn，监听随机端口。"""
+
+    def __init__(self, app):
+        import uvicorn
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        config = uvicorn.Config(app, log_level="warning", access_log=False)
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, kwargs={"sockets": [self.sock]}, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.time() + 30
+        while not self.server.started:
+            if time.time() > deadline:
+                raise RuntimeError("uvicorn did not start")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=30)
+
+    def connect(self):
+        return http.client.HTTPConnection("127.0.0.1", self.port, timeout=120)
+
+
+def request(conn, method, path, body=None):
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    start = time.perf_counter()
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = conn.getresponse()
+    data = response.read()
+    elapsed = time.perf_counter() - start
+    if response.status >= 400:
+        raise RuntimeError(f"{method} {path} -> {response.status}: {data[:200]!r}")
+    return data, elapsed
+
+
+def wait_for_job(conn, job_id, timeout=3600):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        data, _ = request(conn, "GET", f"/admin/jobs/{job_id}")
+        job = json.loads(data)
+        if job["status"] not in ("queued", "running"):
+            if job["status"] != "completed":
+                raise RuntimeError(f"Job {job_id} ended with {job['status']}: {job.get('error')}")
+            return job
+        time.sleep(0.02)
+    raise RuntimeError(f"Job {job_id} timed out")
+
+
+def timed_job(conn, method, path, body=None):
+    start = time.perf_counter()
+    data, _ = request(conn, method, path, body)
+    job = wait_for_job(conn, json.loads(data)["job_id"])
+    return {
+        "seconds": round(time.perf_counter() - start, 4),
+        "progress": job["progress"],
+    }
+
+
+# ---- 各项测量 ----
+
+def bench_listing(conn, iterations):
+    full = []
+    paged = []
+    top_level = []
+    for _ in range(iterations):
+        full.append(request(conn, "GET", "/comics")[1])
+        paged.append(request(conn, "GET", "/comics?limit=60&sort=title")[1])
+        top_level.append(request(conn, "GET", "/comics?top_level=true&limit=60")[1])
+    return {"full": summarize(full), "paged_by_title": summarize(paged), "top_level": summarize(top_level)}
+
+
+def bench_contents(conn, comics, iterations):
+    folders = [c for c in comics if not c["is_archive"]]
+    archives = [c for c in comics if c["is_archive"]]
+    result = {}
+    for name, items in (("folder", folders), ("archive", archives)):
+        samples = []
+        for _ in range(iterations):
+            for comic in items[:50]:
+                samples.append(request(conn, "GET", f"/comic/{comic['id']}")[1])
+        result[name] = summarize(samples)
+    return result
+
+
+def collect_volumes(conn, comics):
+    """找出可以直接阅读的卷（压缩包或只含图片的文件夹），返回 (名称, 页面地址列表)。"""
+    volumes = []
+    for comic in comics:
+        data, _ = request(conn, "GET", f"/comic/{comic['id']}")
+        contents = json.loads(data)["contents"]
+        pages = [item["path"] for item in contents if item["type"] == "image"]
+        if pages and not any(item["type"] == "folder" for item in contents):
+            kind = "folder" if not comic["is_archive"] else os.path.splitext(comic["title"])[0].split(" ")[0]
+            # 去掉 http://host 前缀，只保留路径
+            volumes.append((kind, [p.split("://", 1)[-1].split("/", 1)[1] for p in pages]))
+    return volumes
+
+
+def bench_pages(server, volumes, readers, volumes_per_reader, query=""):
+    """多个模拟读者并发顺序翻页，统计吞吐和延迟。"""
+    samples = {}
+    total_bytes = [0]
+    errors = [0]
+    lock = threading.Lock()
+
+    def reader(seed):
+        rng = random.Random(seed)
+        conn = server.connect()
+        try:
+            for _ in range(volumes_per_reader):
+                kind, pages = rng.choice(volumes)
+                for page in pages:
+                    path = "/" + page + query
+                    try:
+                        data, elapsed = request(conn, "GET", path)
+                    except Exception:
+                        with lock:
+                            errors[0] += 1
+                        conn.close()
+                        conn = server.connect()
+                        continue
+                    with lock:
+                        samples.setdefault(kind, []).append(elapsed)
+                        total_bytes[0] += len(data)
+        finally:
+            conn.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    all_samples = [s for values in samples.values() for s in values]
+    return {
+        "readers": readers,
+        "seconds": round(elapsed, 4),
+        "pages": len(all_samples),
+        "errors": errors[0],
+        "pages_per_second": round(len(all_samples) / elapsed, 2) if elapsed else None,
+        "megabytes_per_second": round(total_bytes[0] / elapsed / 1e6, 3) if elapsed else None,
+        "latency": summarize(all_samples),
+        "by_kind": {kind: summarize(values) for kind, values in sorted(samples.items())},
+    }
+
+
+def touch_library(root, count):
+    # 在前几个系列里各加一个新章节，模拟增量更新
+    series_dirs = sorted(d for d in os.listdir(root) if d.startswith("Series "))[:count]
+    template = None
+    for name in series_dirs:
+        chapter_dir = os.path.join(root, name, "Bench Extra Chapter")
+        os.makedirs(chapter_dir, exist_ok=True)
+        if template is None:
+            template = make_page_templates(200, 300, count=1)[0]
+        with open(os.path.join(chapter_dir, "1.jpg"), "wb") as f:
+            f.write(template)
+    return len(series_dirs)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "-C", REPO_DIR, "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="manga-bench-")
+    library_root = os.path.join(workdir, "comics", LIBRARY_NAME)
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": {},
+    }
+    try:
+        start = time.perf_counter()
+        results["meta"]["library"] = generate_library(
+            library_root, series=args.series, chapters=args.chapters, pages=args.pages, nested=not args.flat,
+            stored_zips=args.stored_zips, deflated_zips=args.deflated_zips, solid_7z=args.solid_7z,
+            page_width=args.page_width, page_height=args.page_height)
+        results["meta"]["generate_seconds"] = round(time.perf_counter() - start, 3)
+
+        # 服务的数据库、缓存、静态文件都用相对路径，切到工作目录后再导入
+        static_link = os.path.join(workdir, "static")
+        if not os.path.exists(static_link):
+            os.symlink(os.path.join(REPO_DIR, "static"), static_link)
+        os.chdir(workdir)
+        sys.path.insert(0, REPO_DIR)
+        from comic_main import app
+
+        with LocalServer(app) as server:
+            conn = server.connect()
+            results["results"]["full_scan"] = timed_job(
+                conn, "POST", "/admin/add_library", {"name": LIBRARY_NAME, "folderName": LIBRARY_NAME})
+            results["results"]["rescan_unchanged"] = timed_job(conn, "POST", "/admin/refresh")
+            touched = touch_library(library_root, args.touch)
+            results["results"]["rescan_changed"] = timed_job(conn, "POST", "/admin/refresh")
+            results["results"]["rescan_changed"]["touched_series"] = touched
+
+            comics = json.loads(request(conn, "GET", "/comics")[0])["comics"]
+            results["results"]["comics_total"] = len(comics)
+            results["results"]["listing"] = bench_listing(conn, args.iterations)
+            results["results"]["contents"] = bench_contents(conn, comics, max(1, args.iterations // 10))
+
+            volumes = collect_volumes(conn, comics)
+            results["results"]["volumes"] = len(volumes)
+            # 第一轮是冷缓存（压缩包首次打开、固实压缩包整卷解压），第二轮是热缓存
+            results["results"]["pages_cold"] = bench_pages(server, volumes, args.readers, args.volumes_per_reader)
+            results["results"]["pages_warm"] = bench_pages(server, volumes, args.readers, args.volumes_per_reader)
+            if args.resize:
+                results["results"]["pages_resized"] = bench_pages(
+                    server, volumes, args.readers, args.volumes_per_reader, query=f"?w={args.resize}")
+            conn.close()
+    finally:
+        if not args.workdir and not args.keep:
+            os.chdir(REPO_DIR)
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+# ---- 对比 ----
+
+def flatten(data, prefix=""):
+    items = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            items.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            items[name] = value
+    return items
+
+
+# 越大越好的指标，其余（耗时类）越小越好
+HIGHER_IS_BETTER = ("pages_per_second", "megabytes_per_second")
+
+
+def compare(baseline, current, threshold):
+    """逐项对比两次结果，返回超过阈值的退化项。"""
+    old = flatten(baseline["results"])
+    new = flatten(current["results"])
+    regressions = []
+    for name in sorted(set(old) & set(new)):
+        if not (name.endswith(("_ms", "seconds")) or name.endswith(HIGHER_IS_BETTER)) or not old[name]:
+            continue
+        change = (new[name] - old[name]) / old[name]
+        worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+        marker = "  REGRESSION" if worse > threshold else ""
+        print(f"{name:60s} {old[name]:>12} -> {new[name]:>12} ({change * 100:+.1f}%){marker}")
+        if worse > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manga reader benchmark")
+    parser.add_argument("--series", type=int, default=10, help="number of folder series")
+    parser.add_argument("--chapters", type=int, default=5, help="chapters per series")
+    parser.add_argument("--pages", type=int, default=20, help="pages per chapter/volume")
+    parser.add_argument("--flat", action="store_true", help="put chapters directly under each series")
+    parser.add_argument("--stored-zips", type=int, default=5)
+    parser.add_argument("--deflated-zips", type=int, default=5)
+    parser.add_argument("--solid-7z", type=int, default=2)
+    parser.add_argument("--page-width", type=int, default=1200)
+    parser.add_argument("--page-height", type=int, default=1700)
+    parser.add_argument("--touch", type=int, default=3, help="series to modify before the incremental rescan")
+    parser.add_argument("--iterations", type=int, default=50, help="requests per listing benchmark")
+    parser.add_argument("--readers", type=int, default=4, help="concurrent simulated readers")
+    parser.add_argument("--volumes-per-reader", type=int, default=3)
+    parser.add_argument("--resize", type=int, default=0, help="also benchmark ?w=N resized pages")
+    parser.add_argument("--workdir", help="run in this directory instead of a temporary one (kept afterwards)")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directory")
+    parser.add_argument("--output", help="write JSON results to this file (default: stdout)")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="regression threshold for --compare")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+    results = run(args)
+
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.threshold * 100:.0f}%")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import logging
+import os
+import time
+import uuid
+import zipfile
+from urllib.parse import quote
+
+from archive_index import IMAGE_EXTENSIONS, load_archive_index, load_folder_index
+from archive_pool import archive_pool
+from image_info import sniff_media_type
+from page_cache import solid_page_cache
+
+logger = logging.getLogger("uvicorn.info")
+
+
+def bundle_pages(comic_path, is_archive, start=0, end=None):
+    """取出要打包的页面（按自然顺序），返回 (页面成员列表, stat)。"""
+    loaded = load_archive_index(comic_path) if is_archive else load_folder_index(comic_path)
+    stat = os.stat(comic_path)
+    pages = [m for m in loaded.members if m.name.lower().endswith(IMAGE_EXTENSIONS)]
+    return pages[start:end], stat
+
+
+def _read_stored(f, member):
+    f.seek(member.offset)
+    return f.read(member.file_size)
+
+
+def iter_page_data(comic_path, is_archive, pages):
+    """按顺序产出 (成员, 数据)，整卷只打开一次压缩包。"""
+    if not is_archive:
+        for member in pages:
+            with open(os.path.join(comic_path, member.name), 'rb') as f:
+                yield member, f.read()
+        return
+
+    # 固实压缩包逐页读取要反复从头解压：整卷顺序解压进页面缓存（磁盘），再逐个文件输出，内存里只有当前一页
+    with solid_page_cache.extracted(comic_path) as volume_dir:
+        if volume_dir is not None:
+            for member in pages:
+                page_path = solid_page_cache.page_path(volume_dir, member.name)
+                if page_path is None:
+                    raise FileNotFoundError(f"{member.name} missing from extracted {comic_path}")
+                with open(page_path, 'rb') as f:
+                    yield member, f.read()
+            return
+
+    with archive_pool.acquire(comic_path) as archive, open(comic_path, 'rb') as raw:
+        for member in pages:
+            if comic_path.lower().endswith('.zip') and member.method == zipfile.ZIP_STORED:
+                # 未压缩的成员直接按偏移读取，不经过 zipfile
+                yield member, _read_stored(raw, member)
+            else:
+                yield member, archive.read(member.name)
+
+
+class _ChunkBuffer:
+    # zipfile 写入不可 seek 的流时会改用数据描述符，这里把写出的字节攒起来逐段交给响应
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_zip_bundle(comic_path, is_archive, pages, first_index=0):
+    """把页面重新打包成不压缩的 ZIP 流，边读边输出。"""
+    buffer = _ChunkBuffer()
+    date_time = time.localtime(time.time())[:6]
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as bundle:
+        for index, (member, data) in enumerate(iter_page_data(comic_path, is_archive, pages), first_index):
+            # 用序号前缀保证解包后的文件名顺序与阅读顺序一致
+            info = zipfile.ZipInfo(f"{index:04d}_{os.path.basename(member.name)}", date_time=date_time)
+            info.compress_type = zipfile.ZIP_STORED
+            bundle.writestr(info, data)
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def multipart_boundary():
+    return f"manga-{uuid.uuid4().hex}"
+
+
+def iter_multipart_bundle(comic_path, is_archive, pages, boundary, page_url_prefix, first_index=0):
+    """multipart/mixed 流：每页一个分段，带类型、长度、原始地址和在整卷中的页码。"""
+    for index, (member, data) in enumerate(iter_page_data(comic_path, is_archive, pages), first_index):
+        headers = (
+            f"--{boundary}\r\n"
+            f"Content-Type: {sniff_media_type(data, member.name)}\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Content-Location: {page_url_prefix}{quote(member.name)}\r\n"
+            f"X-Page-Index: {index}\r\n"
+            f"\r\n"
+        )
+        yield headers.encode("utf-8") + data + b"\r\n"
+    yield f"--{boundary}--\r\n".encode("utf-8")
@@ -0,0 +1,383 @@
+import base64
+import bisect
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from config import CATALOG_SNAPSHOT
+from coordination import read_catalog_version
+from database import Library, Comic
+
+logger = logging.getLogger("uvicorn.info")
+
+SNAPSHOT_FORMAT = 1
+
+# 每本漫画在内存中只保留这些字段，缩略图地址预先拼好（相对路径）
+CatalogEntry = namedtuple("CatalogEntry", ["id", "title", "library_id", "parent_id", "is_archive", "thumbnail"])
+LibraryEntry = namedtuple("LibraryEntry", ["id", "name", "path"])
+
+
+def make_entry(comic_id, title, library_id, parent_id, is_archive):
+    return CatalogEntry(comic_id, title, library_id, parent_id, bool(is_archive), f"/thumbnail/{comic_id}")
+
+
+def entry_payload(entry, base_url):
+    return {
+        "id": entry.id,
+        "title": entry.title,
+        "library_id": entry.library_id,
+        "parent_id": entry.parent_id,
+        "thumbnail": f"{base_url}{entry.thumbnail}",
+        "is_archive": entry.is_archive
+    }
+
+
+def encode_cursor(sort, order, key):
+    raw = json.dumps([sort, order, list(key)], ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+# 各排序方式的排序键类型，与 Catalog._sort_key 一致
+CURSOR_KEY_TYPES = {
+    "title": (str, int),
+    "recent": (float, int),
+    "added": (int,),
+}
+
+
+def _cursor_value(value, expected):
+    # bool 是 int 的子类；JSON 里整数形式的时间戳按浮点数处理
+    if isinstance(value, bool):
+        raise ValueError("Invalid cursor")
+    if expected is float and isinstance(value, int):
+        return float(value)
+    if not isinstance(value, expected):
+        raise ValueError("Invalid cursor")
+    return value
+
+
+def decode_cursor(cursor, sort, order):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, cursor_order, key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        types = CURSOR_KEY_TYPES.get(cursor_sort)
+        if types is None or not isinstance(key, list) or len(key) != len(types):
+            raise ValueError("Invalid cursor")
+        key = tuple(_cursor_value(value, expected) for value, expected in zip(key, types))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort or cursor_order != order:
+        raise ValueError("Cursor does not match sort order")
+    return key
+
+
+class Catalog:
+    """进程内的漫画目录：启动时构建一次，之后由扫描结果增量更新，并保存二进制快照以便快速启动。"""
+
+    def __init__(self, snapshot_path=CATALOG_SNAPSHOT):
+        self.snapshot_path = snapshot_path
+        self.entries = {}
+        self.libraries = {}
+        # 资料库名称到根目录，文件路由据此解析，不查数据库
+        self.library_roots = {}
+        self.by_library = {}
+        self.children = {}
+        self.version = 0
+        # 数据库 catalog_state 里的共享版本，本进程的目录已同步到该版本
+        self.shared_version = None
+        self.loaded = False
+        self.last_opened = {}
+        self.activity_version = 0
+        # 最近一次打开的时间；阅读进度在各工作进程间同步，用它作 recent 排序的 ETag 成分
+        self.last_activity = 0.0
+        self._lock = threading.RLock()
+        self._payload_cache = {}
+        self._sorted_cache = {}
+
+    # ---- 构建与快照 ----
+
+    def build(self, db: Session, save=True):
+        rows = db.query(Comic.id, Comic.title, Comic.library_id, Comic.parent_id, Comic.is_archive).all()
+        libraries = db.query(Library.id, Library.name, Library.path).all()
+        with self._lock:
+            self._replace([make_entry(*row) for row in rows], [LibraryEntry(*row) for row in libraries])
+        logger.info(f"Built comic catalog with {len(rows)} comics and {len(libraries)} libraries")
+        if save:
+            self.save_snapshot(db)
+
+    def _replace(self, entries, libraries):
+        self.entries = {e.id: e for e in entries}
+        self.libraries = {lib.id: lib for lib in libraries}
+        self._index_libraries_locked()
+        self.by_library = {}
+        self.children = {}
+        for entry in sorted(self.entries.values(), key=lambda e: e.id):
+            self.by_library.setdefault(entry.library_id, []).append(entry.id)
+            self.children.setdefault(entry.parent_id, []).append(entry.id)
+        self.loaded = True
+        self._bump()
+
+    def _index_libraries_locked(self):
+        # 整体替换字典，读取方不加锁也不会看到修改到一半的映射
+        self.library_roots = {lib.name: lib.path for lib in self.libraries.values()}
+
+    def _bump(self):
+        self.version += 1
+        self._payload_cache.clear()
+        self._sorted_cache.clear()
+
+    @staticmethod
+    def _fingerprint(db: Session, version):
+        # version 为共享目录版本：改名、移动等不改变数量的改动也会让旧快照失效
+        count, max_id = db.query(func.count(Comic.id), func.max(Comic.id)).one()
+        libraries = sorted(tuple(row) for row in db.query(Library.id, Library.name, Library.path))
+        return version, count, max_id, libraries
+
+    def load_snapshot(self, db: Session):
+        if not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                data = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to read catalog snapshot {self.snapshot_path}: {e}")
+            return False
+        if data.get("format") != SNAPSHOT_FORMAT or data.get("fingerprint") != self._fingerprint(db, read_catalog_version(db)):
+            logger.info("Catalog snapshot is stale, rebuilding from database")
+            return False
+        with self._lock:
+            self._replace([CatalogEntry(*row) for row in data["comics"]],
+                          [LibraryEntry(*row) for row in data["libraries"]])
+        logger.info(f"Loaded comic catalog snapshot with {len(self.entries)} comics")
+        return True
+
+    def load_or_build(self, db: Session):
+        # 先记下共享版本再加载，加载期间其他进程的改动会在下一次 sync 时补上
+        version = read_catalog_version(db)
+        with self._lock:
+            self.shared_version = version
+        if not self.load_snapshot(db):
+            self.build(db)
+
+    def note_version(self, old, new):
+        # 本进程提交了一次变化：此前已同步到 old 时直接记为 new，否则留给 sync 从数据库重建
+        with self._lock:
+            if self.shared_version == old:
+                self.shared_version = new
+
+    def sync(self, db: Session):
+        """共享版本变化（其他进程改动过漫画或资料库）时从数据库重建，返回是否重建。"""
+        version = read_catalog_version(db)
+        if version == self.shared_version:
+            return False
+        self.build(db, save=False)
+        self.shared_version = version
+        return True
+
+    def save_snapshot(self, db: Session):
+        with self._lock:
+            data = {
+                "format": SNAPSHOT_FORMAT,
+                # 用内存目录对应的版本而不是数据库当前版本，其他进程刚提交的改动不会被记进快照
+                "fingerprint": self._fingerprint(db, self.shared_version),
+                "comics": [tuple(e) for e in self.entries.values()],
+                "libraries": [tuple(lib) for lib in self.libraries.values()],
+            }
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 先写临时文件再原子替换，避免读到写了一半的快照
+        temp_path = f"{self.snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.snapshot_path)
+        except OSError as e:
+            logger.warning(f"Failed to write catalog snapshot {self.snapshot_path}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    # ---- 增量更新 ----
+
+    def _insert_locked(self, entry):
+        old = self.entries.get(entry.id)
+        if old is not None:
+            self._remove_locked(entry.id)
+        self.entries[entry.id] = entry
+        bisect.insort(self.by_library.setdefault(entry.library_id, []), entry.id)
+        bisect.insort(self.children.setdefault(entry.parent_id, []), entry.id)
+
+    def _remove_locked(self, comic_id):
+        entry = self.entries.pop(comic_id, None)
+        if entry is None:
+            return
+        for index, key in ((self.by_library, entry.library_id), (self.children, entry.parent_id)):
+            ids = index.get(key)
+            if ids:
+                pos = bisect.bisect_left(ids, comic_id)
+                if pos < len(ids) and ids[pos] == comic_id:
+                    del ids[pos]
+                if not ids:
+                    del index[key]
+
+    def add_comic(self, comic):
+        with self._lock:
+            self._insert_locked(make_entry(comic.id, comic.title, comic.library_id, comic.parent_id, comic.is_archive))
+            self._bump()
+
+    def apply_scan(self, result):
+        # result 为 scanner.ScanResult，只处理有变化的记录
+        if not (result.added or result.updated or result.removed_ids):
+            return False
+        with self._lock:
+            for comic_id in result.removed_ids:
+                self._remove_locked(comic_id)
+            for c in list(result.added) + list(result.updated):
+                self._insert_locked(make_entry(c.id, c.title, c.library_id, c.parent_id, c.is_archive))
+            self._bump()
+        return True
+
+    def set_libraries(self, db: Session):
+        libraries = db.query(Library.id, Library.name, Library.path).all()
+        with self._lock:
+            self.libraries = {row.id: LibraryEntry(*row) for row in libraries}
+            self._index_libraries_locked()
+            for library_id in [k for k in self.by_library if k not in self.libraries]:
+                for comic_id in list(self.by_library.get(library_id, ())):
+                    self._remove_locked(comic_id)
+            self._bump()
+
+    def remove_library(self, library_id):
+        with self._lock:
+            self.libraries.pop(library_id, None)
+            self._index_libraries_locked()
+            for comic_id in list(self.by_library.get(library_id, ())):
+                self._remove_locked(comic_id)
+            self._bump()
+
+    # ---- 查询 ----
+
+    def get(self, comic_id):
+        return self.entries.get(comic_id)
+
+    def library_name(self, library_id):
+        library = self.libraries.get(library_id)
+        return library.name if library else None
+
+    def library_root(self, name):
+        return self.library_roots.get(name)
+
+    def siblings(self, comic_id, parent_id):
+        """同一父目录下按 id 相邻的前一本和后一本。"""
+        with self._lock:
+            ids = self.children.get(parent_id, ())
+            pos = bisect.bisect_left(ids, comic_id)
+            prev_id = ids[pos - 1] if pos > 0 else None
+            if pos < len(ids) and ids[pos] == comic_id:
+                pos += 1
+            next_id = ids[pos] if pos < len(ids) else None
+            return prev_id, next_id
+
+    def mark_opened(self, comic_id, at=None):
+        # 记录最近打开时间，用于“最近阅读”排序；上层文件夹一起更新，只影响 recent 排序的缓存
+        at = time.time() if at is None else at
+        with self._lock:
+            while comic_id is not None:
+                if self.last_opened.get(comic_id, 0.0) < at:
+                    self.last_opened[comic_id] = at
+                entry = self.entries.get(comic_id)
+                comic_id = entry.parent_id if entry is not None else None
+            self.activity_version += 1
+            self.last_activity = max(self.last_activity, at)
+            for key in [k for k in self._sorted_cache if k[1] == "recent"]:
+                del self._sorted_cache[key]
+
+    def _sort_key(self, sort, entry):
+        if sort == "title":
+            return (entry.title.casefold(), entry.id)
+        if sort == "recent":
+            return (self.last_opened.get(entry.id, 0.0), entry.id)
+        return (entry.id,)
+
+    def _sorted(self, sort, library_id, parent_id, top_level):
+        key = (self.version, sort, library_id, parent_id, top_level)
+        cached = self._sorted_cache.get(key)
+        if cached is not None:
+            return cached
+        if parent_id is not None:
+            candidates = (self.entries[i] for i in self.children.get(parent_id, ()))
+        elif library_id is not None:
+            candidates = (self.entries[i] for i in self.by_library.get(library_id, ()))
+        else:
+            candidates = self.entries.values()
+        selected = [e for e in candidates
+                    if (library_id is None or e.library_id == library_id)
+                    and (not top_level or e.parent_id is None)]
+        keyed = sorted((self._sort_key(sort, e), e) for e in selected)
+        cached = ([k for k, _ in keyed], [e for _, e in keyed])
+        # 只保留少量排序结果，目录版本变化时整体失效
+        if len(self._sorted_cache) >= 32:
+            self._sorted_cache.clear()
+        self._sorted_cache[key] = cached
+        return cached
+
+    def etag_version(self, sort):
+        # 用数据库里的共享版本而不是本进程的计数，多个工作进程对同一内容给出同一个 ETag
+        with self._lock:
+            if sort == "recent":
+                return f"{self.shared_version}.{self.last_activity!r}"
+            return str(self.shared_version)
+
+    def query(self, sort="added", order="asc", library_id=None, parent_id=None,
+              top_level=False, cursor=None, limit=None):
+        """按条件筛选排序后分页，返回 (本页记录, 下一页游标, 总数)。游标记录上一页最后一条的排序键。"""
+        with self._lock:
+            keys, entries = self._sorted(sort, library_id, parent_id, top_level)
+            total = len(entries)
+            after = decode_cursor(cursor, sort, order) if cursor else None
+            if order == "desc":
+                end = bisect.bisect_left(keys, after) if after is not None else total
+                start = 0 if limit is None else max(0, end - limit)
+                page = entries[start:end][::-1]
+                has_more = start > 0
+            else:
+                start = bisect.bisect_right(keys, after) if after is not None else 0
+                end = total if limit is None else min(total, start + limit)
+                page = entries[start:end]
+                has_more = end < total
+            next_cursor = encode_cursor(sort, order, self._sort_key(sort, page[-1])) if page and has_more else None
+            return page, next_cursor, total
+
+    def libraries_payload(self):
+        with self._lock:
+            return [{"id": lib.id, "name": lib.name, "path": lib.path}
+                    for lib in sorted(self.libraries.values(), key=lambda lib: lib.id)]
+
+    def comics_payload(self, base_url):
+        # 同一版本的目录只序列化一次
+        with self._lock:
+            key = (self.version, base_url)
+            payload = self._payload_cache.get(key)
+            if payload is None:
+                comics = [entry_payload(e, base_url) for e in sorted(self.entries.values(), key=lambda e: e.id)]
+                payload = {"comics": comics, "libraries": self.libraries_payload()}
+                self._payload_cache = {key: payload}
+            return payload
+
+    def stats(self):
+        with self._lock:
+            return {
+                "version": self.version,
+                "comics": len(self.entries),
+                "libraries": len(self.libraries),
+            }
+
+
+catalog = Catalog()
@@ -1,30 +1,59 @@
 from fastapi import FastAPI, HTTPException, Request, Depends
-from fastapi.responses import RedirectResponse, FileResponse, JSONResponse, Response
+from fastapi.responses import RedirectResponse, FileResponse, JSONResponse, Response, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
-from pathlib import Path as PathLib
 import uvicorn
 import logging
 import os
 import time
-from database import get_db, Library, Comic, Base, engine, get_comic
-from pydantic import BaseModel
+from database import get_db, SessionLocal, Library, Comic, ScanDirectory, ArchiveIndexRecord, Base, engine, get_comic
+from archive_pool import archive_pool
+from page_cache import solid_page_cache
+from responses import (range_file_response, file_slice_response, etag_matches, not_modified_response,
+                       cache_headers, is_not_modified)
+from image_info import sniff_media_type, sniff_file_media_type
+from thumbnails import thumbnail_store
+from archive_index import (is_archive, get_archive_contents, get_archive_member, member_etag,
+                           remove_archive_indexes_under, ArchiveIndexError)
+from scanner import scan_library
+from archive_indexer import archive_indexer
+from watcher import library_watcher
+from jobs import job_manager
+from catalog import catalog, entry_payload
+from folder_listing import folder_listing_cache
+from file_stat_cache import file_stat_cache
+from prefetch import read_ahead
+from transcode import derived_images, parse_transform, TranscodeBusy
+from metrics import registry, cache_samples, install_sql_timing, RequestTimer
+from config import LOG_LEVEL, WATCH_ENABLED, PROGRESS_WARM_PAGES
+from coordination import FileLock, bump_catalog_version, worker_coordinator
+from archive_index import index_cache
+from manifest import ensure_archive_dimensions, build_manifest, folder_manifest_source
+from bundle import bundle_pages, iter_zip_bundle, iter_multipart_bundle, multipart_boundary
+from search_index import ensure_search_index, index_comics, remove_orphans as remove_search_orphans, search
+from progress import progress_store, remove_orphans as remove_progress_orphans
+from migrations import run_migrations
+from executors import decompress_executor, metadata_executor, executor_stats, shutdown_executors
+from pydantic import BaseModel, Field
 from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
 from urllib.parse import unquote, quote
-from fastapi import Path
+from fastapi import Path, Query
+from typing import Optional
+import hashlib
 import zipfile
 import rarfile
 from io import BytesIO
-from sqlalchemy import inspect, Boolean
 from sqlalchemy import text as sa_text
 import py7zr
 from py7zr import SevenZipFile
-import json
 import os
-from datetime import datetime, timedelta
 
 app = FastAPI()
 logger = logging.getLogger("uvicorn.info")
+logger.setLevel(LOG_LEVEL)
+app.add_middleware(RequestTimer)
+install_sql_timing(engine)
 
 # 设置静态文件路径
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -50,6 +79,10 @@ async def admin_page():
 @app.get("/reader/{comic_id}")
 @app.get("/reader/{comic_id}/{subfolder:path}")
 async def reader_page(comic_id: int, subfolder: str = "", db: Session = Depends(get_db)):
+    await metadata_executor.run(resolve_reader_comic, db, comic_id, subfolder)
+    return FileResponse('static/reader.html')
+
+def resolve_reader_comic(db: Session, comic_id: int, subfolder: str):
     comic = db.query(Comic).filter(Comic.id == comic_id).first()
     if not comic:
         raise HTTPException(status_code=404, detail="Comic not found")
@@ -63,22 +96,33 @@ async def reader_page(comic_id: int, subfolder: str = "", db: Session = Depends(
         # 查找或创建子文件夹对应的 Comic 记录
         sub_comic = db.query(Comic).filter(Comic.path == subfolder_path).first()
         if not sub_comic:
-            sub_comic = Comic(title=os.path.basename(subfolder_path), path=subfolder_path, library_id=comic.library_id, parent_id=comic.id)
-            db.add(sub_comic)
-            db.commit()
+            # 标题与扫描器一致，使用相对资料库根目录的路径
+            sub_title = os.path.normpath(os.path.join(comic.title, subfolder))
+            sub_comic = Comic(title=sub_title, path=subfolder_path, library_id=comic.library_id, parent_id=comic.id)
+            try:
+                db.add(sub_comic)
+                db.flush()
+                index_comics(db, [sub_comic])
+                commit_catalog_change(db)
+                catalog.add_comic(sub_comic)
+            except IntegrityError:
+                # 扫描任务同时插入了同一条记录
+                db.rollback()
+                sub_comic = db.query(Comic).filter(Comic.library_id == comic.library_id,
+                                                   Comic.title == sub_title).first()
+                if sub_comic is None:
+                    raise
         
         comic_id = sub_comic.id
     
-    return FileResponse('static/reader.html')
+    return comic_id
 
 class LibraryCreate(BaseModel):
     name: str
     folderName: str
 
-@app.post("/admin/add_library")
-async def add_library(library: LibraryCreate, db: Session = Depends(get_db)):
-    logger.info(f"Received request to add library: {library.name} with folder {library.folderName}")
-    
+def create_library(db: Session, library: LibraryCreate):
+    # 在线程池里运行：建目录、写库和提交都可能阻塞（扫描任务持有写锁时最多等 DB_BUSY_TIMEOUT）
     base_path = "./comics"  # 确保这个路径是正确的
     full_path = os.path.normpath(os.path.join(base_path, library.folderName))
     
@@ -112,132 +156,333 @@ async def add_library(library: LibraryCreate, db: Session = Depends(get_db)):
     
     db_library = Library(name=library.name, path=full_path)
     db.add(db_library)
-    db.commit()
+    db.flush()
+    commit_catalog_change(db)
     db.refresh(db_library)
+    # 文件路由 /comics/{library_name}/... 按数据库里的资料库解析，所有工作进程都能立即访问，不再单独挂载
+    catalog.set_libraries(db)
     
-    # 立即更新漫画数据库
-    update_comics_db(db, db_library)
-    
-    # 为新添加的库挂载静态文件路径
-    try:
-        app.mount(f"/comics/{library.name}", StaticFiles(directory=full_path), name=f"comics_{library.name}")
-        logger.info(f"Mounted new comic folder: {library.name} at {full_path}")
-    except Exception as e:
-        logger.error(f"Failed to mount new comic folder: {library.name} at {full_path}. Error: {str(e)}")
-        # 如果挂载失败，从数据库中删除这个库
-        db.delete(db_library)
-        db.commit()
-        raise HTTPException(status_code=500, detail="Failed to mount comic folder")
-    
-    # 在成功添加库后刷新数据库和缓存
-    await refresh_database_and_cache(db)
+    # 扫描放到后台任务里执行，接口立即返回任务 id
+    job = job_manager.submit("scan_library", run_refresh_job, library_id=db_library.id)
+    sync_watched_libraries()
     
     logger.info(f"Successfully added library: {library.name} at {full_path}")
-    return {"status": "success", "message": "Library added successfully"}
+    return job
 
-@app.get("/admin/libraries")
-async def get_libraries(db: Session = Depends(get_db)):
+@app.post("/admin/add_library")
+async def add_library(library: LibraryCreate, db: Session = Depends(get_db)):
+    logger.info(f"Received request to add library: {library.name} with folder {library.folderName}")
+    job = await metadata_executor.run(create_library, db, library)
+    return {"status": "success", "message": "Library added successfully", "job_id": job.id}
+
+def list_libraries(db: Session):
     libraries = db.query(Library).all()
     return [{"id": lib.id, "name": lib.name, "path": lib.path} for lib in libraries]
 
-CACHE_FILE = 'comic_cache.json'
-CACHE_DURATION = timedelta(hours=1)  # 缓存有效期为1小时
-
-def get_cached_comics():
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, 'r') as f:
-            cache_data = json.load(f)
-        if datetime.now() - datetime.fromisoformat(cache_data['timestamp']) < CACHE_DURATION:
-            return cache_data['comics']
-    return None
-
-def set_cached_comics(comics):
-    cache_data = {
-        'timestamp': datetime.now().isoformat(),
-        'comics': comics
-    }
-    with open(CACHE_FILE, 'w') as f:
-        json.dump(cache_data, f)
+@app.get("/admin/libraries")
+async def get_libraries(db: Session = Depends(get_db)):
+    return await metadata_executor.run(list_libraries, db)
 
 @app.get("/comics")
-async def get_comics_list(request: Request, db: Session = Depends(get_db)):
-    cached_comics = get_cached_comics()
-    if cached_comics:
-        return JSONResponse(content={"comics": cached_comics})
+async def get_comics_list(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    library_id: Optional[int] = None,
+    parent_id: Optional[int] = None,
+    top_level: bool = False,
+    sort: str = Query("added", regex="^(title|added|recent)$"),
+    order: str = Query("asc", regex="^(asc|desc)$"),
+):
+    base_url = str(request.base_url).rstrip('/')
+    # ETag 由目录版本号和查询参数决定，目录没变时直接返回 304
+    etag_source = f"{catalog.etag_version(sort)}|{base_url}|{request.url.query}"
+    etag = f'"{hashlib.sha1(etag_source.encode("utf-8")).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return not_modified_response(etag, headers)
 
-    comics = db.query(Comic).all()
-    libraries = db.query(Library).all()
-    
+    # 不带任何参数时保持原来的行为，由内存目录一次返回全部漫画
+    if limit is None and cursor is None and library_id is None and parent_id is None \
+            and not top_level and sort == "added" and order == "asc":
+        return JSONResponse(content=catalog.comics_payload(base_url), headers=headers)
+
+    try:
+        page, next_cursor, total = catalog.query(sort=sort, order=order, library_id=library_id,
+                                                 parent_id=parent_id, top_level=top_level,
+                                                 cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(content={
+        "comics": [entry_payload(e, base_url) for e in page],
+        "libraries": catalog.libraries_payload(),
+        "total": total,
+        "next_cursor": next_cursor
+    }, headers=headers)
+
+class ProgressUpdate(BaseModel):
+    page: int = Field(..., ge=0)
+    page_count: Optional[int] = Field(None, ge=1)
+
+def progress_payload(comic_id, record):
+    return {
+        "comic_id": comic_id,
+        "page": record.page if record else 0,
+        "page_count": record.page_count if record else None,
+        "updated_at": record.updated_at if record else None
+    }
+
+@app.post("/comic/{comic_id}/progress")
+async def save_progress(comic_id: int, update: ProgressUpdate):
+    # 阅读器每次翻页调用：只更新内存，由后台线程批量写库
+    entry = catalog.get(comic_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Comic not found")
+    record = progress_store.record(comic_id, update.page, update.page_count)
+    catalog.mark_opened(comic_id, record.updated_at)
+    if update.page_count and update.page >= update.page_count - PROGRESS_WARM_PAGES:
+        # 快读完了，提前准备同一文件夹里的下一卷
+        read_ahead.warm_next(comic_id, entry.parent_id)
+    return progress_payload(comic_id, record)
+
+@app.get("/comic/{comic_id}/progress")
+async def get_progress(comic_id: int):
+    if catalog.get(comic_id) is None:
+        raise HTTPException(status_code=404, detail="Comic not found")
+    return progress_payload(comic_id, progress_store.get(comic_id))
+
+@app.get("/continue")
+async def continue_reading(request: Request, limit: int = Query(20, ge=1, le=200)):
     base_url = str(request.base_url).rstrip('/')
-    comic_list = []
-    for c in comics:
-        thumbnail = None
-        comic_path = PathLib(c.path)
-        if c.is_archive:
-            # 处理压缩文件
-            archive_contents = get_archive_contents(c.path)
-            image_files = [f for f in archive_contents if f.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp'))]
-            if image_files:
-                first_image = sorted(image_files)[0]
-                thumbnail = f"{base_url}/comic_image/{c.id}/{quote(first_image)}"
-        elif comic_path.exists() and comic_path.is_dir():
-            # 处理普通目录
-            image_files = [f for f in comic_path.iterdir() if f.suffix.lower() in ['.jpg', '.jpeg', '.png', '.gif', '.webp']]
-            if image_files:
-                first_image = sorted(image_files)[0]
-                thumbnail = f"{base_url}/comics/{c.library.name}/{c.title}/{first_image.name}"
-        
-        comic_list.append({
-            "id": c.id,
-            "title": c.title,
-            "library_id": c.library_id,
-            "thumbnail": thumbnail,
-            "is_archive": c.is_archive
-        })
-    
-    set_cached_comics(comic_list)
-    
-    library_list = [{"id": l.id, "name": l.name, "path": l.path} for l in libraries]
-    
-    logger.info(f"Retrieved {len(comics)} comics and {len(libraries)} libraries")
-    
+    return {"comics": build_continue_feed(base_url, limit)}
+
+def is_finished(record):
+    return bool(record.page_count) and record.page >= record.page_count - 1
+
+def build_continue_feed(base_url, limit):
+    """继续阅读列表：按最近阅读排序，每个文件夹取一本——优先最近读过但没读完的，都读完时换成最近读完那本的下一本。"""
+    # 按分组收集进度，字典保持插入顺序，即各组最近一次阅读的先后
+    groups = {}
+    for record in progress_store.recent():
+        entry = catalog.get(record.comic_id)
+        if entry is None:
+            continue
+        group = ("folder", entry.parent_id) if entry.parent_id is not None else ("comic", entry.id)
+        groups.setdefault(group, []).append((record, entry))
+
+    items = []
+    for records in groups.values():
+        unfinished = next(((r, e) for r, e in records if not is_finished(r)), None)
+        if unfinished is not None:
+            record, entry = unfinished
+            current = record
+        else:
+            record, entry = records[0]
+            _, next_id = catalog.siblings(entry.id, entry.parent_id)
+            next_entry = catalog.get(next_id) if next_id is not None else None
+            if next_entry is None or next_entry.library_id != entry.library_id:
+                # 这一系列已经读完
+                continue
+            entry = next_entry
+            current = progress_store.get(entry.id)
+        item = entry_payload(entry, base_url)
+        item.update(progress_payload(entry.id, current))
+        item["last_read_at"] = record.updated_at
+        item["reader_url"] = f"{base_url}/reader/{entry.id}?page={item['page']}"
+        items.append(item)
+        if len(items) >= limit:
+            break
+    return items
+
+@app.get("/search")
+async def search_comics(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=200),
+    library_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    base_url = str(request.base_url).rstrip('/')
+    results = await metadata_executor.run(search, db, catalog, q, limit, library_id)
     return JSONResponse(content={
-        "comics": comic_list,
-        "libraries": library_list
+        "query": q,
+        "results": [entry_payload(e, base_url) for e in results]
     })
 
+@registry.register_collector
+def collect_runtime_metrics():
+    # 抓取时读取各组件已有的统计数据
+    samples = []
+    pool = archive_pool.stats()
+    samples += cache_samples("archive_pool", {"entries": pool["open"], "hits": pool["hits"], "misses": pool["misses"]})
+    samples += cache_samples("archive_index", index_cache.stats())
+    samples += cache_samples("folder_listing", folder_listing_cache.stats())
+    samples += cache_samples("file_stat", file_stat_cache.stats())
+    samples += cache_samples("solid_pages", solid_page_cache.stats())
+    samples += cache_samples("thumbnails", thumbnail_store.cache.stats())
+    samples += cache_samples("derived_images", derived_images.stats())
+    prefetch = read_ahead.stats()
+    samples += cache_samples("prefetch", prefetch["cache"])
+    samples.append(("manga_prefetch_pages_total", "counter", "Pages decoded ahead of the reader",
+                    [({}, prefetch["pages_prefetched"])]))
+    samples.append(("manga_transcode_rejected_total", "counter", "Conversions rejected because the queue was full",
+                    [({}, derived_images.stats()["rejected"])]))
+    for name, stats in executor_stats().items():
+        labels = {"executor": name}
+        samples.append(("manga_executor_queued", "gauge", "Tasks waiting in the executor", [(labels, stats["queued"])]))
+        samples.append(("manga_executor_active", "gauge", "Tasks running in the executor", [(labels, stats["active"])]))
+        samples.append(("manga_executor_completed_total", "counter", "Tasks finished by the executor",
+                        [(labels, stats["completed"])]))
+    progress = progress_store.stats()
+    samples.append(("manga_progress_pending", "gauge", "Reading progress updates waiting to be written",
+                    [({}, progress["pending"])]))
+    samples.append(("manga_progress_rows_written_total", "counter", "Reading progress rows written to the database",
+                    [({}, progress["rows_written"])]))
+    catalog_stats = catalog.stats()
+    samples.append(("manga_catalog_comics", "gauge", "Comics in the in-memory catalog", [({}, catalog_stats["comics"])]))
+    samples.append(("manga_catalog_version", "gauge", "Catalog version", [({}, catalog_stats["version"])]))
+    job_counts = {}
+    for job in job_manager.list():
+        job_counts[job.status] = job_counts.get(job.status, 0) + 1
+    samples.append(("manga_jobs", "gauge", "Background jobs by status",
+                    [({"status": status}, count) for status, count in job_counts.items()]))
+    return samples
+
+@app.get("/metrics")
+async def get_metrics():
+    content = await metadata_executor.run(registry.render)
+    return PlainTextResponse(content, media_type="text/plain; version=0.0.4")
+
+@app.get("/thumbnail/{comic_id}")
+async def get_thumbnail(comic_id: int, db: Session = Depends(get_db)):
+    comic = await metadata_executor.run(get_comic, db, comic_id)
+    if not comic:
+        raise HTTPException(status_code=404, detail="Comic not found")
+
+    thumbnail_path = await thumbnail_store.get_or_create(comic.path, comic.is_archive)
+    if not thumbnail_path:
+        return await get_default_thumbnail()
+    return FileResponse(thumbnail_path, media_type=thumbnail_store.media_type,
+                        headers={"Cache-Control": "public, max-age=86400"})
+
+@app.get("/comic/{comic_id}/manifest")
+async def get_comic_manifest(comic_id: int, request: Request, db: Session = Depends(get_db)):
+    base_url = str(request.base_url).rstrip('/')
+    comic = await metadata_executor.run(get_comic, db, comic_id)
+    if not comic:
+        raise HTTPException(status_code=404, detail="Comic not found")
+
+    try:
+        if comic.is_archive:
+            # 补算尺寸可能需要解压，放到解压线程池
+            loaded, complete, stat = await decompress_executor.run(ensure_archive_dimensions, comic.path)
+            prefix = f"{base_url}/comic_image/{comic.id}/"
+        else:
+            loaded, stat = await metadata_executor.run(folder_manifest_source, comic.path)
+            complete = True
+            library_name = catalog.library_name(comic.library_id) or comic.library.name
+            prefix = f"{base_url}/comics/{quote(library_name)}/{quote(comic.title)}/"
+    except OSError:
+        raise HTTPException(status_code=404, detail=f"Item not found: {comic.path}")
+    except Exception as e:
+        logger.error(f"Failed to build manifest for {comic.path}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to read comic: {str(e)}")
+
+    etag_source = f"{comic.id}|{comic.title}|{stat.st_mtime_ns}|{stat.st_size}|{complete}|{prefix}"
+    etag = f'"{hashlib.sha1(etag_source.encode("utf-8")).hexdigest()}"'
+    # 尺寸还没补齐时不让浏览器缓存，之后再取会拿到完整清单
+    headers = {"ETag": etag, "Cache-Control": "no-cache" if complete else "no-store"}
+    if etag_matches(request, etag):
+        return not_modified_response(etag, headers)
+    content = build_manifest(comic.id, comic.title, loaded.members, prefix, complete)
+    return JSONResponse(content=content, headers=headers)
+
+@app.get("/comic/{comic_id}/bundle")
+async def get_comic_bundle(
+    comic_id: int,
+    request: Request,
+    start: int = Query(0, ge=0),
+    end: Optional[int] = Query(None, ge=1),
+    fmt: str = Query("zip", alias="format", regex="^(zip|multipart)$"),
+    db: Session = Depends(get_db)
+):
+    base_url = str(request.base_url).rstrip('/')
+    comic = await metadata_executor.run(get_comic, db, comic_id)
+    if not comic:
+        raise HTTPException(status_code=404, detail="Comic not found")
+    try:
+        pages, stat = await metadata_executor.run(bundle_pages, comic.path, comic.is_archive, start, end)
+    except OSError:
+        raise HTTPException(status_code=404, detail=f"Item not found: {comic.path}")
+    except Exception as e:
+        logger.error(f"Failed to read comic {comic.path}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to read comic: {str(e)}")
+    if not pages:
+        raise HTTPException(status_code=404, detail="No pages in range")
+
+    etag_source = f"{comic.id}|{stat.st_mtime_ns}|{stat.st_size}|{start}|{end}|{fmt}"
+    etag = f'"{hashlib.sha1(etag_source.encode("utf-8")).hexdigest()}"'
+    headers = cache_headers(etag, stat.st_mtime)
+    if is_not_modified(request, etag, stat.st_mtime):
+        return not_modified_response(etag, headers)
+
+    # 整卷只打开一次压缩包，生成器在解压线程池里逐页推进
+    if fmt == "zip":
+        name = os.path.basename(comic.title)
+        filename = f"{os.path.splitext(name)[0] if comic.is_archive else name}.zip"
+        headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(filename)}"
+        iterator = iter_zip_bundle(comic.path, comic.is_archive, pages, start)
+        media_type = "application/zip"
+    else:
+        boundary = multipart_boundary()
+        if comic.is_archive:
+            prefix = f"{base_url}/comic_image/{comic.id}/"
+        else:
+            library_name = catalog.library_name(comic.library_id) or comic.library.name
+            prefix = f"{base_url}/comics/{quote(library_name)}/{quote(comic.title)}/"
+        iterator = iter_multipart_bundle(comic.path, comic.is_archive, pages, boundary, prefix, start)
+        media_type = f"multipart/mixed; boundary={boundary}"
+    return StreamingResponse(decompress_executor.iterate(iterator), media_type=media_type, headers=headers)
+
 @app.get("/comic/{comic_id_or_title}")
 async def get_comic_contents(
     request: Request,
     comic_id_or_title: str = Path(...),
     db: Session = Depends(get_db)
 ):
-    logger.info(f"Received request for comic_id_or_title: {comic_id_or_title}")
+    base_url = str(request.base_url).rstrip('/')
+    content = await metadata_executor.run(build_comic_contents, db, comic_id_or_title, base_url)
+    return JSONResponse(content=content)
+
+def build_comic_contents(db: Session, comic_id_or_title: str, base_url: str):
+    logger.debug(f"Received request for comic_id_or_title: {comic_id_or_title}")
     
     # 尝试将输入转换为整数（ID）
     try:
         comic_id = int(comic_id_or_title)
         comic = db.query(Comic).filter(Comic.id == comic_id).first()
-        logger.info(f"Query result for comic_id {comic_id}: {comic}")
+        logger.debug(f"Query result for comic_id {comic_id}: {comic}")
     except ValueError:
         # 如果无法转换为整数，则将其视为标题
         comic_title = unquote(comic_id_or_title)
         comic = db.query(Comic).filter(Comic.title == comic_title).first()
-        logger.info(f"Query result for comic_title {comic_title}: {comic}")
+        logger.debug(f"Query result for comic_title {comic_title}: {comic}")
 
     if not comic:
         logger.warning(f"Comic not found: {comic_id_or_title}")
         raise HTTPException(status_code=404, detail=f"Comic not found: {comic_id_or_title}")
+    catalog.mark_opened(comic.id)
     
-    comic_path = PathLib(comic.path)
-    if not comic_path.exists():
-        raise HTTPException(status_code=404, detail=f"Item not found: {comic_path}")
-    
-    base_url = str(request.base_url).rstrip('/')
     contents = []
 
     if comic.is_archive:
-        archive_contents = get_archive_contents(comic.path)
+        if not os.path.exists(comic.path):
+            raise HTTPException(status_code=404, detail=f"Item not found: {comic.path}")
+        try:
+            archive_contents = get_archive_contents(comic.path)
+        except Exception as e:
+            logger.warning(f"Failed to read archive {comic.path}: {e}")
+            raise HTTPException(status_code=500, detail=f"Failed to read archive: {comic.title}")
         for item in archive_contents:
             if item.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
                 contents.append({
@@ -245,123 +490,218 @@ async def get_comic_contents(
                     "path": f"{base_url}/comic_image/{comic.id}/{quote(item)}"
                 })
     else:
-        for item in sorted(comic_path.iterdir()):
-            if item.is_dir():
-                sub_comic = db.query(Comic).filter(Comic.path == str(item), Comic.parent_id == comic.id).first()
-                if not sub_comic:
-                    sub_comic = Comic(title=item.name, path=str(item), library_id=comic.library_id, parent_id=comic.id)
-                    db.add(sub_comic)
-                    db.commit()
-                
-                thumbnail = f"{base_url}/static/default-thumbnail.png"
-                for subitem in item.iterdir():
-                    if subitem.suffix.lower() in ['.jpg', '.jpeg', '.png', '.gif', '.webp']:
-                        thumbnail = f"{base_url}/comics/{quote(comic.library.name)}/{quote(comic.title)}/{quote(item.name)}/{quote(subitem.name)}"
-                        break
-                contents.append({
-                    "type": "folder",
-                    "id": sub_comic.id,
-                    "name": item.name,
-                    "thumbnail": thumbnail
-                })
-            elif item.suffix.lower() in ['.jpg', '.jpeg', '.png', '.gif', '.webp']:
-                contents.append({
-                    "type": "image",
-                    "path": f"{base_url}/comics/{quote(comic.library.name)}/{quote(comic.title)}/{quote(item.name)}"
-                })
+        try:
+            listing, _ = folder_listing_cache.get(comic.path)
+        except OSError:
+            raise HTTPException(status_code=404, detail=f"Item not found: {comic.path}")
+        child_ids = resolve_folder_children(db, comic, listing)
+        for name, path in listing.folders:
+            sub_comic_id = child_ids.get(path)
+            if sub_comic_id is None:
+                continue
+            contents.append({
+                "type": "folder",
+                "id": sub_comic_id,
+                "name": name,
+                "thumbnail": f"{base_url}/thumbnail/{sub_comic_id}"
+            })
+        image_prefix = f"{base_url}/comics/{quote(catalog.library_name(comic.library_id) or comic.library.name)}/{quote(comic.title)}"
+        for name in listing.images:
+            contents.append({
+                "type": "image",
+                "path": f"{image_prefix}/{quote(name)}"
+            })
     
-    prev_comic = db.query(Comic).filter(Comic.id < comic.id, Comic.parent_id == comic.parent_id).order_by(Comic.id.desc()).first()
-    next_comic = db.query(Comic).filter(Comic.id > comic.id, Comic.parent_id == comic.parent_id).order_by(Comic.id.asc()).first()
+    prev_comic, next_comic = catalog.siblings(comic.id, comic.parent_id)
     
-    return JSONResponse(content={
+    return {
         "id": comic.id,
         "title": comic.title,
         "contents": contents,
-        "prev_comic": prev_comic.id if prev_comic else None,
-        "next_comic": next_comic.id if next_comic else None,
+        "prev_comic": prev_comic,
+        "next_comic": next_comic,
         "is_first": prev_comic is None,
         "is_last": next_comic is None,
         "parent_id": comic.parent_id
-    })
-
-def create_archive_index(archive_path):
-    index_path = archive_path + '.index'
-    if os.path.exists(index_path):
-        return
-
-    if archive_path.lower().endswith('.zip'):
-        with zipfile.ZipFile(archive_path, 'r') as z:
-            index = {name: name for name in z.namelist()}
-    elif archive_path.lower().endswith('.rar'):
-        with rarfile.RarFile(archive_path, 'r') as r:
-            index = {name: name for name in r.namelist()}
-    elif archive_path.lower().endswith('.7z'):
-        with py7zr.SevenZipFile(archive_path, mode='r') as z:
-            index = {info.filename: info.filename for info in z.list()}
-    else:
-        return
-
-    with open(index_path, 'w') as f:
-        json.dump(index, f)
+    }
 
-def get_archive_index(archive_path):
-    index_path = archive_path + '.index'
-    if not os.path.exists(index_path):
-        create_archive_index(archive_path)
-    
-    with open(index_path, 'r') as f:
-        return json.load(f)
+def resolve_folder_children(db: Session, comic: Comic, listing):
+    """把目录列表里的子文件夹映射到漫画 id：缓存命中时不查库，否则一次查询、一次批量插入。"""
+    if listing.child_ids is not None and all(i in catalog.entries for i in listing.child_ids.values()):
+        return listing.child_ids
 
-def get_archive_contents(archive_path):
-    return list(get_archive_index(archive_path).keys())
+    wanted = {path for _, path in listing.folders}
+    child_ids = {}
+    if wanted:
+        rows = db.query(Comic.id, Comic.path).filter(Comic.parent_id == comic.id).all()
+        child_ids = {row.path: row.id for row in rows if row.path in wanted}
+    missing = [Comic(title=os.path.join(comic.title, name), path=path, library_id=comic.library_id,
+                     parent_id=comic.id)
+               for name, path in listing.folders if path not in child_ids]
+    if missing:
+        try:
+            db.add_all(missing)
+            db.flush()
+            index_comics(db, missing)
+            commit_catalog_change(db)
+        except IntegrityError:
+            # 扫描任务已经插入了这些子目录，回滚后重新查询
+            db.rollback()
+            rows = db.query(Comic.id, Comic.path).filter(Comic.parent_id == comic.id).all()
+            child_ids = {row.path: row.id for row in rows if row.path in wanted}
+            return child_ids
+        for sub_comic in missing:
+            catalog.add_comic(sub_comic)
+            child_ids[sub_comic.path] = sub_comic.id
+    folder_listing_cache.remember_children(comic.path, listing, child_ids)
+    return child_ids
 
 def get_image_from_archive(archive_path, image_path):
-    index = get_archive_index(archive_path)
-    if image_path not in index:
-        raise HTTPException(status_code=404, detail="Image not found in archive")
+    if not is_archive(archive_path):
+        return None
 
-    if archive_path.lower().endswith('.zip'):
-        with zipfile.ZipFile(archive_path, 'r') as zip_ref:
-            return zip_ref.read(image_path)
-    elif archive_path.lower().endswith('.rar'):
-        try:
-            with rarfile.RarFile(archive_path, 'r') as rar_ref:
-                return rar_ref.read(image_path)
-        except rarfile.RarCannotExec as e:
-            logger.error(f"Failed to open RAR file: {e}")
-            logger.error(f"UnRAR tool path: {rarfile.UNRAR_TOOL}")
-            raise HTTPException(status_code=500, detail="Failed to open RAR file")
-        except rarfile.Error as e:
-            logger.error(f"RAR file error: {e}")
-            raise HTTPException(status_code=500, detail="RAR file error")
-    elif archive_path.lower().endswith('.7z'):
-        try:
-            with py7zr.SevenZipFile(archive_path, mode='r') as z:
-                data = z.read([image_path])
-                return data[image_path].read()
-        except py7zr.Bad7zFile as e:
-            logger.error(f"Failed to open 7z file: {e}")
-            raise HTTPException(status_code=500, detail="Failed to open 7z file")
-        except Exception as e:
+    # 从句柄池中取已打开的压缩包，避免每页都重新解析目录
+    try:
+        with archive_pool.acquire(archive_path) as archive:
+            if image_path not in archive.names:
+                raise HTTPException(status_code=404, detail="Image not found in archive")
+            return archive.read(image_path)
+    except HTTPException:
+        raise
+    except rarfile.RarCannotExec as e:
+        logger.error(f"Failed to open RAR file: {e}")
+        logger.error(f"UnRAR tool path: {rarfile.UNRAR_TOOL}")
+        raise HTTPException(status_code=500, detail="Failed to open RAR file")
+    except rarfile.Error as e:
+        logger.error(f"RAR file error: {e}")
+        raise HTTPException(status_code=500, detail="RAR file error")
+    except py7zr.Bad7zFile as e:
+        logger.error(f"Failed to open 7z file: {e}")
+        raise HTTPException(status_code=500, detail="Failed to open 7z file")
+    except Exception as e:
+        if archive_path.lower().endswith('.7z'):
             logger.error(f"Error reading from 7z file: {e}")
             raise HTTPException(status_code=500, detail="Error reading from 7z file")
-    else:
+        raise
+
+def archive_page_info(archive_path, image_path):
+    """从压缩包索引取成员信息和缓存校验用的 ETag；索引不可用时返回 None，由调用方直接读取压缩包。"""
+    try:
+        member = get_archive_member(archive_path, image_path)
+        stat = os.stat(archive_path)
+    except ArchiveIndexError as e:
+        # 索引时已确认压缩包损坏，文件没变之前不再重新打开
+        raise HTTPException(status_code=500, detail=f"Failed to read archive: {e}")
+    except Exception as e:
+        logger.warning(f"Failed to load archive index for {archive_path}: {e}")
         return None
+    if member is None:
+        raise HTTPException(status_code=404, detail="Image not found in archive")
+    return member, member_etag(member, stat), stat.st_mtime
+
+def archive_page_source(archive_path, image_path, member, etag):
+    # 给转码进程准备源图：能直接读文件的只传路径和区间，其余先解压成字节
+    if is_stored_member(archive_path, member):
+        return ("file", archive_path, member.offset, member.file_size)
+    prefetched = read_ahead.lookup(archive_path, image_path, etag)
+    if prefetched:
+        return ("bytes", prefetched[0])
+    cached_page = solid_page_cache.lookup(archive_path, image_path)
+    if cached_page:
+        return ("file", cached_page, 0, os.path.getsize(cached_page))
+    return ("bytes", get_image_from_archive(archive_path, image_path))
+
+def read_transform(w, fmt, q):
+    try:
+        return parse_transform(w, fmt, q)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def transformed_response(request: Request, source_id, transform, mtime, load_source):
+    etag = derived_images.etag(source_id, transform)
+    headers = cache_headers(etag, mtime)
+    if is_not_modified(request, etag, mtime):
+        return not_modified_response(etag, headers)
+    try:
+        path = await derived_images.get_or_create(source_id, transform, load_source)
+    except TranscodeBusy:
+        raise HTTPException(status_code=503, detail="Too many image conversions in progress",
+                            headers={"Retry-After": "1"})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to convert image {source_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to convert image: {str(e)}")
+    if path is None:
+        raise HTTPException(status_code=500, detail="Failed to convert image")
+    return range_file_response(request, path, media_type=derived_images.media_type(transform),
+                               headers=headers, etag=etag)
+
+def client_key(request: Request):
+    # 预读按客户端跟踪阅读位置，用地址加 UA 区分同一台机器上的不同浏览器
+    host = request.client.host if request.client else ""
+    return f"{host}|{request.headers.get('user-agent', '')}"
+
+def is_stored_member(archive_path, member):
+    return (archive_path.lower().endswith('.zip') and member.method == zipfile.ZIP_STORED
+            and member.compress_size == member.file_size)
 
 @app.get("/comic_image/{comic_id}/{image_path:path}")
-async def get_comic_image(comic_id: int, image_path: str, db: Session = Depends(get_db)):
-    comic = db.query(Comic).filter(Comic.id == comic_id).first()
+async def get_comic_image(
+    comic_id: int,
+    image_path: str,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1),
+    fmt: Optional[str] = Query(None, alias="format", regex="^(webp|avif|jpeg|jpg)$"),
+    q: Optional[int] = Query(None, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    transform = read_transform(w, fmt, q)
+    comic = await metadata_executor.run(get_comic, db, comic_id)
     if not comic or not comic.is_archive:
         raise HTTPException(status_code=404, detail="Comic not found or not an archive")
 
-    logger.info(f"Attempting to read image {image_path} from archive {comic.path}")
+    # ETag 由成员 CRC 和压缩包 mtime/大小决定，浏览器再次打开同一卷时直接 304
+    page = await metadata_executor.run(archive_page_info, comic.path, image_path)
+    etag = None
+    headers = {}
+    if page is not None:
+        member, etag, mtime = page
+        headers = cache_headers(etag, mtime)
+        read_ahead.on_page(client_key(request), comic.id, comic.path, comic.parent_id, member.position)
+        if transform is not None:
+            source_id = f"{os.path.abspath(comic.path)}|{image_path}|{etag}"
+            return await transformed_response(
+                request, source_id, transform, mtime,
+                lambda: decompress_executor.run(archive_page_source, comic.path, image_path, member, etag))
+        if is_not_modified(request, etag, mtime):
+            return not_modified_response(etag, headers)
+
+        # 未压缩的 ZIP 成员直接按索引里的偏移从压缩包文件输出，不解压也不读入内存
+        if is_stored_member(comic.path, member):
+            media_type = await metadata_executor.run(sniff_file_media_type, comic.path, member.offset, member.name)
+            return file_slice_response(request, comic.path, member.offset, member.file_size,
+                                       media_type=media_type, headers=headers, etag=etag)
+
+        prefetched = read_ahead.lookup(comic.path, image_path, etag)
+        if prefetched:
+            data, media_type = prefetched
+            return Response(content=data, media_type=media_type, headers=headers)
+
+    # 固实压缩包整卷解压完成后直接从页面缓存读取
+    cached_page = await decompress_executor.run(solid_page_cache.lookup, comic.path, image_path)
+    if cached_page:
+        media_type = await metadata_executor.run(sniff_file_media_type, cached_page, 0, image_path)
+        return range_file_response(request, cached_page, media_type=media_type, headers=headers, etag=etag)
+
+    logger.debug(f"Attempting to read image {image_path} from archive {comic.path}")
     try:
-        image_data = get_image_from_archive(comic.path, image_path)
+        image_data = await decompress_executor.run(get_image_from_archive, comic.path, image_path)
         if not image_data:
             logger.error(f"Image {image_path} not found in archive {comic.path}")
             raise HTTPException(status_code=404, detail="Image not found in archive")
-        logger.info(f"Successfully read image {image_path} from archive {comic.path}")
-        return Response(content=image_data, media_type="image/jpeg")
+        logger.debug(f"Successfully read image {image_path} from archive {comic.path}")
+        return Response(content=image_data, media_type=sniff_media_type(image_data, image_path), headers=headers)
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -370,51 +710,23 @@ async def get_comic_image(comic_id: int, image_path: str, db: Session = Depends(
 
 @app.get("/{comic_id}")
 async def redirect_to_comic(comic_id: str, request: Request, db: Session = Depends(get_db)):
-    # 首先尝试直接查找匹配的 id
-    comic = db.query(Comic).filter(Comic.id == comic_id).first()
-    
-    # 如果没有找到，尝试查找匹配的标题
-    if not comic:
-        comic = db.query(Comic).filter(Comic.title.contains(comic_id)).first()
-    
+    comic = await metadata_executor.run(find_comic_for_redirect, db, comic_id)
     if not comic:
         raise HTTPException(status_code=404, detail="Comic not found")
     
     # 重定向到新的 reader 页面
     return RedirectResponse(url=f"/reader/{comic.id}")
 
-def is_archive(file_path):
-    return file_path.lower().endswith(('.zip', '.rar', '.7z'))
-
-def update_comics_db(db: Session, library: Library, parent_id=None, current_path=None):
-    if current_path is None:
-        current_path = library.path
-    
-    logger.info(f"Updating comics for path: {current_path}")
-    for item in os.listdir(current_path):
-        item_path = os.path.join(current_path, item)
-        relative_path = os.path.relpath(item_path, library.path)
-        
-        if os.path.isdir(item_path) or is_archive(item_path):
-            existing_comic = db.query(Comic).filter(Comic.title == relative_path, Comic.library_id == library.id).first()
-            if not existing_comic:
-                comic = Comic(title=relative_path, path=item_path, library_id=library.id, parent_id=parent_id, is_archive=is_archive(item_path))
-                db.add(comic)
-                db.flush()
-                logger.info(f"Added new comic: {relative_path} with id {comic.id}, is_archive: {comic.is_archive}")
-            else:
-                comic = existing_comic
-                comic.is_archive = is_archive(item_path)  # 更新现有记录的 is_archive 字段
-                logger.info(f"Updated existing comic: {relative_path} with id {comic.id}, is_archive: {comic.is_archive}")
-            
-            if os.path.isdir(item_path):
-                # 递归处理子文件夹
-                update_comics_db(db, library, parent_id=comic.id, current_path=item_path)
-            elif is_archive(item_path):
-                create_archive_index(item_path)
+def find_comic_for_redirect(db: Session, comic_id: str):
+    # 首先尝试直接查找匹配的 id
+    comic = db.query(Comic).filter(Comic.id == comic_id).first()
     
-    db.commit()
-    logger.info(f"Finished updating comics for path: {current_path}")
+    # 如果没有找到，用搜索索引查找最匹配的标题
+    if not comic:
+        matches = search(db, catalog, comic_id, limit=1)
+        if matches:
+            comic = db.query(Comic).filter(Comic.id == matches[0].id).first()
+    return comic
 
 # 在 startup_event 函数之前添加这个函数
 def clean_invalid_libraries(db: Session):
@@ -424,17 +736,6 @@ def clean_invalid_libraries(db: Session):
         db.delete(library)
     db.commit()
 
-def run_migration(engine):
-    inspector = inspect(engine)
-    columns = [c['name'] for c in inspector.get_columns('comics')]
-    if 'is_archive' not in columns:
-        logger.info("Running database migration to add 'is_archive' column")
-        with engine.begin() as connection:
-            connection.execute(sa_text("ALTER TABLE comics ADD COLUMN is_archive BOOLEAN"))
-        logger.info("Migration completed successfully")
-    else:
-        logger.info("'is_archive' column already exists, skipping migration")
-
 @app.on_event("startup")
 async def startup_event():
     global engine  # 确保我们使用的是全局的 engine 变量
@@ -450,31 +751,92 @@ async def startup_event():
     # 关闭所有现有的数据库连接
     engine.dispose()
     
-    # 重新创建数据库表（如果不存在）
-    Base.metadata.create_all(bind=engine)
-    
-    # 运行迁移
-    run_migration(engine)
-    
     db = next(get_db())
-    clean_invalid_libraries(db)
+    # 多个工作进程同时启动时，建表、迁移和清理只由先拿到锁的进程执行，其余进程等待后发现已是最新
+    with FileLock("startup"):
+        # 重新创建数据库表（如果不存在）
+        Base.metadata.create_all(bind=engine)
+        
+        # 运行迁移
+        run_migrations(engine)
+        ensure_search_index(engine)
+        clean_invalid_libraries(db)
     libraries = db.query(Library).all()
     for library in libraries:
         if library.path and os.path.exists(library.path):
-            try:
-                app.mount(f"/comics/{library.name}", StaticFiles(directory=library.path), name=f"comics_{library.name}")
-                logger.info(f"Mounted comic folder: {library.name} at {library.path}")
-            except Exception as e:
-                logger.error(f"Failed to mount comic folder: {library.name} at {library.path}. Error: {str(e)}")
+            logger.info(f"Serving comic folder: {library.name} at {library.path}")
         else:
             logger.warning(f"Invalid library path for {library.name}: {library.path}")
-    logger.info("Finished mounting comic folders for all libraries")
 
     comic_count = db.query(Comic).count()
     logger.info(f"Total comics in database: {comic_count}")
     if comic_count == 0:
         logger.warning("No comics found in database. Make sure to add libraries and update the database.")
 
+    # 载入内存漫画目录：优先使用快照，快照过期时从数据库重建
+    catalog.load_or_build(db)
+    # 阅读进度常驻内存，同时驱动“最近阅读”排序
+    on_progress_change(progress_store.load(db))
+    progress_store.start(on_progress_change)
+    # 连接池里的连接是有限的，启动用的会话要归还
+    db.close()
+    # 文件监视只在一个工作进程里运行（谁先拿到 watcher 锁），其余进程只跟随共享目录版本
+    worker_coordinator.start(sync_catalog, on_elected=start_library_watcher if WATCH_ENABLED else None)
+
+def commit_catalog_change(db: Session):
+    # 改动漫画或资料库的事务提交时递增共享目录版本，其他工作进程据此重建各自的内存目录
+    versions = bump_catalog_version(db)
+    db.commit()
+    catalog.note_version(*versions)
+
+def sync_catalog():
+    # 协调线程回调：共享版本变化时重建内存目录，丢弃可能过期的目录列表缓存
+    db = SessionLocal()
+    try:
+        changed = catalog.sync(db)
+    finally:
+        db.close()
+    if changed:
+        folder_listing_cache.clear()
+        file_stat_cache.clear()
+        sync_watched_libraries()
+
+def watched_libraries():
+    return [(library.id, library.path) for library in catalog.libraries.values()
+            if library.path and os.path.exists(library.path)]
+
+def start_library_watcher():
+    library_watcher.start(watched_libraries(), on_library_change)
+
+def sync_watched_libraries():
+    # 只有运行监视器的进程需要跟着资料库的增删调整监视范围
+    if library_watcher.running:
+        library_watcher.sync_libraries(watched_libraries())
+
+def on_progress_change(records):
+    # 载入或读回其他工作进程写入的阅读进度时，同步到内存目录的最近阅读时间
+    for record in records:
+        if record.updated_at:
+            catalog.mark_opened(record.comic_id, record.updated_at)
+
+def on_library_change(library_id, dirty, archives):
+    # 监视线程回调：把变化交给后台任务队列，与手动刷新串行执行
+    job_manager.submit("watch_update", run_refresh_job, library_id=library_id, dirty=dirty, archives=archives)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    worker_coordinator.stop()
+    progress_store.stop()
+    library_watcher.stop()
+    archive_pool.close_all()
+    solid_page_cache.shutdown()
+    thumbnail_store.shutdown()
+    derived_images.shutdown()
+    archive_indexer.shutdown()
+    job_manager.shutdown()
+    shutdown_executors()
+    logger.info("Closed all pooled archive handles")
+
 @app.get("/test_path/{folder_name}")
 async def test_path(folder_name: str):
     base_path = "E:/PythonProject/manga_reader/comics"
@@ -485,6 +847,10 @@ async def test_path(folder_name: str):
 
 @app.get("/admin/check_library/{library_id}")
 async def check_library(library_id: int, db: Session = Depends(get_db)):
+    content = await metadata_executor.run(build_library_check, db, library_id)
+    return JSONResponse(content=content)
+
+def build_library_check(db: Session, library_id: int):
     library = db.query(Library).filter(Library.id == library_id).first()
     if not library:
         raise HTTPException(status_code=404, detail="Library not found")
@@ -492,138 +858,227 @@ async def check_library(library_id: int, db: Session = Depends(get_db)):
     folders = [f for f in os.listdir(library.path) if os.path.isdir(os.path.join(library.path, f))]
     comics = db.query(Comic).filter(Comic.library_id == library_id).all()
     
-    return JSONResponse(content={
+    return {
         "library_name": library.name,
         "library_path": library.path,
         "folders_in_path": folders,
         "comics_in_db": [c.title for c in comics]
-    })
+    }
 
-@app.delete("/admin/delete_library/{library_id}")
-async def delete_library(library_id: int, db: Session = Depends(get_db)):
+def remove_library(db: Session, library_id: int):
     library = db.query(Library).filter(Library.id == library_id).first()
     if not library:
         raise HTTPException(status_code=404, detail="Library not found")
     
-    # 删除与该资料库相关的所有漫画
-    db.query(Comic).filter(Comic.library_id == library_id).delete()
+    library_name = library.name
+    library_path = library.path
     
-    # 删除资料库
-    db.delete(library)
-    db.commit()
-    
-    # 卸载静态文件路径
-    try:
-        app.routes = [route for route in app.routes if route.name != f"comics_{library.name}"]
-        logger.info(f"Unmounted comic folder: {library.name}")
-    except Exception as e:
-        logger.error(f"Failed to unmount comic folder: {library.name}. Error: {str(e)}")
+    # 删除资料库，相关漫画记录由后台任务清理
+    # 用批量删除，避免 ORM 把关联漫画的 library_id 置空
+    db.query(Library).filter(Library.id == library_id).delete(synchronize_session=False)
+    commit_catalog_change(db)
+    catalog.remove_library(library_id)
+    file_stat_cache.clear()
+    sync_watched_libraries()
     
-    # 在成功删除库后刷新数据库和缓存
-    await refresh_database_and_cache(db)
+    job = job_manager.submit("delete_library", run_delete_library_job,
+                             library_id=library_id, library_path=library_path)
     
-    logger.info(f"Successfully deleted library: {library.name}")
-    return {"status": "success", "message": "Library deleted successfully"}
+    logger.info(f"Successfully deleted library: {library_name}")
+    return job
+
+@app.delete("/admin/delete_library/{library_id}")
+async def delete_library(library_id: int, db: Session = Depends(get_db)):
+    job = await metadata_executor.run(remove_library, db, library_id)
+    return {"status": "success", "message": "Library deleted successfully", "job_id": job.id}
 
 # 新增刷新数据库和缓存的函数
-async def refresh_database_and_cache(db: Session):
-    # 获取所有库
-    libraries = db.query(Library).all()
-    
-    # 用于存储所有有效的漫画ID
-    valid_comic_ids = set()
+def refresh_database_and_cache(db: Session, job=None, library_id=None, dirty=None, archives=None):
+    # 获取需要扫描的库，library_id 为空时扫描全部
+    query = db.query(Library)
+    if library_id is not None:
+        query = query.filter(Library.id == library_id)
+    libraries = query.all()
     
+    changed_comics = []
     for library in libraries:
-        # 更新每个库的漫画数据，并获取有效的漫画ID
-        valid_ids = update_comics_db(db, library)
-        valid_comic_ids.update(valid_ids)
-    
-    # 删除不再存在的漫画记录
-    db.query(Comic).filter(Comic.id.notin_(valid_comic_ids)).delete(synchronize_session='fetch')
+        # 增量扫描每个库，只处理发生变化的目录，并把变化同步到内存目录
+        result = update_comics_db(db, library, job=job, dirty=dirty)
+        catalog.apply_scan(result)
+        changed_comics.extend((c.path, c.is_archive) for c in result.added + result.changed)
+        for rel_dir in dirty or ():
+            folder_listing_cache.invalidate(os.path.join(library.path, rel_dir) if rel_dir else library.path)
+    # 页面文件可能被替换或删除，不等缓存过期
+    file_stat_cache.clear()
+
+    if archives:
+        # 原地覆盖的压缩包：目录 mtime 不变，扫描不会碰到，单独重建索引和缩略图
+        archive_indexer.index_archives(archives, job)
+        changed_comics.extend((path, True) for path in archives if os.path.exists(path))
     
-    # 清除缓存
-    if os.path.exists(CACHE_FILE):
-        os.remove(CACHE_FILE)
+    # 删除已不属于任何资料库的漫画记录
+    library_ids = [row.id for row in db.query(Library.id)]
+    removed = db.query(Comic).filter(Comic.library_id.notin_(library_ids) | Comic.library_id.is_(None)).delete(synchronize_session=False)
+    if job is not None:
+        job.advance(comics_removed=removed)
+    remove_search_orphans(db)
+    remove_progress_orphans(db)
     
-    db.commit()
+    commit_catalog_change(db)
+    catalog.set_libraries(db)
+    catalog.save_snapshot(db)
+    progress_store.retain(catalog.entries)
     logger.info("Database and cache refreshed")
 
-def update_comics_db(db: Session, library: Library, parent_id=None, current_path=None):
-    if current_path is None:
-        current_path = library.path
-    
-    logger.info(f"Updating comics for path: {current_path}")
-    
-    valid_comic_ids = set()
-    
-    for item in os.listdir(current_path):
-        item_path = os.path.join(current_path, item)
-        relative_path = os.path.relpath(item_path, library.path)
-        
-        if os.path.isdir(item_path) or is_archive(item_path):
-            existing_comic = db.query(Comic).filter(Comic.title == relative_path, Comic.library_id == library.id).first()
-            if not existing_comic:
-                comic = Comic(title=relative_path, path=item_path, library_id=library.id, parent_id=parent_id, is_archive=is_archive(item_path))
-                db.add(comic)
-                db.flush()
-                logger.info(f"Added new comic: {relative_path} with id {comic.id}, is_archive: {comic.is_archive}")
-            else:
-                comic = existing_comic
-                comic.is_archive = is_archive(item_path)  # 更新现有记录的 is_archive 字段
-                logger.info(f"Updated existing comic: {relative_path} with id {comic.id}, is_archive: {comic.is_archive}")
-            
-            valid_comic_ids.add(comic.id)
-            
-            if os.path.isdir(item_path):
-                # 递归处理子文件夹，并合并有效的漫画ID
-                valid_comic_ids.update(update_comics_db(db, library, parent_id=comic.id, current_path=item_path))
-            elif is_archive(item_path):
-                create_archive_index(item_path)
-    
-    return valid_comic_ids
+    # 扫描完成后在后台进程池里为新增或变化的漫画预生成缩略图
+    thumbnail_store.schedule(changed_comics)
+
+def update_comics_db(db: Session, library: Library, job=None, dirty=None):
+    # 增量扫描，返回 ScanResult（新增/变化/删除的漫画和扫描统计）
+    return scan_library(db, library, job=job, dirty=dirty)
+
+# 后台任务：在任务线程里使用独立的数据库会话
+def run_refresh_job(job, library_id=None, dirty=None, archives=None):
+    db = SessionLocal()
+    try:
+        refresh_database_and_cache(db, job=job, library_id=library_id, dirty=dirty, archives=archives)
+    finally:
+        db.close()
+    return "Database and cache refreshed"
+
+def run_delete_library_job(job, library_id, library_path=None):
+    db = SessionLocal()
+    try:
+        removed = db.query(Comic).filter(Comic.library_id == library_id).delete(synchronize_session=False)
+        db.query(ScanDirectory).filter(ScanDirectory.library_id == library_id).delete(synchronize_session=False)
+        if library_path:
+            remove_archive_indexes_under(db, library_path)
+        remove_search_orphans(db)
+        remove_progress_orphans(db)
+        commit_catalog_change(db)
+        job.advance(comics_removed=removed)
+        catalog.remove_library(library_id)
+        catalog.save_snapshot(db)
+        progress_store.retain(catalog.entries)
+    finally:
+        db.close()
+    return f"Removed {removed} comics"
 
 # 添加一个新的路由来处理子文件夹
 @app.get("/comics/{library_name}/{comic_title:path}")
-async def get_comic_file(library_name: str, comic_title: str, db: Session = Depends(get_db)):
-    library_name = unquote(library_name)
-    comic_title = unquote(comic_title)
-    
-    library = db.query(Library).filter(Library.name == library_name).first()
-    if not library:
-        raise HTTPException(status_code=404, detail="Library not found")
-    
-    file_path = os.path.join(library.path, comic_title)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
-    
-    return FileResponse(file_path)
+async def get_comic_file(
+    library_name: str,
+    comic_title: str,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1),
+    fmt: Optional[str] = Query(None, alias="format", regex="^(webp|avif|jpeg|jpg)$"),
+    q: Optional[int] = Query(None, ge=1, le=100)
+):
+    transform = read_transform(w, fmt, q)
+    info = await resolve_comic_file(unquote(library_name), unquote(comic_title))
+    etag = f'"{info.mtime_ns:x}-{info.size:x}"'
+    if transform is not None and info.media_type.startswith("image/"):
+        async def load_source():
+            return ("file", info.path, 0, info.size)
+        return await transformed_response(request, f"{os.path.abspath(info.path)}|{etag}",
+                                          transform, info.mtime, load_source)
+    headers = cache_headers(etag, info.mtime)
+    if is_not_modified(request, etag, info.mtime):
+        return not_modified_response(etag, headers)
+    # 大小已知，直接按区间分块输出，不再重复 stat
+    return file_slice_response(request, info.path, 0, info.size, media_type=info.media_type,
+                               headers=headers, etag=etag)
 
-@app.get("/debug/comic/{comic_id}")
-async def debug_comic(comic_id: int, db: Session = Depends(get_db)):
+async def resolve_comic_file(library_name: str, comic_title: str):
+    # 资料库根目录取自内存目录，缓存命中时不查库也不做系统调用
+    root = catalog.library_root(library_name)
+    if root is None:
+        # 其他工作进程刚添加、本进程还没同步到的资料库
+        root = await metadata_executor.run(lookup_library_root, library_name)
+        if root is None:
+            raise HTTPException(status_code=404, detail="Library not found")
+    info = file_stat_cache.get(root, comic_title)
+    if info is None:
+        info = await metadata_executor.run(file_stat_cache.load, root, comic_title)
+        if info is None:
+            raise HTTPException(status_code=404, detail="File not found")
+    return info
+
+def lookup_library_root(library_name: str):
+    db = SessionLocal()
+    try:
+        row = db.query(Library.path).filter(Library.name == library_name).first()
+        return row.path if row else None
+    finally:
+        db.close()
+
+def build_comic_debug(db: Session, comic_id: int):
     comic = db.query(Comic).filter(Comic.id == comic_id).first()
     if comic:
+        index_error = None
+        if comic.is_archive:
+            index_error = db.query(ArchiveIndexRecord.error).filter(
+                ArchiveIndexRecord.path == os.path.abspath(comic.path)).scalar()
         return {
             "id": comic.id,
             "title": comic.title,
             "path": comic.path,
             "library_id": comic.library_id,
-            "parent_id": comic.parent_id
+            "parent_id": comic.parent_id,
+            "index_error": index_error
         }
     else:
         return {"error": "Comic not found"}
 
-@app.get("/debug/all_comics")
-async def debug_all_comics(db: Session = Depends(get_db)):
+@app.get("/debug/comic/{comic_id}")
+async def debug_comic(comic_id: int, db: Session = Depends(get_db)):
+    return await metadata_executor.run(build_comic_debug, db, comic_id)
+
+def build_all_comics_debug(db: Session):
     comics = db.query(Comic).all()
     return [{"id": c.id, "title": c.title, "path": c.path, "library_id": c.library_id, "parent_id": c.parent_id} for c in comics]
 
+@app.get("/debug/all_comics")
+async def debug_all_comics(db: Session = Depends(get_db)):
+    return await metadata_executor.run(build_all_comics_debug, db)
+
 # 设置 UnRAR 工具的路径
 rarfile.UNRAR_TOOL = r"C:\Program Files\WinRAR\UnRAR.exe"  # 根据你的实际安装路径调整
 
 @app.post("/admin/refresh")
-async def manual_refresh(db: Session = Depends(get_db)):
-    await refresh_database_and_cache(db)
-    return {"status": "success", "message": "Database and cache refreshed successfully"}
+async def manual_refresh():
+    job = job_manager.submit("refresh", run_refresh_job, dedupe=True)
+    return {"status": "success", "message": "Refresh job queued", "job_id": job.id}
+
+@app.get("/admin/prefetch")
+async def get_prefetch_stats():
+    return read_ahead.stats()
+
+@app.get("/admin/watcher")
+async def get_watcher_stats():
+    return library_watcher.stats()
+
+@app.get("/admin/executors")
+async def get_executor_stats():
+    return executor_stats()
+
+@app.get("/admin/jobs")
+async def list_jobs():
+    return [job.to_dict() for job in job_manager.list()]
+
+@app.get("/admin/jobs/{job_id}")
+async def get_job(job_id: int):
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.post("/admin/jobs/{job_id}/cancel")
+async def cancel_job(job_id: int):
+    job = job_manager.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,115 @@
+import os
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+
+# 压缩包句柄池：最多同时保持打开的压缩包数量
+ARCHIVE_POOL_SIZE = _env_int("MANGA_ARCHIVE_POOL_SIZE", 32)
+# 压缩包句柄空闲多少秒后自动关闭
+ARCHIVE_POOL_IDLE_SECONDS = _env_float("MANGA_ARCHIVE_POOL_IDLE_SECONDS", 300)
+
+# 固实压缩包（solid 7z/RAR）整卷解压缓存
+SOLID_EXTRACT_ENABLED = os.environ.get("MANGA_SOLID_EXTRACT", "1") != "0"
+PAGE_CACHE_DIR = os.environ.get("MANGA_PAGE_CACHE_DIR", os.path.join("cache", "pages"))
+PAGE_CACHE_MAX_BYTES = _env_int("MANGA_PAGE_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024)
+EXTRACT_WORKERS = _env_int("MANGA_EXTRACT_WORKERS", 2)
+
+# 缩略图：尺寸、格式、缓存上限和生成进程数
+THUMBNAIL_DIR = os.environ.get("MANGA_THUMBNAIL_DIR", os.path.join("cache", "thumbnails"))
+THUMBNAIL_WIDTH = _env_int("MANGA_THUMBNAIL_WIDTH", 400)
+THUMBNAIL_HEIGHT = _env_int("MANGA_THUMBNAIL_HEIGHT", 560)
+THUMBNAIL_FORMAT = os.environ.get("MANGA_THUMBNAIL_FORMAT", "webp").lower()
+THUMBNAIL_QUALITY = _env_int("MANGA_THUMBNAIL_QUALITY", 80)
+THUMBNAIL_CACHE_MAX_BYTES = _env_int("MANGA_THUMBNAIL_CACHE_MAX_BYTES", 512 * 1024 * 1024)
+THUMBNAIL_WORKERS = _env_int("MANGA_THUMBNAIL_WORKERS", max(1, (os.cpu_count() or 2) // 2))
+
+# 专用线程池：解压读取与元数据（目录遍历、数据库查询）分开，互不抢占
+DECOMPRESS_WORKERS = _env_int("MANGA_DECOMPRESS_WORKERS", min(8, (os.cpu_count() or 2) + 2))
+METADATA_WORKERS = _env_int("MANGA_METADATA_WORKERS", 8)
+
+# 内存漫画目录的二进制快照，用于快速启动
+CATALOG_SNAPSHOT = os.environ.get("MANGA_CATALOG_SNAPSHOT", os.path.join("cache", "catalog.snapshot"))
+
+# 文件夹内容列表缓存：最多缓存多少个目录，目录 mtime 变化时失效
+FOLDER_LISTING_CACHE_SIZE = _env_int("MANGA_FOLDER_LISTING_CACHE_SIZE", 1024)
+
+# 文件夹页面的文件信息缓存：最多缓存多少个文件，多少秒内直接信任缓存的大小/mtime 而不再 stat
+FILE_STAT_CACHE_SIZE = _env_int("MANGA_FILE_STAT_CACHE_SIZE", 8192)
+FILE_STAT_CACHE_TTL_SECONDS = _env_float("MANGA_FILE_STAT_CACHE_TTL_SECONDS", 2.0)
+
+# 压缩包成员索引：内存中缓存多少个已解码的索引
+ARCHIVE_INDEX_CACHE_SIZE = _env_int("MANGA_ARCHIVE_INDEX_CACHE_SIZE", 256)
+
+# 漫画页面图片的浏览器缓存时间（秒），配合 ETag 校验
+IMAGE_CACHE_MAX_AGE = _env_int("MANGA_IMAGE_CACHE_MAX_AGE", 30 * 24 * 3600)
+
+# 阅读预读：顺序翻页时提前解压后面几页放进内存缓存
+PREFETCH_ENABLED = os.environ.get("MANGA_PREFETCH", "1") != "0"
+PREFETCH_PAGES = _env_int("MANGA_PREFETCH_PAGES", 4)
+PREFETCH_NEXT_COMIC_PAGES = _env_int("MANGA_PREFETCH_NEXT_COMIC_PAGES", 2)
+PREFETCH_CACHE_MAX_BYTES = _env_int("MANGA_PREFETCH_CACHE_MAX_BYTES", 128 * 1024 * 1024)
+PREFETCH_WORKERS = _env_int("MANGA_PREFETCH_WORKERS", 2)
+
+# 页面缩放/转码：?w= / ?format= / ?q= 生成的派生图片缓存
+TRANSCODE_DIR = os.environ.get("MANGA_TRANSCODE_DIR", os.path.join("cache", "derived"))
+TRANSCODE_CACHE_MAX_BYTES = _env_int("MANGA_TRANSCODE_CACHE_MAX_BYTES", 1024 * 1024 * 1024)
+TRANSCODE_WORKERS = _env_int("MANGA_TRANSCODE_WORKERS", max(1, (os.cpu_count() or 2) // 2))
+# 同时排队的转码任务上限，超过时直接返回 503，避免突发请求压垮 CPU
+TRANSCODE_MAX_PENDING = _env_int("MANGA_TRANSCODE_MAX_PENDING", 32)
+TRANSCODE_MAX_WIDTH = _env_int("MANGA_TRANSCODE_MAX_WIDTH", 4096)
+TRANSCODE_DEFAULT_FORMAT = os.environ.get("MANGA_TRANSCODE_DEFAULT_FORMAT", "webp").lower()
+TRANSCODE_DEFAULT_QUALITY = _env_int("MANGA_TRANSCODE_DEFAULT_QUALITY", 80)
+
+# SQLite 连接池：WAL 模式下读请求可以并发，写入之间按 busy_timeout 排队等待
+DB_POOL_SIZE = _env_int("MANGA_DB_POOL_SIZE", 16)
+DB_POOL_OVERFLOW = _env_int("MANGA_DB_POOL_OVERFLOW", 48)
+DB_BUSY_TIMEOUT = _env_float("MANGA_DB_BUSY_TIMEOUT", 30.0)
+DB_CACHE_KIB = _env_int("MANGA_DB_CACHE_KIB", 16 * 1024)
+DB_MMAP_BYTES = _env_int("MANGA_DB_MMAP_BYTES", 256 * 1024 * 1024)
+
+# 扫描时并行建压缩包索引：进程数、最多同时在途的任务数和每批提交的记录数
+INDEX_WORKERS = _env_int("MANGA_INDEX_WORKERS", os.cpu_count() or 2)
+INDEX_MAX_PENDING = _env_int("MANGA_INDEX_MAX_PENDING", max(1, INDEX_WORKERS) * 4)
+INDEX_COMMIT_BATCH = _env_int("MANGA_INDEX_COMMIT_BATCH", 200)
+
+# 文件监视：资料库目录变化后自动增量更新。后端 auto 优先 inotify，不可用时定时比较目录 mtime
+WATCH_ENABLED = os.environ.get("MANGA_WATCH", "1") != "0"
+WATCH_BACKEND = os.environ.get("MANGA_WATCH_BACKEND", "auto").lower()
+# 最后一个事件之后静默多少秒才提交更新；持续有事件时最多攒 WATCH_MAX_DELAY 秒
+WATCH_DEBOUNCE_SECONDS = _env_float("MANGA_WATCH_DEBOUNCE_SECONDS", 2.0)
+WATCH_MAX_DELAY_SECONDS = _env_float("MANGA_WATCH_MAX_DELAY_SECONDS", 30.0)
+WATCH_POLL_SECONDS = _env_float("MANGA_WATCH_POLL_SECONDS", 60.0)
+
+# 阅读进度：翻页记录每隔多少秒批量写入数据库，积压多少条时提前写入；读到距卷末多少页时预热下一卷
+PROGRESS_FLUSH_SECONDS = _env_float("MANGA_PROGRESS_FLUSH_SECONDS", 5.0)
+PROGRESS_MAX_PENDING = _env_int("MANGA_PROGRESS_MAX_PENDING", 1000)
+PROGRESS_WARM_PAGES = _env_int("MANGA_PROGRESS_WARM_PAGES", 3)
+
+# 多进程部署：任务状态文件、跨进程锁文件的位置，以及各进程检查共享目录版本的间隔
+JOBS_DIR = os.environ.get("MANGA_JOBS_DIR", os.path.join("cache", "jobs"))
+LOCK_DIR = os.environ.get("MANGA_LOCK_DIR", os.path.join("cache", "locks"))
+COORDINATION_SECONDS = _env_float("MANGA_COORDINATION_SECONDS", 1.0)
+
+# 日志与监控：日志级别、是否输出 SQL、慢请求阈值和请求日志抽样比例
+LOG_LEVEL = os.environ.get("MANGA_LOG_LEVEL", "info").upper()
+SQL_ECHO = os.environ.get("MANGA_SQL_ECHO", "0") == "1"
+SLOW_REQUEST_SECONDS = _env_float("MANGA_SLOW_REQUEST_SECONDS", 1.0)
+REQUEST_LOG_SAMPLE_RATE = _env_float("MANGA_REQUEST_LOG_SAMPLE_RATE", 0.0)
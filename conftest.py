@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# database.py 导入时在当前目录建库（./sql_app.db），缓存和锁文件也放在当前目录下；
+# 测试切到临时目录里运行，不改动仓库目录里的数据
+os.chdir(tempfile.mkdtemp(prefix="manga-reader-test-"))
@@ -0,0 +1,139 @@
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import text as sa_text
+from sqlalchemy.orm import Session
+
+from config import LOCK_DIR, COORDINATION_SECONDS
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger("uvicorn.info")
+
+
+class FileLock:
+    """跨进程互斥锁：对锁文件加操作系统级的排他锁，持有进程退出时由系统自动释放。"""
+
+    def __init__(self, name, directory=LOCK_DIR):
+        self.path = os.path.join(directory, f"{name}.lock")
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def _try_lock(self, f):
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self, blocking=True, poll=0.2, should_stop=None):
+        """blocking 时每隔 poll 秒重试一次；should_stop() 返回 True 时放弃等待并返回 False。"""
+        with self._lock:
+            if self._file is not None:
+                return True
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            f = open(self.path, "a+")
+            while not self._try_lock(f):
+                if not blocking or (should_stop is not None and should_stop()):
+                    f.close()
+                    return False
+                time.sleep(poll)
+            self._file = f
+            return True
+
+    def release(self):
+        with self._lock:
+            f, self._file = self._file, None
+        if f is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            f.close()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+# ---- 共享目录版本 ----
+
+def read_catalog_version(db: Session):
+    return db.execute(sa_text("SELECT version FROM catalog_state WHERE id = 1")).scalar() or 0
+
+
+def bump_catalog_version(db: Session):
+    """在调用方的写事务里把共享目录版本加一，返回 (旧版本, 新版本)；提交后交给 catalog.note_version。"""
+    # 先写后读：UPDATE 先拿到写锁，多个进程同时提交时不会读到同一个旧版本
+    db.execute(sa_text("UPDATE catalog_state SET version = version + 1 WHERE id = 1"))
+    new = read_catalog_version(db)
+    return new - 1, new
+
+
+class WorkerCoordinator:
+    """每个工作进程一个后台线程：定期读取共享目录版本，其他进程改动后回调刷新本进程的内存状态；
+    同时尝试成为文件监视的主进程（同一时刻只有持有 watcher 锁的进程运行监视器）。"""
+
+    def __init__(self, interval=COORDINATION_SECONDS):
+        self.interval = max(0.1, interval)
+        self.leader_lock = FileLock("watcher")
+        self._stop = threading.Event()
+        self._thread = None
+        self._check_version = None
+        self._on_elected = None
+
+    @property
+    def is_leader(self):
+        return self.leader_lock.held
+
+    def start(self, check_version, on_elected=None):
+        # check_version() 比较并刷新共享版本；on_elected() 在本进程成为主进程时调用一次
+        if self._thread is not None:
+            return
+        self._check_version = check_version
+        self._on_elected = on_elected
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="worker-coordinator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.leader_lock.release()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._on_elected is not None and not self.is_leader \
+                        and self.leader_lock.acquire(blocking=False):
+                    logger.info(f"Process {os.getpid()} became the watcher leader")
+                    self._on_elected()
+                self._check_version()
+            except Exception as e:
+                logger.error(f"Worker coordination error: {e}")
+            self._stop.wait(self.interval)
+
+
+worker_coordinator = WorkerCoordinator()
@@ -1,7 +1,10 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Boolean
+from sqlalchemy import create_engine, event, Column, Integer, String, ForeignKey, Boolean, LargeBinary, Index, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session, relationship
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import QueuePool
+
+from config import SQL_ECHO, DB_POOL_SIZE, DB_POOL_OVERFLOW, DB_BUSY_TIMEOUT, DB_CACHE_KIB, DB_MMAP_BYTES
+from coordination import FileLock
 
 Base = declarative_base()
 
@@ -26,15 +29,75 @@ class Comic(Base):
     parent = relationship("Comic", remote_side=[id], back_populates="children")
     children = relationship("Comic", back_populates="parent")
 
+    __table_args__ = (
+        # 扫描按 (资料库, 相对路径) 定位记录；同级导航按 parent_id 取子项并按 id 排序
+        Index("ux_comics_library_title", "library_id", "title", unique=True),
+        Index("ix_comics_parent_id_id", "parent_id", "id"),
+        Index("ix_comics_path", "path"),
+    )
+
+class ScanDirectory(Base):
+    __tablename__ = "scan_directories"
+
+    id = Column(Integer, primary_key=True)
+    library_id = Column(Integer, ForeignKey("libraries.id"), index=True)
+    path = Column(String)  # 相对于资料库根目录的路径，根目录为空字符串
+    mtime_ns = Column(Integer)
+
+    __table_args__ = (
+        Index("ux_scan_directories_library_path", "library_id", "path", unique=True),
+    )
+
+class ArchiveIndexRecord(Base):
+    __tablename__ = "archive_indexes"
+
+    id = Column(Integer, primary_key=True)
+    path = Column(String, unique=True, index=True)  # 压缩包绝对路径
+    size = Column(Integer)
+    mtime_ns = Column(Integer)
+    member_count = Column(Integer)
+    data = Column(LargeBinary)  # archive_index.pack_members 生成的二进制成员表
+    error = Column(String, nullable=True)  # 建索引失败的原因，文件不变时不再重试
+
+class CatalogState(Base):
+    __tablename__ = "catalog_state"
+
+    id = Column(Integer, primary_key=True)  # 只有 id=1 一行
+    version = Column(Integer, default=0)  # 漫画/资料库每次变化加一，各工作进程据此刷新内存目录
+
+class ReadingProgress(Base):
+    __tablename__ = "reading_progress"
+
+    comic_id = Column(Integer, ForeignKey("comics.id"), primary_key=True)
+    page = Column(Integer, default=0)  # 最后阅读的页码，从 0 开始
+    page_count = Column(Integer, nullable=True)
+    updated_at = Column(Float, index=True)  # 阅读器上报的时间（不是写入数据库的时间）
+
 SQLALCHEMY_DATABASE_URL = "sqlite:///./sql_app.db"
 
+# 每个线程从池里借用独立的连接，用完归还；连接本身不跨线程同时使用
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
-    echo=True  # 添加这行以输出 SQL 语句，方便调试
+    connect_args={"check_same_thread": False, "timeout": DB_BUSY_TIMEOUT},
+    poolclass=QueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_POOL_OVERFLOW,
+    echo=SQL_ECHO  # MANGA_SQL_ECHO=1 时输出 SQL 语句，方便调试
 )
 
+
+@event.listens_for(engine, "connect")
+def _configure_connection(dbapi_connection, connection_record):
+    # WAL：读不阻塞写、写不阻塞读；synchronous=NORMAL 在 WAL 下仍保证崩溃后数据库一致
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}")
+    cursor.execute(f"PRAGMA cache_size=-{DB_CACHE_KIB}")
+    cursor.execute(f"PRAGMA mmap_size={DB_MMAP_BYTES}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def get_db():
@@ -47,5 +110,6 @@ def get_db():
 def get_comic(db: SessionLocal, comic_id: int):
     return db.query(Comic).filter(Comic.id == comic_id).first()
 
-# 确保在应用启动时创建所有表
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+# 确保在应用启动时创建所有表；多个工作进程同时导入时由启动锁串行化，避免重复建表出错
+with FileLock("startup"):
+    Base.metadata.create_all(bind=engine)
\ No newline at end of file
@@ -0,0 +1,186 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("uvicorn.info")
+
+# 超过这个时间仍未完成的临时文件视为崩溃遗留；更新的可能是其他工作进程正在写入的
+STALE_TEMP_SECONDS = 3600
+
+
+def _entry_size(path):
+    if os.path.isdir(path):
+        total = 0
+        for dirpath, _, filenames in os.walk(path):
+            for name in filenames:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, name))
+                except OSError:
+                    pass
+        return total
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def remove_path(path):
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+    except OSError as e:
+        logger.warning(f"Failed to remove cache entry {path}: {e}")
+
+
+class DiskLRUCache:
+    """磁盘缓存目录，按总字节数做 LRU 淘汰。每个条目是 root 下的一个文件或目录。
+
+    多个工作进程共用同一目录：条目先写到带进程号的临时路径再重命名，
+    本进程没有记录的条目在命中前会先检查磁盘上是否已由其他进程写好。
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        # 被占用的条目不参与淘汰；按次数计，多个使用者各自 pin/unpin
+        self._pinned = {}
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+        self._load_existing()
+
+    def _load_existing(self):
+        found = []
+        now = time.time()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            if name.startswith('.'):
+                # 临时文件/目录是未完成的写入，只清理已经过期的
+                if now - mtime > STALE_TEMP_SECONDS:
+                    remove_path(path)
+                continue
+            found.append((mtime, name, _entry_size(path)))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self.total_bytes += size
+        if found:
+            logger.info(f"Loaded {len(found)} cache entries ({self.total_bytes} bytes) from {self.root}")
+
+    def path_for(self, key):
+        return os.path.join(self.root, key)
+
+    def temp_path_for(self, key):
+        return os.path.join(self.root, f".{key}.{os.getpid()}.{threading.get_ident()}.{time.monotonic_ns()}.tmp")
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self.path_for(key)
+        # 其他工作进程可能已经写好了这个条目
+        final_path = self.path_for(key)
+        if os.path.exists(final_path):
+            size = _entry_size(final_path)
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = size
+                    self.total_bytes += size
+                self.hits += 1
+            return final_path
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def commit(self, key, temp_path):
+        # 写入完成后原子地重命名到最终位置，再登记大小
+        final_path = self.path_for(key)
+        size = _entry_size(temp_path)
+        with self._lock:
+            if key in self._entries:
+                remove_path(temp_path)
+                self._entries.move_to_end(key)
+                return final_path
+            if os.path.isdir(temp_path):
+                if not self._replace_dir(temp_path, final_path):
+                    # 其他进程抢先写好了同一个目录，用它的结果
+                    remove_path(temp_path)
+                    size = _entry_size(final_path)
+            else:
+                os.replace(temp_path, final_path)
+            self._entries[key] = size
+            self.total_bytes += size
+            to_remove = self._evict_locked(protect=key)
+        for path in to_remove:
+            remove_path(path)
+        return final_path
+
+    @staticmethod
+    def _replace_dir(temp_path, final_path):
+        # 目录不能原子覆盖；目标已存在时说明内容相同的条目已经写好，返回 False 由调用方丢弃临时目录
+        if os.path.exists(final_path):
+            return False
+        try:
+            os.rename(temp_path, final_path)
+        except OSError:
+            if os.path.isdir(final_path):
+                return False
+            raise
+        return True
+
+    def pin(self, key):
+        with self._lock:
+            self._pinned[key] = self._pinned.get(key, 0) + 1
+
+    def unpin(self, key):
+        with self._lock:
+            count = self._pinned.get(key, 0) - 1
+            if count > 0:
+                self._pinned[key] = count
+            else:
+                self._pinned.pop(key, None)
+
+    def discard(self, key):
+        with self._lock:
+            size = self._entries.pop(key, None)
+            if size is None:
+                return
+            self.total_bytes -= size
+        remove_path(self.path_for(key))
+
+    def _evict_locked(self, protect=None):
+        removed = []
+        for key in list(self._entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key == protect or key in self._pinned:
+                continue
+            self.total_bytes -= self._entries.pop(key)
+            removed.append(self.path_for(key))
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import DECOMPRESS_WORKERS, METADATA_WORKERS, PREFETCH_WORKERS
+
+
+class BoundedExecutor:
+    """固定大小的线程池，记录排队深度和执行中的任务数，供监控使用。"""
+
+    def __init__(self, name, max_workers):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.max_queue_depth = 0
+
+    def _wrap(self, func, args, kwargs):
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+
+    def submit(self, func, *args, **kwargs):
+        with self._lock:
+            self.queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queued)
+        try:
+            return self._executor.submit(self._wrap, func, args, kwargs)
+        except Exception:
+            with self._lock:
+                self.queued -= 1
+            raise
+
+    async def run(self, func, *args, **kwargs):
+        # 在线程池中执行阻塞函数，异常原样抛回调用方（包括 HTTPException）
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    async def iterate(self, iterator):
+        # 在线程池中逐项推进同步生成器，供流式响应使用；提前结束时在线程池里关闭生成器
+        done = object()
+        try:
+            while True:
+                item = await self.run(next, iterator, done)
+                if item is done:
+                    break
+                yield item
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                await self.run(close)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queued": self.queued,
+                "active": self.active,
+                "completed": self.completed,
+                "max_queue_depth": self.max_queue_depth,
+            }
+
+
+decompress_executor = BoundedExecutor("decompress", DECOMPRESS_WORKERS)
+metadata_executor = BoundedExecutor("metadata", METADATA_WORKERS)
+# 预读只用少量线程，避免和前台请求争抢解压资源
+prefetch_executor = BoundedExecutor("prefetch", PREFETCH_WORKERS)
+
+
+def executor_stats():
+    return {
+        decompress_executor.name: decompress_executor.stats(),
+        metadata_executor.name: metadata_executor.stats(),
+        prefetch_executor.name: prefetch_executor.stats(),
+    }
+
+
+def shutdown_executors():
+    decompress_executor.shutdown()
+    metadata_executor.shutdown()
+    prefetch_executor.shutdown()
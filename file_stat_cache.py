@@ -0,0 +1,103 @@
+import ntpath
+import os
+import stat
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from config import FILE_STAT_CACHE_SIZE, FILE_STAT_CACHE_TTL_SECONDS
+from image_info import sniff_file_media_type
+
+# 一个已校验过路径的文件：完整路径、大小、mtime、inode 和嗅探出的媒体类型；checked_at 为上次 stat 的时间
+FileInfo = namedtuple("FileInfo", ["path", "size", "mtime", "mtime_ns", "inode", "media_type", "checked_at"])
+
+
+def join_library_path(root, rel_path):
+    """把 URL 里的相对路径拼到资料库根目录下；绝对路径、带盘符、.. 越界或含空字节时返回 None。"""
+    if not rel_path or "\x00" in rel_path:
+        return None
+    rel = os.path.normpath(rel_path)
+    if os.path.isabs(rel) or rel in (os.curdir, os.pardir) or rel.startswith(os.pardir + os.sep):
+        return None
+    # Windows 上 "C:foo" 这样带盘符的相对路径会让 os.path.join 丢掉根目录；按 Windows 规则检查，各平台一致拒绝
+    if ntpath.splitdrive(rel)[0]:
+        return None
+    return os.path.join(root, rel)
+
+
+class FileStatCache:
+    """文件夹漫画页面的路径与 stat 缓存，按 (资料库根目录, 相对路径) 索引，LRU 淘汰。
+
+    ttl 秒内的命中不做任何系统调用；过期后重新 stat，文件没变（inode/大小/mtime 相同）时沿用媒体类型。
+    """
+
+    def __init__(self, max_entries=FILE_STAT_CACHE_SIZE, ttl=FILE_STAT_CACHE_TTL_SECONDS):
+        self.max_entries = max(1, max_entries)
+        self.ttl = max(0.0, ttl)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, root, rel_path):
+        """返回仍在有效期内的 FileInfo，没有时返回 None（由调用方在线程池里调用 load）。"""
+        key = (root, rel_path)
+        with self._lock:
+            info = self._entries.get(key)
+            if info is not None and time.monotonic() - info.checked_at < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return info
+            self.misses += 1
+        return None
+
+    def load(self, root, rel_path):
+        """校验路径并 stat，返回 FileInfo；路径越界、文件不存在或不是普通文件时返回 None。"""
+        key = (root, rel_path)
+        with self._lock:
+            previous = self._entries.get(key)
+        path = previous.path if previous is not None else join_library_path(root, rel_path)
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except (OSError, ValueError):
+            self.discard(root, rel_path)
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        if previous is not None and (previous.inode, previous.size, previous.mtime_ns) == \
+                (st.st_ino, st.st_size, st.st_mtime_ns):
+            media_type = previous.media_type
+        else:
+            try:
+                media_type = sniff_file_media_type(path)
+            except OSError:
+                return None
+        info = FileInfo(path, st.st_size, st.st_mtime, st.st_mtime_ns, st.st_ino, media_type, time.monotonic())
+        with self._lock:
+            self._entries[key] = info
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return info
+
+    def discard(self, root, rel_path):
+        with self._lock:
+            self._entries.pop((root, rel_path), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+file_stat_cache = FileStatCache()
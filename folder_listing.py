@@ -0,0 +1,88 @@
+import logging
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from archive_index import natural_sort_key
+from config import FOLDER_LISTING_CACHE_SIZE
+
+logger = logging.getLogger("uvicorn.info")
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+# 目录的一次列举结果：子文件夹 (名称, 完整路径) 和图片文件名，均按名称自然排序；
+# child_ids 为子文件夹路径到漫画 id 的映射，由调用方解析后回填
+FolderListing = namedtuple("FolderListing", ["mtime_ns", "folders", "images", "child_ids"])
+
+
+def list_folder(path):
+    folders = []
+    images = []
+    with os.scandir(path) as entries:
+        for entry in sorted(entries, key=lambda e: natural_sort_key(e.name)):
+            try:
+                if entry.is_dir():
+                    folders.append((entry.name, entry.path))
+                    continue
+            except OSError:
+                continue
+            if entry.name.lower().endswith(IMAGE_SUFFIXES):
+                images.append(entry.name)
+    return folders, images
+
+
+class FolderListingCache:
+    """按目录 mtime 缓存文件夹内容，目录项不变时无需再次 scandir 和查询子项。"""
+
+    def __init__(self, max_entries=FOLDER_LISTING_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        """返回 (listing, cached)；目录不存在时抛出 OSError。"""
+        mtime_ns = os.stat(path).st_mtime_ns
+        with self._lock:
+            listing = self._entries.get(path)
+            if listing is not None and listing.mtime_ns == mtime_ns:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return listing, True
+            self.misses += 1
+        folders, images = list_folder(path)
+        listing = FolderListing(mtime_ns, folders, images, None)
+        with self._lock:
+            self._entries[path] = listing
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return listing, False
+
+    def remember_children(self, path, listing, child_ids):
+        # 只在目录没有再次变化时回填，避免把旧的 id 挂到新的列表上
+        with self._lock:
+            current = self._entries.get(path)
+            if current is not None and current.mtime_ns == listing.mtime_ns:
+                self._entries[path] = current._replace(child_ids=child_ids)
+
+    def invalidate(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+folder_listing_cache = FolderListingCache()
@@ -0,0 +1,105 @@
+import mimetypes
+import struct
+
+# 读取图片尺寸时最多需要的文件头字节数；JPEG 的 SOF 段可能在较大的 EXIF 之后
+HEADER_BYTES = 64 * 1024
+
+
+def image_dimensions(data):
+    """只解析文件头得到 (宽, 高)，无法识别时返回 None。支持 JPEG/PNG/GIF/WebP。"""
+    if len(data) < 26:
+        return None
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        width, height = struct.unpack('>II', data[16:24])
+        return width, height
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        width, height = struct.unpack('<HH', data[6:10])
+        return width, height
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return _webp_dimensions(data)
+    if data[:2] == b'\xff\xd8':
+        return _jpeg_dimensions(data)
+    return None
+
+
+def read_dimensions(f, offset=0, size=None):
+    """从文件对象的 offset 处读取图片头得到尺寸；先读一小段，JPEG 的 SOF 靠后时再多读。"""
+    limit = HEADER_BYTES if size is None else min(HEADER_BYTES, size)
+    f.seek(offset)
+    head = f.read(min(4096, limit))
+    dims = image_dimensions(head)
+    if dims is None and len(head) < limit:
+        head += f.read(limit - len(head))
+        dims = image_dimensions(head)
+    return dims
+
+
+def _webp_dimensions(data):
+    chunk = data[12:16]
+    if chunk == b'VP8 ' and len(data) >= 30:
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3fff, height & 0x3fff
+    if chunk == b'VP8L' and len(data) >= 25:
+        bits = int.from_bytes(data[21:25], 'little')
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    if chunk == b'VP8X' and len(data) >= 30:
+        width = int.from_bytes(data[24:27], 'little') + 1
+        height = int.from_bytes(data[27:30], 'little') + 1
+        return width, height
+    return None
+
+
+def _jpeg_dimensions(data):
+    pos = 2
+    size = len(data)
+    while pos + 4 <= size:
+        if data[pos] != 0xff:
+            pos += 1
+            continue
+        marker = data[pos + 1]
+        if marker == 0xff:
+            pos += 1
+            continue
+        if marker in (0xd8, 0x01) or 0xd0 <= marker <= 0xd7:
+            pos += 2
+            continue
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        # SOF0-SOF15（除去 DHT/JPG/DAC）携带图像尺寸
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            if pos + 9 > size:
+                return None
+            height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + length
+    return None
+
+
+# 判断图片类型只需要文件开头的这些字节
+SNIFF_BYTES = 32
+
+
+def sniff_media_type(data, name=None):
+    """按文件头判断图片类型，识别不了时再按扩展名猜测。"""
+    if data[:3] == b'\xff\xd8\xff':
+        return "image/jpeg"
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return "image/png"
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return "image/gif"
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return "image/webp"
+    if data[4:12] in (b'ftypavif', b'ftypavis'):
+        return "image/avif"
+    if data[:2] == b'BM':
+        return "image/bmp"
+    if name:
+        guessed = mimetypes.guess_type(name)[0]
+        if guessed:
+            return guessed
+    return "application/octet-stream"
+
+
+def sniff_file_media_type(path, offset=0, name=None):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return sniff_media_type(f.read(SNIFF_BYTES), name or path)
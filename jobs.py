@@ -0,0 +1,293 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from config import JOBS_DIR
+from coordination import FileLock
+
+logger = logging.getLogger("uvicorn.info")
+
+# 最多保留多少个已结束的任务记录
+MAX_FINISHED_JOBS = 100
+# 运行中的任务最多每隔多少秒把进度写入状态文件、检查一次其他进程发来的取消请求
+PROGRESS_SAVE_SECONDS = 0.5
+CANCEL_CHECK_SECONDS = 1.0
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class Job:
+    def __init__(self, job_id, kind, func, params, manager=None):
+        self.id = job_id
+        self.kind = kind
+        self.func = func
+        self.params = params
+        self.status = "queued"
+        self.progress = {
+            "directories_visited": 0,
+            "comics_added": 0,
+            "comics_removed": 0,
+            "archives_indexed": 0,
+        }
+        self.message = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.owner = os.getpid()
+        self._manager = manager
+        self._saved_at = 0.0
+        self._cancel_checked_at = 0.0
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in ("completed", "failed", "cancelled")
+
+    def advance(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.progress[name] = self.progress.get(name, 0) + value
+            now = time.monotonic()
+            due = now - self._saved_at >= PROGRESS_SAVE_SECONDS
+            if due:
+                self._saved_at = now
+        if due and self._manager is not None:
+            self._manager.save(self)
+
+    @property
+    def cancel_requested(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def check_cancelled(self):
+        # 由任务函数在循环中调用，收到取消请求时中断执行；其他进程的取消请求以标记文件传递
+        now = time.monotonic()
+        if not self._cancel_event.is_set() and self._manager is not None \
+                and now - self._cancel_checked_at >= CANCEL_CHECK_SECONDS:
+            self._cancel_checked_at = now
+            if os.path.exists(self._manager.cancel_path(self.id)):
+                self._cancel_event.set()
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def to_dict(self):
+        with self._lock:
+            progress = dict(self.progress)
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "params": self.params,
+            "progress": progress,
+            "message": self.message,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "cancel_requested": self.cancel_requested,
+            "owner": self.owner,
+        }
+
+
+class StoredJob:
+    """其他工作进程提交的任务，只读，内容来自状态文件。"""
+
+    def __init__(self, data):
+        self.data = data
+        self.id = data["id"]
+        self.kind = data["kind"]
+        self.status = data["status"]
+        # 所属进程已经退出的未结束任务视为中断
+        if self.status in ("queued", "running") and not _pid_alive(data.get("owner") or 0):
+            self.status = "failed"
+            self.data = dict(data, status="failed", error=data.get("error") or "Worker process exited")
+
+    @property
+    def finished(self):
+        return self.status in ("completed", "failed", "cancelled")
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class JobManager:
+    """后台任务队列：扫描等耗时操作在单个工作线程里依次执行，避免阻塞事件循环和并发写库。
+
+    多个工作进程时，任务状态写在 jobs_dir 下的 JSON 文件里，任意进程都能查询和取消；
+    执行前先取得跨进程的任务锁，保证同一时刻整个部署只有一个任务在写库。
+    """
+
+    def __init__(self, jobs_dir=JOBS_DIR):
+        self.jobs_dir = jobs_dir
+        self._jobs = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._run_lock = FileLock("jobs")
+        self._stopping = threading.Event()
+        self._worker = None
+
+    def _path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def cancel_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.cancel")
+
+    def _stored_ids(self):
+        try:
+            names = os.listdir(self.jobs_dir)
+        except OSError:
+            return []
+        return sorted(int(name[:-5]) for name in names if name.endswith(".json") and name[:-5].isdigit())
+
+    def _allocate_id(self):
+        # 用 O_EXCL 创建状态文件占住编号，多个进程同时提交也不会拿到相同的 id
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        ids = self._stored_ids()
+        job_id = (ids[-1] if ids else 0) + 1
+        while True:
+            try:
+                os.close(os.open(self._path(job_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return job_id
+            except FileExistsError:
+                job_id += 1
+
+    def save(self, job):
+        # 先写临时文件再原子替换，其他进程不会读到写了一半的状态
+        path = self._path(job.id)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(job.to_dict(), f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Failed to save job {job.id} state: {e}")
+
+    def _load(self, job_id):
+        try:
+            with open(self._path(job_id), encoding="utf-8") as f:
+                return StoredJob(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def submit(self, kind, func, dedupe=False, **params):
+        with self._lock:
+            if dedupe:
+                # 同类任务还在排队时直接复用，避免重复扫描
+                for job in self._jobs.values():
+                    if job.kind == kind and job.params == params and job.status == "queued":
+                        return job
+            job = Job(self._allocate_id(), kind, func, params, manager=self)
+            self._jobs[job.id] = job
+            self.save(job)
+            self._prune_locked()
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="job-worker", daemon=True)
+                self._worker.start()
+        self._queue.put(job)
+        logger.info(f"Queued job {job.id} ({kind}) with params {params}")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None else self._load(job_id)
+
+    def list(self):
+        with self._lock:
+            jobs = dict(self._jobs)
+        for job_id in self._stored_ids()[-(MAX_FINISHED_JOBS + len(jobs)):]:
+            if job_id not in jobs:
+                stored = self._load(job_id)
+                if stored is not None:
+                    jobs[job_id] = stored
+        return sorted(jobs.values(), key=lambda j: j.id, reverse=True)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if not job.finished:
+            if isinstance(job, Job):
+                job.cancel()
+            else:
+                # 任务在其他进程里，留下标记文件，由执行它的进程在 check_cancelled 里发现
+                with open(self.cancel_path(job_id), "w"):
+                    pass
+                job.data["cancel_requested"] = True
+        return job
+
+    def shutdown(self):
+        self._stopping.set()
+        for job in self.list():
+            if isinstance(job, Job) and not job.finished:
+                job.cancel()
+        self._queue.put(None)
+
+    def _prune_locked(self):
+        finished = [j for j in self._jobs.values() if j.finished]
+        for job in sorted(finished, key=lambda j: j.id)[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job.id]
+        # 状态文件按编号只保留最近的一批，各进程提交任务时顺带清理
+        for job_id in self._stored_ids()[:-(MAX_FINISHED_JOBS * 2)]:
+            if job_id not in self._jobs:
+                for path in (self._path(job_id), self.cancel_path(job_id)):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            # 其他进程正在执行任务时排队等待，等待期间仍然响应取消
+            acquired = self._run_lock.acquire(should_stop=lambda: self._stopping.is_set() or job.cancel_requested)
+            if not acquired or job.cancel_requested:
+                if acquired:
+                    self._run_lock.release()
+                job.status = "cancelled"
+                job.finished_at = time.time()
+                self.save(job)
+                continue
+            job.status = "running"
+            job.started_at = time.time()
+            self.save(job)
+            logger.info(f"Running job {job.id} ({job.kind})")
+            try:
+                job.message = job.func(job, **job.params)
+                status = "completed"
+            except JobCancelled:
+                status = "cancelled"
+                logger.info(f"Job {job.id} ({job.kind}) cancelled")
+            except Exception as e:
+                status = "failed"
+                job.error = str(e)
+                logger.exception(f"Job {job.id} ({job.kind}) failed")
+            finally:
+                self._run_lock.release()
+            job.finished_at = time.time()
+            job.status = status
+            self.save(job)
+
+
+job_manager = JobManager()
@@ -0,0 +1,80 @@
+import logging
+import os
+from urllib.parse import quote
+
+from archive_index import IMAGE_EXTENSIONS, UNKNOWN_DIMENSION, load_archive_index, load_folder_index, update_index_dimensions
+from archive_pool import archive_pool
+from image_info import image_dimensions, read_dimensions, HEADER_BYTES
+from page_cache import solid_page_cache
+
+logger = logging.getLogger("uvicorn.info")
+
+
+def ensure_archive_dimensions(archive_path):
+    """补齐压缩包索引里缺失的图片尺寸（7z/RAR 建索引时不解压），算出后写回索引。
+    图片头无法识别的成员记为 UNKNOWN_DIMENSION，之后不再重复读取。
+
+    返回 (LoadedIndex, 尺寸是否齐全, stat)。ZIP/RAR 只解压每页开头的一小段；固实压缩包要等整卷解压完成后才能补齐，
+    非固实 7z 无法只读开头，尺寸保持未知。
+    """
+    path = os.path.abspath(archive_path)
+    stat = os.stat(path)
+    loaded = load_archive_index(path)
+    missing = [m for m in loaded.members if m.width == 0 and m.name.lower().endswith(IMAGE_EXTENSIONS)]
+    if not missing:
+        return loaded, True, stat
+
+    dimensions = {}
+    complete = True
+    if solid_page_cache.handles(path):
+        for member in missing:
+            page = solid_page_cache.lookup(path, member.name)
+            if page is None:
+                complete = False
+                break
+            with open(page, 'rb') as f:
+                dims = read_dimensions(f)
+            dimensions[member.name] = dims or (UNKNOWN_DIMENSION, UNKNOWN_DIMENSION)
+    else:
+        for member in missing:
+            try:
+                head = archive_pool.read_head(path, member.name, HEADER_BYTES)
+            except Exception as e:
+                logger.warning(f"Failed to read image header {member.name} in {path}: {e}")
+                continue
+            if head is None:
+                # 非固实 7z 不能只解压开头，不为读图片头解压整页，尺寸留空
+                complete = False
+                break
+            dimensions[member.name] = image_dimensions(head) or (UNKNOWN_DIMENSION, UNKNOWN_DIMENSION)
+    if dimensions:
+        loaded = update_index_dimensions(path, stat.st_size, stat.st_mtime_ns, dimensions) or loaded
+    return loaded, complete, stat
+
+
+def build_manifest(comic_id, title, members, page_url_prefix, complete):
+    pages = []
+    for member in members:
+        if not member.name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        known = member.width != UNKNOWN_DIMENSION
+        pages.append({
+            "index": len(pages),
+            "name": member.name,
+            "url": f"{page_url_prefix}{quote(member.name)}",
+            "width": (member.width or None) if known else None,
+            "height": (member.height or None) if known else None,
+            "size": member.file_size,
+        })
+    return {
+        "id": comic_id,
+        "title": title,
+        "page_count": len(pages),
+        "dimensions_complete": complete,
+        "pages": pages,
+    }
+
+
+def folder_manifest_source(folder_path):
+    stat = os.stat(folder_path)
+    return load_folder_index(folder_path), stat
@@ -0,0 +1,255 @@
+import bisect
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from config import REQUEST_LOG_SAMPLE_RATE, SLOW_REQUEST_SECONDS
+
+logger = logging.getLogger("uvicorn.info")
+
+# 秒；覆盖从内存缓存命中到整卷解压的范围
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float) and value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(zip(self.label_names, key))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [每个桶的计数..., +Inf 计数, 总和]
+                series = [0] * (len(self.buckets) + 1) + [0.0]
+                self._series[key] = series
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            labels = list(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """进程内的指标注册表，按 Prometheus 文本格式输出。
+
+    计数器和直方图在热路径上直接累加；各个缓存、线程池的现有 stats() 通过收集函数在抓取时读取。
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text, label_names=()):
+        metric = Counter(name, help_text, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, func):
+        # func() 返回 [(指标名, 类型, 说明, [(标签字典, 值), ...]), ...]
+        with self._lock:
+            self._collectors.append(func)
+        return func
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        with self._lock:
+            collectors = list(self._collectors)
+        families = {}
+        for collector in collectors:
+            try:
+                for name, kind, help_text, samples in collector():
+                    family = families.setdefault(name, (kind, help_text, []))
+                    family[2].extend(samples)
+            except Exception as e:
+                logger.warning(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+        for name, (kind, help_text, samples) in families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if value is None:
+                    continue
+                lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+request_latency = registry.histogram(
+    "manga_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+span_latency = registry.histogram(
+    "manga_span_duration_seconds", "Duration of internal operations (archive open, decompress, index, render)",
+    ("span",))
+db_query_latency = registry.histogram(
+    "manga_db_query_duration_seconds", "SQLite statement latency", ("statement",))
+errors_total = registry.counter("manga_errors_total", "Failed internal operations", ("span",))
+
+
+@contextmanager
+def span(name):
+    """计时一段内部操作，出错时同时计入 manga_errors_total。"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        errors_total.inc(span=name)
+        raise
+    finally:
+        span_latency.observe(time.perf_counter() - start, span=name)
+
+
+def cache_samples(name, stats):
+    """把各个缓存 stats() 里的 hits/misses/entries/bytes 转成按 cache 标签区分的样本。"""
+    labels = {"cache": name}
+    result = []
+    for key, metric, kind, help_text in (
+        ("hits", "manga_cache_hits_total", "counter", "Cache hits"),
+        ("misses", "manga_cache_misses_total", "counter", "Cache misses"),
+        ("entries", "manga_cache_entries", "gauge", "Entries held by the cache"),
+        ("bytes", "manga_cache_bytes", "gauge", "Bytes held by the cache"),
+    ):
+        if key in stats:
+            result.append((metric, kind, help_text, [(labels, stats[key])]))
+    hits, misses = stats.get("hits"), stats.get("misses")
+    if hits is not None and misses is not None:
+        ratio = hits / (hits + misses) if hits + misses else 0.0
+        result.append(("manga_cache_hit_ratio", "gauge", "Cache hit ratio since start", [(labels, round(ratio, 6))]))
+    return result
+
+
+def install_sql_timing(engine):
+    # 用 SQLAlchemy 事件给每条语句计时，标签只取语句类型，避免标签数量失控
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("query_start")
+        if starts:
+            kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+            db_query_latency.observe(time.perf_counter() - starts.pop(), statement=kind)
+
+
+class RequestTimer:
+    """ASGI 中间件：按路由模板记录请求耗时；慢请求和按比例抽样的请求输出一行结构化日志。"""
+
+    def __init__(self, app, sample_rate=REQUEST_LOG_SAMPLE_RATE, slow_seconds=SLOW_REQUEST_SECONDS):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self._route_names = {}
+
+    def _route_template(self, scope):
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        template = self._route_names.get(endpoint)
+        if template is None:
+            template = getattr(endpoint, "__name__", "unknown")
+            router = scope.get("router")
+            for route in getattr(router, "routes", ()):
+                if getattr(route, "endpoint", None) is endpoint:
+                    template = route.path
+                    break
+            self._route_names[endpoint] = template
+        return template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = self._route_template(scope)
+            request_latency.observe(elapsed, method=scope.get("method", ""), route=route, status=status["code"])
+            if elapsed >= self.slow_seconds or (self.sample_rate > 0 and random.random() < self.sample_rate):
+                logger.info(f"request method={scope.get('method')} route={route} path={scope.get('path')} "
+                            f"status={status['code']} duration_ms={elapsed * 1000:.1f}")
@@ -0,0 +1,102 @@
+import logging
+
+from sqlalchemy import inspect
+from sqlalchemy import text as sa_text
+
+logger = logging.getLogger("uvicorn.info")
+
+# 已执行到的版本号记录在 SQLite 的 PRAGMA user_version 里。
+# 新增迁移时在末尾追加并使用更大的版本号；每个迁移都要可以重复执行
+# （表可能已由 create_all 按最新模型建好，DDL 在 SQLite 中也不一定处于事务内）。
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return register
+
+
+def schema_version(connection):
+    return connection.execute(sa_text("PRAGMA user_version")).scalar() or 0
+
+
+@migration(1, "add comics.is_archive")
+def _add_is_archive(connection):
+    columns = [c['name'] for c in inspect(connection).get_columns('comics')]
+    if 'is_archive' not in columns:
+        connection.execute(sa_text("ALTER TABLE comics ADD COLUMN is_archive BOOLEAN"))
+
+
+def _remove_duplicates(connection, table, key_columns, parent_column=None):
+    # 建唯一索引前按键去重，保留 id 最小的一条；被删记录的子项挂到保留的那条下面
+    keys = ", ".join(key_columns)
+    rows = connection.execute(sa_text(
+        f"SELECT id, keep FROM (SELECT id, MIN(id) OVER (PARTITION BY {keys}) AS keep FROM {table}) "
+        f"WHERE id != keep"
+    )).fetchall()
+    if not rows:
+        return 0
+    for row in rows:
+        if parent_column:
+            connection.execute(sa_text(f"UPDATE {table} SET {parent_column} = :keep WHERE {parent_column} = :id"),
+                               {"keep": row.keep, "id": row.id})
+        connection.execute(sa_text(f"DELETE FROM {table} WHERE id = :id"), {"id": row.id})
+    return len(rows)
+
+
+@migration(2, "add comic and scan directory indexes")
+def _add_indexes(connection):
+    removed = _remove_duplicates(connection, "comics", ["library_id", "title"], parent_column="parent_id")
+    if removed:
+        logger.warning(f"Removed {removed} duplicate comic records before adding unique index")
+    _remove_duplicates(connection, "scan_directories", ["library_id", "path"])
+    for statement in (
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_comics_library_title ON comics (library_id, title)",
+        "CREATE INDEX IF NOT EXISTS ix_comics_parent_id_id ON comics (parent_id, id)",
+        "CREATE INDEX IF NOT EXISTS ix_comics_path ON comics (path)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_scan_directories_library_path ON scan_directories (library_id, path)",
+    ):
+        connection.execute(sa_text(statement))
+    connection.execute(sa_text("ANALYZE"))
+
+
+@migration(3, "add archive_indexes.error")
+def _add_archive_index_error(connection):
+    columns = [c['name'] for c in inspect(connection).get_columns('archive_indexes')]
+    if 'error' not in columns:
+        connection.execute(sa_text("ALTER TABLE archive_indexes ADD COLUMN error VARCHAR"))
+
+
+@migration(4, "seed shared catalog version")
+def _seed_catalog_state(connection):
+    connection.execute(sa_text("CREATE TABLE IF NOT EXISTS catalog_state (id INTEGER PRIMARY KEY, version INTEGER)"))
+    connection.execute(sa_text("INSERT OR IGNORE INTO catalog_state (id, version) VALUES (1, 0)"))
+
+
+@migration(5, "add reading_progress")
+def _add_reading_progress(connection):
+    connection.execute(sa_text(
+        "CREATE TABLE IF NOT EXISTS reading_progress (comic_id INTEGER NOT NULL PRIMARY KEY "
+        "REFERENCES comics (id), page INTEGER, page_count INTEGER, updated_at FLOAT)"
+    ))
+    connection.execute(sa_text(
+        "CREATE INDEX IF NOT EXISTS ix_reading_progress_updated_at ON reading_progress (updated_at)"
+    ))
+
+
+def run_migrations(engine):
+    """按版本号依次执行尚未执行的迁移，返回最终的版本号。"""
+    with engine.begin() as connection:
+        current = schema_version(connection)
+    for version, description, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version <= current:
+            continue
+        logger.info(f"Running database migration {version}: {description}")
+        with engine.begin() as connection:
+            func(connection)
+            connection.execute(sa_text(f"PRAGMA user_version = {int(version)}"))
+        current = version
+    logger.info(f"Database schema at version {current}")
+    return current
@@ -0,0 +1,160 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from archive_pool import archive_pool, open_archive
+from config import SOLID_EXTRACT_ENABLED, PAGE_CACHE_DIR, PAGE_CACHE_MAX_BYTES, EXTRACT_WORKERS
+from disk_cache import DiskLRUCache, remove_path
+from metrics import span
+
+logger = logging.getLogger("uvicorn.info")
+
+
+def volume_key(archive_path):
+    st = os.stat(archive_path)
+    raw = f"{os.path.abspath(archive_path)}|{st.st_mtime_ns}|{st.st_size}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class SolidPageCache:
+    """固实 7z/RAR 第一次访问时在后台整卷解压一次，之后的页面直接从磁盘缓存读取。"""
+
+    def __init__(self, root=PAGE_CACHE_DIR, max_bytes=PAGE_CACHE_MAX_BYTES,
+                 workers=EXTRACT_WORKERS, enabled=SOLID_EXTRACT_ENABLED):
+        self.enabled = enabled
+        self.root = root
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self._cache = None
+        self._executor = None
+        self._pending = {}
+        self._solid = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        # 延迟创建缓存目录，未使用固实压缩包时不在磁盘上留下任何东西
+        if self._cache is None:
+            with self._lock:
+                if self._cache is None:
+                    self._cache = DiskLRUCache(self.root, self.max_bytes)
+        return self._cache
+
+    def lookup(self, archive_path, member):
+        if not self.enabled or not archive_path.lower().endswith(('.7z', '.rar')):
+            return None
+        key = volume_key(archive_path)
+        volume_dir = self.cache.get(key)
+        if volume_dir is not None:
+            return self.page_path(volume_dir, member)
+        self._maybe_schedule(archive_path, key)
+        return None
+
+    def handles(self, archive_path):
+        """该压缩包是否由整卷解压缓存负责（固实且解压后不超过缓存上限）。"""
+        if not self.enabled or not archive_path.lower().endswith(('.7z', '.rar')):
+            return False
+        return self._check_solid(archive_path, volume_key(archive_path))
+
+    def warm(self, archive_path):
+        # 提前在后台解压整卷，不等第一次翻页
+        if self.handles(archive_path):
+            key = volume_key(archive_path)
+            if self.cache.get(key) is None:
+                self._maybe_schedule(archive_path, key)
+
+    def _check_solid(self, archive_path, key):
+        with self._lock:
+            solid = self._solid.get(key)
+        if solid is None:
+            try:
+                with archive_pool.acquire(archive_path) as archive:
+                    is_solid, uncompressed = archive.solid_info()
+            except Exception as e:
+                logger.warning(f"Failed to inspect archive {archive_path}: {e}")
+                is_solid, uncompressed = False, 0
+            # 单卷解压后超过整个缓存上限的不做整卷解压
+            solid = is_solid and uncompressed <= self.max_bytes
+            with self._lock:
+                self._solid[key] = solid
+        return solid
+
+    def _maybe_schedule(self, archive_path, key):
+        with self._lock:
+            if key in self._pending:
+                return
+        if not self._check_solid(archive_path, key):
+            return
+        with self._lock:
+            if key in self._pending:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=max(1, self.workers),
+                                                    thread_name_prefix="solid-extract")
+            self._pending[key] = self._executor.submit(self._extract, archive_path, key)
+
+    def _extract(self, archive_path, key):
+        cache = self.cache
+        cache.pin(key)
+        temp_dir = cache.temp_path_for(key)
+        try:
+            os.makedirs(temp_dir)
+            logger.info(f"Extracting solid archive {archive_path} into page cache")
+            # 单独打开一个句柄做顺序解压，不占用句柄池里的锁
+            with span("solid_extract"), open_archive(archive_path) as archive:
+                archive.extractall(temp_dir)
+            cache.commit(key, temp_dir)
+            logger.info(f"Finished extracting solid archive {archive_path}")
+        except Exception as e:
+            logger.error(f"Failed to extract solid archive {archive_path}: {e}")
+            remove_path(temp_dir)
+        finally:
+            cache.unpin(key)
+            with self._lock:
+                self._pending.pop(key, None)
+
+    @contextmanager
+    def extracted(self, archive_path):
+        """同步取得整卷解压目录（后台正在解压时等它完成），使用期间不会被淘汰；不能解压时给出 None。"""
+        if not self.handles(archive_path):
+            yield None
+            return
+        key = volume_key(archive_path)
+        cache = self.cache
+        cache.pin(key)
+        try:
+            if cache.get(key) is None:
+                self._maybe_schedule(archive_path, key)
+                with self._lock:
+                    future = self._pending.get(key)
+                if future is not None:
+                    future.result()
+            yield cache.get(key)
+        finally:
+            cache.unpin(key)
+
+    def page_path(self, volume_dir, member):
+        # 成员名来自压缩包，拼接后必须仍在卷目录里
+        page_path = os.path.realpath(os.path.join(volume_dir, member))
+        if page_path.startswith(os.path.realpath(volume_dir) + os.sep) and os.path.isfile(page_path):
+            return page_path
+        return None
+
+    def shutdown(self):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def stats(self):
+        stats = self.cache.stats() if self._cache is not None else {}
+        with self._lock:
+            stats["pending_extractions"] = len(self._pending)
+        return stats
+
+
+solid_page_cache = SolidPageCache()
@@ -0,0 +1,257 @@
+import logging
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+
+from archive_index import IMAGE_EXTENSIONS, get_archive_index, member_etag
+from archive_pool import archive_pool
+from catalog import catalog
+from config import (PREFETCH_ENABLED, PREFETCH_PAGES, PREFETCH_NEXT_COMIC_PAGES,
+                    PREFETCH_CACHE_MAX_BYTES)
+from database import SessionLocal, get_comic
+from executors import prefetch_executor
+from folder_listing import folder_listing_cache
+from image_info import sniff_media_type
+from page_cache import solid_page_cache
+
+logger = logging.getLogger("uvicorn.info")
+
+# 最多跟踪多少个客户端的阅读位置
+MAX_TRACKED_CLIENTS = 256
+# 按阅读进度预热过的下一卷最多记多少个，避免卷末每翻一页都重复提交
+MAX_WARMED_COMICS = 256
+
+
+def advise_willneed(path):
+    # 提示内核提前把文件读进页缓存；不支持 posix_fadvise 的平台直接跳过
+    if not hasattr(os, "posix_fadvise"):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+
+
+class MemoryPageCache:
+    """按总字节数限制的内存 LRU，存放预读出来的页面 (数据, 类型)。"""
+
+    def __init__(self, max_bytes=PREFETCH_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, data, media_type):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._entries[key] = (data, media_type)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class _ClientState:
+    def __init__(self):
+        self.comic_id = None
+        self.position = None
+        self.streak = 0
+        self.generation = 0
+
+
+class ReadAhead:
+    """阅读预读：同一客户端顺序翻页时，在后台解压后面几页（接近卷末时包括下一卷开头）。
+
+    每个客户端的计划带一个代号，客户端跳页或换卷时代号递增，旧计划在下一页前自行退出。
+    """
+
+    def __init__(self, cache=None, pages=PREFETCH_PAGES, next_comic_pages=PREFETCH_NEXT_COMIC_PAGES,
+                 enabled=PREFETCH_ENABLED):
+        self.cache = cache or MemoryPageCache()
+        self.pages = pages
+        self.next_comic_pages = next_comic_pages
+        self.enabled = enabled and pages > 0
+        self._clients = OrderedDict()
+        self._warmed = OrderedDict()
+        self._lock = threading.Lock()
+        self.plans_started = 0
+        self.volumes_warmed = 0
+        self.jumps = 0
+        self.pages_prefetched = 0
+
+    @staticmethod
+    def _key(archive_path, name, etag):
+        return os.path.abspath(archive_path), name, etag
+
+    def lookup(self, archive_path, name, etag):
+        return self.cache.get(self._key(archive_path, name, etag))
+
+    def on_page(self, client, comic_id, archive_path, parent_id, position):
+        """记录一次页面访问，判断为顺序阅读时提交预读计划。只做内存操作，可在事件循环里调用。"""
+        if not self.enabled:
+            return
+        with self._lock:
+            state = self._clients.get(client)
+            if state is None:
+                state = _ClientState()
+                self._clients[client] = state
+                while len(self._clients) > MAX_TRACKED_CLIENTS:
+                    self._clients.popitem(last=False)
+            self._clients.move_to_end(client)
+
+            if state.comic_id == comic_id and position == state.position:
+                return
+            if state.comic_id == comic_id and state.position is not None and 0 < position - state.position <= 2:
+                state.streak += 1
+            else:
+                # 跳页或换卷：取消正在进行的预读
+                if state.comic_id is not None:
+                    self.jumps += 1
+                state.generation += 1
+                state.streak = 0
+            state.comic_id = comic_id
+            state.position = position
+            # 从卷首开始读，或者已经连续向后翻页时才预读
+            if state.streak == 0 and position != 0:
+                return
+            state.generation += 1
+            generation = state.generation
+            self.plans_started += 1
+        prefetch_executor.submit(self._run_plan, client, generation, comic_id, archive_path, parent_id, position)
+
+    def _current(self, client, generation):
+        with self._lock:
+            state = self._clients.get(client)
+            return state is not None and state.generation == generation
+
+    def _run_plan(self, client, generation, comic_id, archive_path, parent_id, position):
+        try:
+            images = [m for m in get_archive_index(archive_path) if m.name.lower().endswith(IMAGE_EXTENSIONS)]
+            upcoming = [m for m in images if m.position > position][:self.pages]
+            # 固实压缩包由整卷解压缓存负责，逐页读取反而更慢
+            if upcoming and not solid_page_cache.handles(archive_path):
+                stat = os.stat(archive_path)
+                for member in upcoming:
+                    if not self._current(client, generation):
+                        return
+                    self._fetch(archive_path, member, stat)
+            if len(upcoming) < self.pages and self.next_comic_pages > 0:
+                self._prefetch_next_comic(client, generation, comic_id, parent_id)
+        except Exception as e:
+            logger.warning(f"Prefetch failed for {archive_path}: {e}")
+
+    def _prefetch_next_comic(self, client, generation, comic_id, parent_id):
+        _, next_id = catalog.siblings(comic_id, parent_id)
+        entry = catalog.get(next_id) if next_id is not None else None
+        if entry is None or not entry.is_archive:
+            return
+        self._warm_comic(next_id, lambda: self._current(client, generation))
+
+    def warm_next(self, comic_id, parent_id):
+        """阅读进度接近卷末时在后台预热同一文件夹里的下一卷，每卷只提交一次。返回是否提交。"""
+        if not self.enabled or self.next_comic_pages <= 0:
+            return False
+        _, next_id = catalog.siblings(comic_id, parent_id)
+        if next_id is None:
+            return False
+        with self._lock:
+            if next_id in self._warmed:
+                return False
+            self._warmed[next_id] = True
+            while len(self._warmed) > MAX_WARMED_COMICS:
+                self._warmed.popitem(last=False)
+            self.volumes_warmed += 1
+        prefetch_executor.submit(self._warm_comic, next_id)
+        return True
+
+    def _warm_comic(self, comic_id, is_current=None):
+        try:
+            entry = catalog.get(comic_id)
+            if entry is None:
+                return
+            db = SessionLocal()
+            try:
+                comic = get_comic(db, comic_id)
+                path = comic.path if comic else None
+            finally:
+                db.close()
+            if not path or not os.path.exists(path):
+                return
+            if not entry.is_archive:
+                # 文件夹里的页面直接从磁盘输出，提前让内核读进页缓存
+                listing, _ = folder_listing_cache.get(path)
+                for name in listing.images[:self.next_comic_pages]:
+                    advise_willneed(os.path.join(path, name))
+                return
+            if solid_page_cache.handles(path):
+                # 固实压缩包提前触发整卷解压即可
+                solid_page_cache.warm(path)
+                return
+            images = [m for m in get_archive_index(path) if m.name.lower().endswith(IMAGE_EXTENSIONS)]
+            stat = os.stat(path)
+            for member in images[:self.next_comic_pages]:
+                if is_current is not None and not is_current():
+                    return
+                self._fetch(path, member, stat)
+        except Exception as e:
+            logger.warning(f"Failed to warm comic {comic_id}: {e}")
+
+    def _fetch(self, archive_path, member, stat):
+        # 未压缩的 ZIP 成员直接从文件输出，不需要放进内存
+        if archive_path.lower().endswith('.zip') and member.method == zipfile.ZIP_STORED:
+            return
+        key = self._key(archive_path, member.name, member_etag(member, stat))
+        if key in self.cache:
+            return
+        data = archive_pool.read(archive_path, member.name)
+        self.cache.put(key, data, sniff_media_type(data, member.name))
+        with self._lock:
+            self.pages_prefetched += 1
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "enabled": self.enabled,
+                "clients": len(self._clients),
+                "plans_started": self.plans_started,
+                "jumps": self.jumps,
+                "pages_prefetched": self.pages_prefetched,
+                "volumes_warmed": self.volumes_warmed,
+            }
+        stats["cache"] = self.cache.stats()
+        return stats
+
+
+read_ahead = ReadAhead()
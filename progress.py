@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import text as sa_text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from config import PROGRESS_FLUSH_SECONDS, PROGRESS_MAX_PENDING
+from database import SessionLocal, ReadingProgress
+
+logger = logging.getLogger("uvicorn.info")
+
+# 一本漫画的阅读位置；updated_at 为阅读器上报的时间
+ProgressRecord = namedtuple("ProgressRecord", ["comic_id", "page", "page_count", "updated_at"])
+
+UPSERT_SQL = sa_text(
+    "INSERT INTO reading_progress (comic_id, page, page_count, updated_at) "
+    "VALUES (:comic_id, :page, :page_count, :updated_at) "
+    "ON CONFLICT(comic_id) DO UPDATE SET page = excluded.page, page_count = excluded.page_count, "
+    "updated_at = excluded.updated_at WHERE excluded.updated_at >= reading_progress.updated_at"
+)
+
+
+class ProgressStore:
+    """阅读进度：翻页时只更新内存，后台线程按间隔把变化批量写入数据库（write-behind）。
+
+    全部进度常驻内存，"继续阅读"和最近阅读排序不查库；多个工作进程时，
+    每次写入后顺带读回其他进程最近写入的记录。
+    """
+
+    def __init__(self, flush_interval=PROGRESS_FLUSH_SECONDS, max_pending=PROGRESS_MAX_PENDING):
+        self.flush_interval = max(0.1, flush_interval)
+        self.max_pending = max(1, max_pending)
+        self._records = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._on_change = None
+        # 已从数据库读到的最新 updated_at；待写记录的时间可能比写入时刻早一个刷新间隔
+        self._seen_at = 0.0
+        self.updates = 0
+        self.flushes = 0
+        self.rows_written = 0
+
+    def load(self, db: Session):
+        rows = db.query(ReadingProgress.comic_id, ReadingProgress.page, ReadingProgress.page_count,
+                        ReadingProgress.updated_at).all()
+        records = [ProgressRecord(*row) for row in rows]
+        with self._lock:
+            self._records = {r.comic_id: r for r in records}
+            self._seen_at = max((r.updated_at or 0.0 for r in records), default=0.0)
+        logger.info(f"Loaded reading progress for {len(records)} comics")
+        return records
+
+    def start(self, on_change=None):
+        # on_change(records) 在读回其他进程的新记录时调用
+        if self._thread is not None:
+            return
+        self._on_change = on_change
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="progress-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join(timeout=5)
+            self._thread = None
+        # 关闭前把剩下的进度写完
+        self.flush()
+
+    def record(self, comic_id, page, page_count=None):
+        record = ProgressRecord(comic_id, max(0, page), page_count, time.time())
+        with self._lock:
+            self._records[comic_id] = record
+            self._pending[comic_id] = record
+            self.updates += 1
+            backlog = len(self._pending)
+        if backlog >= self.max_pending:
+            self._wake.set()
+        return record
+
+    def get(self, comic_id):
+        return self._records.get(comic_id)
+
+    def recent(self):
+        """按最近阅读时间从新到旧排列的全部进度。"""
+        with self._lock:
+            records = list(self._records.values())
+        return sorted(records, key=lambda r: (r.updated_at or 0.0, r.comic_id), reverse=True)
+
+    def retain(self, comic_ids):
+        # 漫画被删除后丢弃对应的内存记录（comic_ids 为仍然存在的漫画），数据库里的由 remove_orphans 清理
+        with self._lock:
+            for comic_id in [i for i in self._records if i not in comic_ids]:
+                self._records.pop(comic_id, None)
+                self._pending.pop(comic_id, None)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        db = SessionLocal()
+        try:
+            db.execute(UPSERT_SQL, [r._asdict() for r in pending.values()])
+            db.commit()
+        except OperationalError as e:
+            # 数据库正忙（例如扫描持有写锁）：放回队列下次再写，期间更新的记录以新的为准
+            db.rollback()
+            logger.warning(f"Failed to save reading progress, will retry: {e}")
+            with self._lock:
+                for comic_id, record in pending.items():
+                    self._pending.setdefault(comic_id, record)
+            return 0
+        finally:
+            db.close()
+        with self._lock:
+            self.flushes += 1
+            self.rows_written += len(pending)
+        return len(pending)
+
+    def _poll(self):
+        since = self._seen_at - self.flush_interval * 2 - 5
+        db = SessionLocal()
+        try:
+            rows = db.query(ReadingProgress.comic_id, ReadingProgress.page, ReadingProgress.page_count,
+                            ReadingProgress.updated_at).filter(ReadingProgress.updated_at > since).all()
+        finally:
+            db.close()
+        changed = []
+        with self._lock:
+            for row in rows:
+                record = ProgressRecord(*row)
+                current = self._records.get(record.comic_id)
+                if current is None or (current.updated_at or 0.0) < (record.updated_at or 0.0):
+                    self._records[record.comic_id] = record
+                    changed.append(record)
+                self._seen_at = max(self._seen_at, record.updated_at or 0.0)
+        if changed and self._on_change is not None:
+            self._on_change(changed)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                self._poll()
+            except Exception as e:
+                logger.error(f"Reading progress writer error: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._records),
+                "pending": len(self._pending),
+                "updates": self.updates,
+                "flushes": self.flushes,
+                "rows_written": self.rows_written,
+            }
+
+
+def remove_orphans(db: Session):
+    """删除已不存在的漫画的阅读进度，由调用方提交。"""
+    db.execute(sa_text("DELETE FROM reading_progress WHERE comic_id NOT IN (SELECT id FROM comics)"))
+
+
+progress_store = ProgressStore()
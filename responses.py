@@ -0,0 +1,149 @@
+import os
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+from starlette.concurrency import run_in_threadpool
+
+from config import IMAGE_CACHE_MAX_AGE
+
+CHUNK_SIZE = 256 * 1024
+
+
+def parse_range(range_header, file_size):
+    # 只支持单个区间：bytes=start-end / bytes=start- / bytes=-suffix
+    if not range_header or not range_header.startswith("bytes=") or file_size <= 0:
+        return None
+    spec = range_header[len("bytes="):].strip()
+    if "," in spec or "-" not in spec:
+        return None
+    start_text, end_text = spec.split("-", 1)
+    try:
+        if start_text == "":
+            length = int(end_text)
+            if length <= 0:
+                raise ValueError
+            start = max(0, file_size - length)
+            end = file_size - 1
+        else:
+            start = int(start_text)
+            end = int(end_text) if end_text else file_size - 1
+    except ValueError:
+        return "invalid"
+    if start >= file_size or start > end:
+        return "invalid"
+    return start, min(end, file_size - 1)
+
+
+class FileSliceResponse(Response):
+    """直接从文件的某个区间输出响应体，用于未压缩的 ZIP 成员和 Range 请求。
+
+    在线程池里 seek 后分块读取，不经过完整的内存缓冲。
+    """
+
+    def __init__(self, path, offset, length, status_code=200, headers=None, media_type=None):
+        self.path = path
+        self.offset = offset
+        self.length = length
+        super().__init__(content=b"", status_code=status_code, headers=headers, media_type=media_type)
+        self.headers["content-length"] = str(length)
+
+    async def __call__(self, scope, receive, send):
+        f = await run_in_threadpool(open, self.path, 'rb')
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            })
+            if scope.get("method") == "HEAD":
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            else:
+                await run_in_threadpool(f.seek, self.offset)
+                remaining = self.length
+                while remaining > 0:
+                    chunk = await run_in_threadpool(f.read, min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                if remaining > 0:
+                    # 文件在读取过程中被截断，补一个空的结束帧
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            f.close()
+        if self.background is not None:
+            await self.background()
+
+
+def _requested_range(request: Request, size, etag=None):
+    # If-Range 与当前 ETag 不一致时忽略 Range，返回完整内容
+    if_range = request.headers.get("if-range")
+    if if_range and etag and if_range.strip() != etag:
+        return None
+    return parse_range(request.headers.get("range"), size)
+
+
+def file_slice_response(request: Request, path, offset, length, media_type=None, headers=None, etag=None):
+    headers = dict(headers or {})
+    headers["Accept-Ranges"] = "bytes"
+    if etag:
+        headers["ETag"] = etag
+    byte_range = _requested_range(request, length, etag)
+    if byte_range == "invalid":
+        headers["Content-Range"] = f"bytes */{length}"
+        return Response(status_code=416, headers=headers)
+    if byte_range is None:
+        return FileSliceResponse(path, offset, length, headers=headers, media_type=media_type)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    return FileSliceResponse(path, offset + start, end - start + 1, status_code=206,
+                             headers=headers, media_type=media_type)
+
+
+def range_file_response(request: Request, path, media_type=None, headers=None, etag=None):
+    if not request.headers.get("range"):
+        headers = dict(headers or {})
+        headers["Accept-Ranges"] = "bytes"
+        if etag:
+            headers["ETag"] = etag
+        return FileResponse(path, media_type=media_type, headers=headers)
+    return file_slice_response(request, path, 0, os.path.getsize(path), media_type=media_type,
+                               headers=headers, etag=etag)
+
+
+def etag_matches(request: Request, etag):
+    # If-None-Match 可能包含多个 ETag 或 *，弱比较时忽略 W/ 前缀
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+
+
+def cache_headers(etag, mtime=None, max_age=IMAGE_CACHE_MAX_AGE):
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+    if mtime is not None:
+        headers["Last-Modified"] = formatdate(mtime, usegmt=True)
+    return headers
+
+
+def is_not_modified(request: Request, etag, mtime=None):
+    # 有 If-None-Match 时只看 ETag，否则再看 If-Modified-Since
+    if request.headers.get("if-none-match"):
+        return etag_matches(request, etag)
+    since = request.headers.get("if-modified-since")
+    if not since or mtime is None:
+        return False
+    try:
+        return int(mtime) <= parsedate_to_datetime(since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def not_modified_response(etag, headers=None):
+    headers = dict(headers or {})
+    headers["ETag"] = etag
+    return Response(status_code=304, headers=headers)
@@ -1,5 +1,13 @@
+import argparse
+
 import uvicorn
-from comic_main import app
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=18081)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="启动漫画阅读器")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=18081)
+    # 多个工作进程共用同一个数据库和缓存目录，资料库变化通过数据库里的共享版本同步
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+    # 多进程时 uvicorn 需要以导入字符串的形式加载应用
+    uvicorn.run("comic_main:app", host=args.host, port=args.port, workers=max(1, args.workers))
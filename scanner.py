@@ -0,0 +1,231 @@
+import logging
+import os
+from collections import defaultdict, namedtuple
+
+from sqlalchemy.orm import Session
+
+from archive_index import is_archive, remove_archive_indexes
+from archive_indexer import archive_indexer
+from database import Library, Comic, ScanDirectory
+from search_index import index_comics, remove_comics
+
+logger = logging.getLogger("uvicorn.info")
+
+# 批量删除时每条语句的 id 数量，避免超过 SQLite 的参数上限
+DELETE_BATCH_SIZE = 500
+
+
+# 扫描结果里的轻量记录，提交事务后仍可直接使用，不会触发 ORM 重新加载
+ScannedComic = namedtuple("ScannedComic", ["id", "title", "path", "library_id", "parent_id", "is_archive"])
+
+
+def _snapshot(comic):
+    return ScannedComic(comic.id, comic.title, comic.path, comic.library_id, comic.parent_id, comic.is_archive)
+
+
+class ScanResult:
+    def __init__(self, library_id):
+        self.library_id = library_id
+        self.valid_ids = set()
+        self.added = []
+        self.changed = []
+        self.updated = []
+        self.removed_ids = []
+        self.directories_visited = 0
+        self.directories_skipped = 0
+        self.archives_indexed = 0
+        self.index_failures = []
+
+    def summary(self):
+        return {
+            "library_id": self.library_id,
+            "directories_visited": self.directories_visited,
+            "directories_skipped": self.directories_skipped,
+            "comics_added": len(self.added),
+            "comics_removed": len(self.removed_ids),
+            "archives_indexed": self.archives_indexed,
+            "archives_failed": len(self.index_failures),
+        }
+
+
+def _parent_title(title):
+    return os.path.dirname(title)
+
+
+def _delete_in_batches(db: Session, model, ids):
+    ids = list(ids)
+    for i in range(0, len(ids), DELETE_BATCH_SIZE):
+        batch = ids[i:i + DELETE_BATCH_SIZE]
+        db.query(model).filter(model.id.in_(batch)).delete(synchronize_session=False)
+
+
+def _with_ancestors(rel_dirs):
+    wanted = set()
+    for rel_dir in rel_dirs:
+        while rel_dir not in wanted:
+            wanted.add(rel_dir)
+            if not rel_dir:
+                break
+            rel_dir = _parent_title(rel_dir)
+    return wanted
+
+
+def scan_library(db: Session, library: Library, job=None, dirty=None):
+    """增量扫描一个资料库：目录 mtime 没变就沿用数据库里的子项，只对变化的目录做 scandir。
+
+    job 为后台任务对象时，每处理一个目录汇报一次进度并检查是否被取消。
+    dirty 为文件监视器报告的目录（相对资料库根目录）时，只走到这些目录及其新增的子目录，
+    其余子树直接沿用数据库记录，不再逐个 stat。
+    """
+    try:
+        return _scan_library(db, library, job, dirty)
+    except Exception:
+        # 取消或出错时放弃本次扫描的所有改动
+        db.rollback()
+        raise
+
+
+def _scan_library(db: Session, library: Library, job, dirty):
+    root = library.path
+    result = ScanResult(library.id)
+
+    # 一次性载入该库已有的漫画记录和目录状态
+    comics = {c.title: c for c in db.query(Comic).filter(Comic.library_id == library.id)}
+    dir_states = {d.path: d for d in db.query(ScanDirectory).filter(ScanDirectory.library_id == library.id)}
+    children_by_parent = defaultdict(list)
+    for title in comics:
+        children_by_parent[_parent_title(title)].append(title)
+
+    visited_dirs = set()
+    wanted = _with_ancestors(dirty) if dirty is not None else None
+
+    def keep_subtree(title):
+        # 没有变化的子树：记录全部保留，目录状态也视为已访问
+        stack = [title]
+        while stack:
+            current = stack.pop()
+            comic = comics[current]
+            if comic.id is not None:
+                result.valid_ids.add(comic.id)
+            if not comic.is_archive:
+                visited_dirs.add(current)
+                stack.extend(children_by_parent.get(current, ()))
+
+    def keep_directory(rel_dir):
+        if rel_dir:
+            keep_subtree(rel_dir)
+        else:
+            result.valid_ids.update(c.id for c in comics.values() if c.id is not None)
+            visited_dirs.update(dir_states)
+
+    # 变化目录里的压缩包，提交目录结构后统一交给进程池建索引
+    archive_paths = []
+    # 按层处理：同一层新增的记录一次 flush 拿到 id，再作为下一层的 parent_id
+    level = [("", None)]
+    while level:
+        next_level = []
+        new_comics = []
+        for rel_dir, dir_comic in level:
+            abs_dir = os.path.join(root, rel_dir) if rel_dir else root
+            try:
+                dir_mtime = os.stat(abs_dir).st_mtime_ns
+            except OSError as e:
+                # 目录暂时无法访问（权限、网络盘断开等）时保留已有记录，等下次扫描再确认
+                logger.warning(f"Failed to read directory {abs_dir}, keeping its comics: {e}")
+                keep_directory(rel_dir)
+                continue
+            if dir_comic is not None and dir_comic.id is not None:
+                result.valid_ids.add(dir_comic.id)
+            visited_dirs.add(rel_dir)
+            result.directories_visited += 1
+            if job is not None:
+                job.check_cancelled()
+                job.advance(directories_visited=1)
+
+            state = dir_states.get(rel_dir)
+            if state is not None and state.mtime_ns == dir_mtime:
+                # 目录项没有变化，直接沿用已知的子项
+                result.directories_skipped += 1
+                for title in children_by_parent.get(rel_dir, ()):
+                    child = comics[title]
+                    if child.is_archive:
+                        result.valid_ids.add(child.id)
+                    elif wanted is not None and title not in wanted:
+                        keep_subtree(title)
+                    else:
+                        next_level.append((title, child))
+                continue
+
+            try:
+                entries = list(os.scandir(abs_dir))
+            except OSError as e:
+                # stat 之后目录被删除或没有列目录权限：同样保留已有记录，目录状态不更新
+                logger.warning(f"Failed to list directory {abs_dir}, keeping its comics: {e}")
+                keep_directory(rel_dir)
+                continue
+            if dir_comic is not None and dir_comic.id is not None:
+                result.changed.append(_snapshot(dir_comic))
+            parent_id = dir_comic.id if dir_comic is not None else None
+            for entry in entries:
+                try:
+                    entry_is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                entry_is_archive = not entry_is_dir and is_archive(entry.name)
+                if not entry_is_dir and not entry_is_archive:
+                    continue
+                title = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                comic = comics.get(title)
+                if comic is None:
+                    comic = Comic(title=title, path=entry.path, library_id=library.id,
+                                  parent_id=parent_id, is_archive=entry_is_archive)
+                    comics[title] = comic
+                    new_comics.append(comic)
+                else:
+                    if (comic.is_archive, comic.parent_id, comic.path) != (entry_is_archive, parent_id, entry.path):
+                        comic.is_archive = entry_is_archive
+                        comic.parent_id = parent_id
+                        comic.path = entry.path
+                        result.updated.append(_snapshot(comic))
+                    result.valid_ids.add(comic.id)
+                if entry_is_dir:
+                    next_level.append((title, comic))
+                else:
+                    archive_paths.append(entry.path)
+
+            if state is None:
+                state = ScanDirectory(library_id=library.id, path=rel_dir)
+                db.add(state)
+                dir_states[rel_dir] = state
+            state.mtime_ns = dir_mtime
+
+        if new_comics:
+            db.add_all(new_comics)
+            db.flush()
+            for comic in new_comics:
+                if comic.is_archive:
+                    result.valid_ids.add(comic.id)
+            result.added.extend(_snapshot(c) for c in new_comics)
+            if job is not None:
+                job.advance(comics_added=len(new_comics))
+        level = next_level
+
+    # 没有被访问到的记录对应的文件已经不存在
+    result.removed_ids = [c.id for c in comics.values() if c.id is not None and c.id not in result.valid_ids]
+    _delete_in_batches(db, Comic, result.removed_ids)
+    remove_archive_indexes(db, [c.path for c in comics.values()
+                                if c.id is not None and c.id not in result.valid_ids])
+    if job is not None:
+        job.advance(comics_removed=len(result.removed_ids))
+    stale_dirs = [s.id for p, s in dir_states.items() if p not in visited_dirs and s.id is not None]
+    _delete_in_batches(db, ScanDirectory, stale_dirs)
+    # 搜索索引与漫画表在同一个事务里更新
+    remove_comics(db, result.removed_ids)
+    index_comics(db, result.added + result.updated)
+    db.commit()
+
+    # 索引单独分批提交，不占用上面的写事务；已是最新的压缩包会被跳过
+    result.archives_indexed, result.index_failures = archive_indexer.index_archives(archive_paths, job)
+
+    logger.info(f"Scanned library {library.name}: {result.summary()}")
+    return result
@@ -0,0 +1,133 @@
+import logging
+import os
+
+from sqlalchemy import text as sa_text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("uvicorn.info")
+
+# trigram 分词器按 3 个字符切分，中日韩文本无需分词即可做子串匹配
+FTS_TABLE = "comics_fts"
+TRIGRAM_LENGTH = 3
+INDEX_BATCH_SIZE = 500
+
+fts_available = False
+
+
+def ensure_search_index(engine):
+    global fts_available
+    try:
+        with engine.begin() as connection:
+            connection.execute(sa_text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(name, path, tokenize='trigram')"
+            ))
+            indexed = connection.execute(sa_text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar()
+            total = connection.execute(sa_text("SELECT count(*) FROM comics")).scalar()
+            if indexed != total:
+                # 首次启用或索引与漫画表不一致时整体重建
+                logger.info(f"Rebuilding search index ({indexed} indexed, {total} comics)")
+                connection.execute(sa_text(f"DELETE FROM {FTS_TABLE}"))
+                rows = connection.execute(sa_text("SELECT id, title FROM comics")).fetchall()
+                _insert_rows(connection, [(row.id, row.title) for row in rows])
+        fts_available = True
+    except OperationalError as e:
+        fts_available = False
+        logger.warning(f"SQLite FTS5 trigram tokenizer unavailable, falling back to in-memory search: {e}")
+    return fts_available
+
+
+def _insert_rows(connection, rows):
+    statement = sa_text(f"INSERT INTO {FTS_TABLE}(rowid, name, path) VALUES (:id, :name, :path)")
+    params = [{"id": comic_id, "name": os.path.basename(title), "path": title} for comic_id, title in rows]
+    for i in range(0, len(params), INDEX_BATCH_SIZE):
+        connection.execute(statement, params[i:i + INDEX_BATCH_SIZE])
+
+
+def index_comics(db: Session, comics):
+    # comics 为带 id/title 的记录，已存在的先删除再插入
+    if not fts_available:
+        return
+    rows = [(c.id, c.title) for c in comics]
+    if not rows:
+        return
+    remove_comics(db, [comic_id for comic_id, _ in rows])
+    _insert_rows(db, rows)
+
+
+def remove_comics(db: Session, comic_ids):
+    if not fts_available:
+        return
+    comic_ids = list(comic_ids)
+    for i in range(0, len(comic_ids), INDEX_BATCH_SIZE):
+        batch = comic_ids[i:i + INDEX_BATCH_SIZE]
+        placeholders = ", ".join(f":id{n}" for n in range(len(batch)))
+        db.execute(sa_text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})"),
+                   {f"id{n}": comic_id for n, comic_id in enumerate(batch)})
+
+
+def remove_orphans(db: Session):
+    if not fts_available:
+        return
+    db.execute(sa_text(f"DELETE FROM {FTS_TABLE} WHERE rowid NOT IN (SELECT id FROM comics)"))
+
+
+def _fts_phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _rank(entry, query, base_score):
+    # 在 bm25 的基础上优先：标题完全相同 > 名称前缀 > 路径前缀
+    name = os.path.basename(entry.title).casefold()
+    title = entry.title.casefold()
+    if name == query or title == query:
+        boost = 0
+    elif name.startswith(query):
+        boost = 1
+    elif title.startswith(query):
+        boost = 2
+    else:
+        boost = 3
+    return (boost, base_score, len(entry.title), entry.id)
+
+
+def search(db: Session, catalog, query, limit=20, library_id=None):
+    """按空格分词，每个词都是标题的子串才算命中。
+
+    至少有一个词不短于 TRIGRAM_LENGTH（3 个字符）时走 FTS5 trigram 索引，较短的词只用来过滤候选；
+    全部词都更短时 trigram 无法匹配，退回到内存目录里逐条比较，耗时与（该资料库的）漫画数成正比。
+    """
+    query = " ".join(query.split()).casefold()
+    if not query:
+        return []
+    terms = query.split(" ")
+    long_terms = [t for t in terms if len(t) >= TRIGRAM_LENGTH]
+
+    if fts_available and long_terms:
+        match = " AND ".join(_fts_phrase(t) for t in long_terms)
+        params = {"match": match, "limit": max(limit * 10, 200)}
+        library_filter = ""
+        if library_id is not None:
+            # 资料库过滤放在 LIMIT 之前，否则候选可能被其他资料库的结果占满
+            library_filter = "AND comics.library_id = :library_id "
+            params["library_id"] = library_id
+        rows = db.execute(sa_text(
+            f"SELECT {FTS_TABLE}.rowid AS rowid, bm25({FTS_TABLE}, 10.0, 1.0) AS score FROM {FTS_TABLE} "
+            f"JOIN comics ON comics.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH :match {library_filter}ORDER BY score LIMIT :limit"
+        ), params).fetchall()
+        candidates = [(catalog.get(row.rowid), row.score) for row in rows]
+    elif library_id is not None:
+        candidates = [(catalog.get(comic_id), 0.0) for comic_id in list(catalog.by_library.get(library_id, ()))]
+    else:
+        candidates = [(entry, 0.0) for entry in list(catalog.entries.values())]
+
+    results = []
+    for entry, score in candidates:
+        if entry is None or (library_id is not None and entry.library_id != library_id):
+            continue
+        title = entry.title.casefold()
+        if all(t in title for t in terms):
+            results.append((_rank(entry, query, score), entry))
+    results.sort(key=lambda item: item[0])
+    return [entry for _, entry in results[:limit]]
@@ -0,0 +1,67 @@
+import io
+import zipfile
+
+import pytest
+from PIL import Image
+
+from archive_index import (UNKNOWN_DIMENSION, ArchiveMember, natural_sort_key, pack_members,
+                           read_archive_members, unpack_members)
+
+
+def png_bytes(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_pack_round_trip():
+    members = [
+        ArchiveMember("page1.jpg", 30, 100, 120, 0x1234abcd, 8, 0, 60, 90),
+        ArchiveMember("第02话/页10.png", 2 ** 40, 2 ** 33, 2 ** 34, 0, 0, 2, 1200, 1700),
+        ArchiveMember("broken.jpg", 0, 7, 7, 0xffffffff, 0, 1, UNKNOWN_DIMENSION, UNKNOWN_DIMENSION),
+        ArchiveMember("notes.txt", 500, 3, 3, 1, 0, 3, 0, 0),
+    ]
+    assert unpack_members(pack_members(members)) == members
+
+
+def test_pack_empty():
+    assert unpack_members(pack_members([])) == []
+
+
+def test_pack_stores_crc_as_unsigned():
+    # 部分库给出的 CRC 是有符号整数，写入时截成 32 位无符号
+    member = ArchiveMember("a.jpg", 0, 1, 1, -1, 0, 0, 0, 0)
+    assert unpack_members(pack_members([member]))[0].crc == 0xffffffff
+
+
+def test_unpack_rejects_unknown_format():
+    data = pack_members([ArchiveMember("a.jpg", 0, 1, 1, 0, 0, 0, 0, 0)])
+    with pytest.raises(ValueError):
+        unpack_members(b"XXXX" + data[4:])
+
+
+def test_natural_sort_key():
+    names = ["page10.jpg", "Page2.jpg", "page1.jpg", "cover.jpg"]
+    assert sorted(names, key=natural_sort_key) == ["cover.jpg", "page1.jpg", "Page2.jpg", "page10.jpg"]
+
+
+def test_read_zip_members(tmp_path):
+    path = tmp_path / "vol.zip"
+    page = png_bytes(40, 30)
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("p10.png", page, compress_type=zipfile.ZIP_STORED)
+        z.writestr("p2.png", page, compress_type=zipfile.ZIP_DEFLATED)
+        z.writestr("bad.jpg", b"not an image")
+        z.writestr("dir/", b"")
+
+    members = {m.name: m for m in read_archive_members(str(path))}
+    assert set(members) == {"p10.png", "p2.png", "bad.jpg"}
+    assert (members["p2.png"].position, members["p10.png"].position) == (1, 2)
+    assert (members["p10.png"].width, members["p10.png"].height) == (40, 30)
+    assert (members["p2.png"].width, members["p2.png"].height) == (40, 30)
+    # 图片头读过但无法识别，记为未知而不是留待以后重新读取
+    assert members["bad.jpg"].width == members["bad.jpg"].height == UNKNOWN_DIMENSION
+    # 未压缩成员的 offset 指向文件中的原始数据
+    stored = members["p10.png"]
+    assert path.read_bytes()[stored.offset:stored.offset + stored.file_size] == page
+    assert unpack_members(pack_members(list(members.values()))) == list(members.values())
@@ -0,0 +1,73 @@
+import os
+import zipfile
+
+import pytest
+
+from archive_index import load_archive_index, unpack_members
+from archive_indexer import ArchiveIndexer
+from database import ArchiveIndexRecord, SessionLocal
+
+
+@pytest.fixture
+def indexer():
+    indexer = ArchiveIndexer(workers=2, max_pending=2, batch_size=1)
+    yield indexer
+    indexer.shutdown()
+
+
+@pytest.fixture
+def archives(tmp_path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"vol{i}.zip"
+        with zipfile.ZipFile(path, "w") as z:
+            z.writestr("p2.jpg", b"2")
+            z.writestr("p1.jpg", b"1")
+        paths.append(str(path))
+    broken = tmp_path / "broken.zip"
+    broken.write_bytes(b"not a zip file")
+    paths.insert(1, str(broken))
+    yield paths
+    db = SessionLocal()
+    db.query(ArchiveIndexRecord).filter(ArchiveIndexRecord.path.in_(paths)).delete(synchronize_session=False)
+    db.commit()
+    db.close()
+
+
+def records(paths):
+    db = SessionLocal()
+    try:
+        rows = db.query(ArchiveIndexRecord).filter(ArchiveIndexRecord.path.in_(paths))
+        return {os.path.basename(r.path): (r.member_count, r.error) for r in rows}
+    finally:
+        db.close()
+
+
+def test_failed_archive_does_not_stop_the_others(indexer, archives):
+    broken = archives[1]
+    indexed, failures = indexer.index_archives(archives)
+    assert indexed == 3
+    assert [path for path, _ in failures] == [broken]
+
+    saved = records(archives)
+    assert saved["broken.zip"][0] == 0 and saved["broken.zip"][1]
+    assert {name: value for name, value in saved.items() if name != "broken.zip"} == \
+        {f"vol{i}.zip": (2, None) for i in range(3)}
+    assert [m.name for m in load_archive_index(archives[0]).members] == ["p1.jpg", "p2.jpg"]
+
+
+def test_unchanged_archives_are_skipped_until_modified(indexer, archives):
+    indexer.index_archives(archives)
+    # 失败记录同样按大小和 mtime 判断，文件不变时不再重试
+    assert indexer.index_archives(archives) == (0, [])
+
+    broken = archives[1]
+    with zipfile.ZipFile(broken, "w") as z:
+        z.writestr("p1.jpg", b"1")
+    assert indexer.index_archives(archives) == (1, [])
+
+    db = SessionLocal()
+    record = db.query(ArchiveIndexRecord).filter(ArchiveIndexRecord.path == broken).one()
+    assert record.error is None
+    assert [m.name for m in unpack_members(record.data)] == ["p1.jpg"]
+    db.close()
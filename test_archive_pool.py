@@ -0,0 +1,105 @@
+import os
+import zipfile
+
+import pytest
+
+import archive_pool as archive_pool_module
+from archive_pool import ArchivePool
+
+
+def make_zip(path, pages):
+    with zipfile.ZipFile(path, "w") as z:
+        for name, data in pages.items():
+            z.writestr(name, data)
+    return str(path)
+
+
+@pytest.fixture
+def archives(tmp_path):
+    return [make_zip(tmp_path / f"vol{i}.zip", {"p1.jpg": f"vol{i}".encode()}) for i in range(3)]
+
+
+def handle_of(pool, path):
+    with pool.acquire(path) as entry:
+        return entry, entry.handle
+
+
+def test_reuses_handles_and_evicts_least_recently_used(archives):
+    pool = ArchivePool(max_size=2, idle_seconds=0)
+    a, b, c = archives
+    assert pool.read(a, "p1.jpg") == b"vol0"
+    assert pool.read(b, "p1.jpg") == b"vol1"
+    _, handle_a = handle_of(pool, a)
+    _, handle_b = handle_of(pool, b)
+    assert pool.stats() == {"open": 2, "max_size": 2, "hits": 2, "misses": 2}
+
+    # a 最近用过，打开 c 时淘汰 b 并关闭它的句柄
+    pool.read(a, "p1.jpg")
+    assert pool.read(c, "p1.jpg") == b"vol2"
+    assert handle_b.fp is None
+    assert handle_of(pool, a)[1] is handle_a
+    assert pool.stats()["open"] == 2
+    pool.close_all()
+    assert handle_a.fp is None
+
+
+def test_entry_in_use_is_closed_by_last_user(archives):
+    pool = ArchivePool(max_size=1, idle_seconds=0)
+    a, b, _ = archives
+    with pool.acquire(a) as entry:
+        pool.read(b, "p1.jpg")
+        # 已被淘汰，但还在读取中，不能关闭
+        assert entry.evicted and entry.handle.fp is not None
+        assert entry.read("p1.jpg") == b"vol0"
+    assert entry.handle.fp is None
+    pool.close_all()
+
+
+def test_modified_archive_replaces_old_handle(archives):
+    pool = ArchivePool(max_size=4, idle_seconds=0)
+    a = archives[0]
+    old, old_handle = handle_of(pool, a)
+    make_zip(a, {"p1.jpg": b"rewritten", "p2.jpg": b"new"})
+    os.utime(a, ns=(0, 0))
+
+    assert pool.read(a, "p1.jpg") == b"rewritten"
+    assert pool.names(a) == {"p1.jpg", "p2.jpg"}
+    assert old.evicted and old_handle.fp is None
+    assert pool.stats()["open"] == 1
+
+    pool.invalidate(a)
+    assert pool.stats()["open"] == 0
+
+
+def test_idle_handles_are_closed(archives):
+    pool = ArchivePool(max_size=4, idle_seconds=30)
+    a, b, _ = archives
+    entry_a, handle_a = handle_of(pool, a)
+    handle_of(pool, b)
+    entry_a.last_used -= 60
+
+    pool.evict_idle()
+    assert handle_a.fp is None
+    assert pool.stats()["open"] == 1
+    pool.close_all()
+
+
+def test_handle_is_closed_when_listing_fails(tmp_path, monkeypatch):
+    closed = []
+
+    class BrokenArchive:
+        def namelist(self):
+            raise zipfile.BadZipFile("truncated central directory")
+
+        def close(self):
+            closed.append(True)
+
+    path = tmp_path / "broken.zip"
+    path.write_bytes(b"")
+    monkeypatch.setattr(archive_pool_module, "open_archive", lambda path: BrokenArchive())
+    pool = ArchivePool(max_size=4, idle_seconds=0)
+
+    with pytest.raises(zipfile.BadZipFile):
+        pool.read(str(path), "p1.jpg")
+    assert closed == [True]
+    assert pool.stats()["open"] == 0
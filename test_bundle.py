@@ -0,0 +1,32 @@
+import os
+import zipfile
+
+from archive_pool import archive_pool
+from bundle import bundle_pages, iter_page_data
+
+
+def test_iter_page_data_reads_stored_and_deflated_members(tmp_path, monkeypatch):
+    # 未压缩成员按偏移直接读取；Windows 上没有 os.pread
+    monkeypatch.delattr(os, "pread", raising=False)
+    path = tmp_path / "vol.zip"
+    pages = {"p1.jpg": b"first" * 100, "p2.jpg": b"second" * 100, "p10.jpg": b"tenth" * 100}
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("p10.jpg", pages["p10.jpg"], compress_type=zipfile.ZIP_STORED)
+        z.writestr("p2.jpg", pages["p2.jpg"], compress_type=zipfile.ZIP_DEFLATED)
+        z.writestr("p1.jpg", pages["p1.jpg"], compress_type=zipfile.ZIP_STORED)
+        z.writestr("notes.txt", b"skip")
+    try:
+        members, _ = bundle_pages(str(path), True)
+        assert [m.name for m in members] == ["p1.jpg", "p2.jpg", "p10.jpg"]
+        assert [(m.name, data) for m, data in iter_page_data(str(path), True, members)] == \
+            [(name, pages[name]) for name in ("p1.jpg", "p2.jpg", "p10.jpg")]
+    finally:
+        archive_pool.invalidate(str(path))
+
+
+def test_iter_page_data_folder_range(tmp_path):
+    for name in ("1.png", "2.png", "3.png"):
+        (tmp_path / name).write_bytes(name.encode())
+    members, _ = bundle_pages(str(tmp_path), False, start=1, end=3)
+    assert [(m.name, data) for m, data in iter_page_data(str(tmp_path), False, members)] == \
+        [("2.png", b"2.png"), ("3.png", b"3.png")]
@@ -0,0 +1,82 @@
+import base64
+import json
+
+import pytest
+
+from catalog import Catalog, LibraryEntry, decode_cursor, encode_cursor, make_entry
+
+
+def raw_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def make_catalog():
+    catalog = Catalog(snapshot_path=None)
+    titles = ["b", "A", "c", "a", "进击的巨人", "B/ch1", "B/ch2"]
+    entries = [make_entry(i + 1, title, 1, None, False) for i, title in enumerate(titles)]
+    catalog._replace(entries, [LibraryEntry(1, "lib", "/lib")])
+    return catalog
+
+
+@pytest.mark.parametrize("sort, key", [
+    ("title", ("进击的巨人", 5)),
+    ("recent", (1700000000.25, 3)),
+    ("added", (42,)),
+])
+def test_cursor_round_trip(sort, key):
+    for order in ("asc", "desc"):
+        cursor = encode_cursor(sort, order, key)
+        assert "=" not in cursor
+        assert decode_cursor(cursor, sort, order) == key
+
+
+def test_recent_cursor_accepts_integer_timestamp():
+    assert decode_cursor(raw_cursor(["recent", "asc", [0, 3]]), "recent", "asc") == (0.0, 3)
+
+
+def test_cursor_for_other_sort_is_rejected():
+    cursor = encode_cursor("title", "asc", ("a", 1))
+    with pytest.raises(ValueError, match="does not match"):
+        decode_cursor(cursor, "title", "desc")
+
+
+@pytest.mark.parametrize("cursor", [
+    "!!!",
+    raw_cursor({"sort": "added"}),
+    raw_cursor(["added", "asc"]),
+    raw_cursor(["added", "asc", 5]),
+    raw_cursor(["added", "asc", []]),
+    raw_cursor(["added", "asc", [1, 2]]),
+    raw_cursor(["added", "asc", ["1"]]),
+    raw_cursor(["added", "asc", [True]]),
+    raw_cursor(["added", "asc", [1.5]]),
+    raw_cursor(["title", "asc", [1, "a"]]),
+    raw_cursor(["recent", "asc", ["x", 1]]),
+    raw_cursor(["unknown", "asc", [1]]),
+])
+def test_malformed_cursor(cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(cursor, "added", "asc")
+
+
+@pytest.mark.parametrize("sort", ["added", "title", "recent"])
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_query_pages_cover_every_entry_once(sort, order):
+    catalog = make_catalog()
+    for comic_id in (3, 1, 6):
+        catalog.mark_opened(comic_id, at=1000.0 + comic_id)
+    expected, _, total = catalog.query(sort=sort, order=order)
+    assert total == len(expected) == 7
+
+    seen, cursor = [], None
+    while True:
+        page, cursor, _ = catalog.query(sort=sort, order=order, cursor=cursor, limit=3)
+        seen.extend(page)
+        if cursor is None:
+            break
+    assert [e.id for e in seen] == [e.id for e in expected]
+
+
+def test_query_title_order_ignores_case():
+    page, _, _ = make_catalog().query(sort="title")
+    assert [e.title for e in page][:4] == ["A", "a", "b", "B/ch1"]
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+from file_stat_cache import FileStatCache, join_library_path
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32
+
+
+@pytest.mark.parametrize("rel_path", [
+    "page1.jpg",
+    "Series A/ch1/page1.jpg",
+    "Series A/../Flat/page1.jpg",
+    "./page1.jpg",
+])
+def test_join_library_path_inside_root(rel_path):
+    root = os.path.join("library", "root")
+    path = join_library_path(root, rel_path)
+    assert path == os.path.join(root, os.path.normpath(rel_path))
+
+
+@pytest.mark.parametrize("rel_path", [
+    "",
+    ".",
+    "..",
+    "../config.py",
+    "Series A/../../config.py",
+    "/etc/passwd",
+    "page\x00.jpg",
+    # Windows 盘符相对路径和 UNC 路径：os.path.join 会丢掉资料库根目录
+    "C:foo",
+    "C:../secret.jpg",
+    "c:/Windows/win.ini",
+    "\\\\server\\share\\page.jpg",
+])
+def test_join_library_path_rejects_escapes(rel_path):
+    assert join_library_path(os.path.join("library", "root"), rel_path) is None
+
+
+def test_load_and_ttl(tmp_path):
+    (tmp_path / "ch1").mkdir()
+    page = tmp_path / "ch1" / "page1.png"
+    page.write_bytes(PNG_HEADER)
+    cache = FileStatCache(max_entries=4, ttl=60)
+
+    assert cache.get(str(tmp_path), "ch1/page1.png") is None
+    info = cache.load(str(tmp_path), "ch1/page1.png")
+    assert info.path == os.path.join(str(tmp_path), "ch1", "page1.png")
+    assert (info.size, info.media_type) == (len(PNG_HEADER), "image/png")
+    assert cache.get(str(tmp_path), "ch1/page1.png") is info
+    assert cache.stats()["hits"] == 1
+
+    cache.discard(str(tmp_path), "ch1/page1.png")
+    assert cache.get(str(tmp_path), "ch1/page1.png") is None
+
+
+def test_load_rejects_traversal_directories_and_missing_files(tmp_path):
+    (tmp_path / "lib").mkdir()
+    (tmp_path / "secret.png").write_bytes(PNG_HEADER)
+    (tmp_path / "lib" / "ch1").mkdir()
+    cache = FileStatCache()
+    root = str(tmp_path / "lib")
+
+    assert cache.load(root, "../secret.png") is None
+    assert cache.load(root, "ch1") is None
+    assert cache.load(root, "missing.png") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_expired_entry_is_refreshed(tmp_path):
+    page = tmp_path / "page1.png"
+    page.write_bytes(PNG_HEADER)
+    cache = FileStatCache(ttl=0)
+    first = cache.load(str(tmp_path), "page1.png")
+    assert cache.get(str(tmp_path), "page1.png") is None
+
+    page.write_bytes(PNG_HEADER + b"more")
+    second = cache.load(str(tmp_path), "page1.png")
+    assert second.size == first.size + 4
+
+    page.unlink()
+    assert cache.load(str(tmp_path), "page1.png") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_eviction(tmp_path):
+    for name in ("a.png", "b.png", "c.png"):
+        (tmp_path / name).write_bytes(PNG_HEADER)
+    cache = FileStatCache(max_entries=2, ttl=60)
+    for name in ("a.png", "b.png", "c.png"):
+        cache.load(str(tmp_path), name)
+    assert cache.get(str(tmp_path), "a.png") is None
+    assert cache.get(str(tmp_path), "c.png") is not None
@@ -0,0 +1,68 @@
+import io
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+import manifest
+from archive_index import UNKNOWN_DIMENSION, ArchiveMember, load_archive_index, update_index_dimensions
+from archive_pool import archive_pool
+from manifest import build_manifest, ensure_archive_dimensions
+
+
+def png_bytes(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_missing_dimensions_are_read_from_member_heads(tmp_path, monkeypatch):
+    path = tmp_path / "vol.zip"
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as z:
+        z.writestr("p1.png", png_bytes(40, 30) + b"\0" * 200000)
+        z.writestr("p2.jpg", b"not an image" * 1000)
+    try:
+        loaded = load_archive_index(str(path))
+        stat = path.stat()
+        # 模拟建索引时没能读到尺寸（例如 RAR）
+        update_index_dimensions(str(path), stat.st_size, stat.st_mtime_ns, {m.name: (0, 0) for m in loaded.members})
+
+        def read(*args):
+            raise AssertionError("whole page decompressed")
+
+        heads = []
+        read_head = archive_pool.read_head
+        monkeypatch.setattr(archive_pool, "read", read)
+        monkeypatch.setattr(archive_pool, "read_head",
+                            lambda *args: heads.append(args[1]) or read_head(*args))
+        loaded, complete, _ = ensure_archive_dimensions(str(path))
+        assert complete
+        assert sorted(heads) == ["p1.png", "p2.jpg"]
+        members = {m.name: (m.width, m.height) for m in loaded.members}
+        assert members == {"p1.png": (40, 30), "p2.jpg": (UNKNOWN_DIMENSION, UNKNOWN_DIMENSION)}
+
+        # 无法识别的成员只读一次
+        heads.clear()
+        ensure_archive_dimensions(str(path))
+        assert heads == []
+
+        pages = build_manifest(1, "vol", loaded.members, "/comic_image/1/", complete)["pages"]
+        assert [(p["name"], p["width"], p["height"]) for p in pages] == [("p1.png", 40, 30), ("p2.jpg", None, None)]
+    finally:
+        archive_pool.invalidate(str(path))
+
+
+def test_non_solid_seven_zip_is_not_decompressed_for_headers(tmp_path, monkeypatch):
+    # 非固实 7z 不能只读开头：不解压整页，尺寸留空
+    path = tmp_path / "vol.7z"
+    path.write_bytes(b"")
+    loaded = SimpleNamespace(members=[ArchiveMember("p1.jpg", 0, 10, 10, 0, 0, 0, 0, 0)])
+    monkeypatch.setattr(manifest.solid_page_cache, "handles", lambda path: False)
+    monkeypatch.setattr(manifest, "load_archive_index", lambda path: loaded)
+    monkeypatch.setattr(archive_pool, "read_head", lambda *args: None)
+    monkeypatch.setattr(manifest, "update_index_dimensions", lambda *args: pytest.fail("index rewritten"))
+
+    result, complete, _ = ensure_archive_dimensions(str(path))
+    assert result is loaded
+    assert complete is False
@@ -0,0 +1,81 @@
+import pytest
+from sqlalchemy import create_engine, inspect
+from sqlalchemy import text as sa_text
+from sqlalchemy.exc import IntegrityError
+
+import migrations
+from database import Base
+from migrations import MIGRATIONS, run_migrations, schema_version
+
+LATEST = max(version for version, _, _ in MIGRATIONS)
+
+
+def make_engine(tmp_path):
+    return create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+
+
+def columns(engine, table):
+    return {c["name"] for c in inspect(engine).get_columns(table)}
+
+
+def test_upgrade_legacy_database(tmp_path):
+    engine = make_engine(tmp_path)
+    # 最早版本的库：comics 没有 is_archive，也没有唯一索引，可能有重复记录
+    with engine.begin() as connection:
+        connection.execute(sa_text("CREATE TABLE libraries (id INTEGER PRIMARY KEY, name VARCHAR UNIQUE, "
+                                   "path VARCHAR UNIQUE)"))
+        connection.execute(sa_text("CREATE TABLE comics (id INTEGER PRIMARY KEY, title VARCHAR, path VARCHAR, "
+                                   "library_id INTEGER, parent_id INTEGER)"))
+        connection.execute(sa_text("INSERT INTO libraries VALUES (1, 'lib', '/lib')"))
+        connection.execute(sa_text(
+            "INSERT INTO comics VALUES (1, 'A', '/lib/A', 1, NULL), (2, 'A', '/lib/A', 1, NULL), "
+            "(3, 'A/ch1', '/lib/A/ch1', 1, 2), (4, 'B', '/lib/B', 1, NULL)"
+        ))
+    # 与启动时一样，先由 create_all 建出缺少的表，再执行迁移
+    Base.metadata.create_all(bind=engine)
+
+    assert run_migrations(engine) == LATEST
+
+    assert "is_archive" in columns(engine, "comics")
+    assert "error" in columns(engine, "archive_indexes")
+    assert {"comic_id", "page", "page_count", "updated_at"} <= columns(engine, "reading_progress")
+    index_names = {index["name"] for index in inspect(engine).get_indexes("comics")}
+    assert {"ux_comics_library_title", "ix_comics_parent_id_id", "ix_comics_path"} <= index_names
+    with engine.begin() as connection:
+        assert schema_version(connection) == LATEST
+        # 重复记录只保留 id 最小的一条，子项改挂到保留的记录下
+        rows = connection.execute(sa_text("SELECT id, title, parent_id FROM comics ORDER BY id")).fetchall()
+        assert [tuple(row) for row in rows] == [(1, "A", None), (3, "A/ch1", 1), (4, "B", None)]
+        assert connection.execute(sa_text("SELECT version FROM catalog_state WHERE id = 1")).scalar() == 0
+    with pytest.raises(IntegrityError):
+        with engine.begin() as connection:
+            connection.execute(sa_text("INSERT INTO comics (title, path, library_id) VALUES ('B', '/lib/B', 1)"))
+
+
+def test_migrations_are_repeatable_on_current_schema(tmp_path):
+    engine = make_engine(tmp_path)
+    Base.metadata.create_all(bind=engine)
+    assert run_migrations(engine) == LATEST
+    with engine.begin() as connection:
+        connection.execute(sa_text("PRAGMA user_version = 0"))
+    # 每个迁移都要能在已是最新结构的库上重复执行
+    assert run_migrations(engine) == LATEST
+
+
+def test_runs_pending_migrations_in_version_order(tmp_path, monkeypatch):
+    engine = make_engine(tmp_path)
+    calls = []
+
+    def step(version):
+        def func(connection):
+            calls.append((version, schema_version(connection)))
+        return func
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", [(3, "c", step(3)), (1, "a", step(1)), (2, "b", step(2))])
+    assert run_migrations(engine) == 3
+    # 每个迁移执行时，版本号停在上一个迁移
+    assert calls == [(1, 0), (2, 1), (3, 2)]
+
+    calls.clear()
+    assert run_migrations(engine) == 3
+    assert calls == []
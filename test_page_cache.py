@@ -0,0 +1,81 @@
+import os
+import zipfile
+
+import py7zr
+import pytest
+
+from archive_pool import archive_pool
+from page_cache import SolidPageCache, volume_key
+
+PAGES = {"p1.jpg": b"first" * 200, "sub/p2.jpg": b"second" * 200}
+
+
+@pytest.fixture
+def solid_7z(tmp_path):
+    # py7zr 默认把所有成员压进同一个 folder，即固实压缩
+    path = tmp_path / "vol.7z"
+    with py7zr.SevenZipFile(path, "w") as z:
+        for name, data in PAGES.items():
+            z.writestr(data, name)
+    yield str(path)
+    archive_pool.invalidate(str(path))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = SolidPageCache(root=str(tmp_path / "pages"), max_bytes=1 << 20, workers=1, enabled=True)
+    yield cache
+    cache.shutdown()
+
+
+def test_extracted_unpacks_solid_volume_once(cache, solid_7z):
+    assert cache.handles(solid_7z)
+    with cache.extracted(solid_7z) as volume_dir:
+        assert volume_dir is not None
+        # 使用期间不会被淘汰
+        assert cache.cache._pinned.get(volume_key(solid_7z)) == 1
+        for name, data in PAGES.items():
+            with open(cache.page_path(volume_dir, name), "rb") as f:
+                assert f.read() == data
+    assert not cache.cache._pinned.get(volume_key(solid_7z))
+
+    # 之后的翻页直接命中磁盘缓存
+    assert cache.lookup(solid_7z, "sub/p2.jpg") == os.path.join(volume_dir, "sub", "p2.jpg")
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["pending_extractions"] == 0
+
+
+def test_lookup_schedules_background_extraction(cache, solid_7z):
+    assert cache.lookup(solid_7z, "p1.jpg") is None
+    with cache._lock:
+        future = cache._pending.get(volume_key(solid_7z))
+    if future is not None:
+        future.result(10)
+    path = cache.lookup(solid_7z, "p1.jpg")
+    with open(path, "rb") as f:
+        assert f.read() == PAGES["p1.jpg"]
+
+
+def test_page_path_stays_inside_volume(cache, solid_7z):
+    with cache.extracted(solid_7z) as volume_dir:
+        assert cache.page_path(volume_dir, "../vol.7z") is None
+        assert cache.page_path(volume_dir, "sub") is None
+        assert cache.page_path(volume_dir, "missing.jpg") is None
+
+
+def test_non_solid_or_oversized_volumes_are_not_extracted(tmp_path, solid_7z):
+    zip_path = tmp_path / "vol.zip"
+    with zipfile.ZipFile(zip_path, "w") as z:
+        z.writestr("p1.jpg", b"page")
+    small = SolidPageCache(root=str(tmp_path / "small"), max_bytes=100, workers=1, enabled=True)
+    disabled = SolidPageCache(root=str(tmp_path / "off"), max_bytes=1 << 20, workers=1, enabled=False)
+
+    assert not small.handles(str(zip_path))
+    # 解压后超过缓存上限
+    assert not small.handles(solid_7z)
+    with small.extracted(solid_7z) as volume_dir:
+        assert volume_dir is None
+    assert small.lookup(solid_7z, "p1.jpg") is None
+    assert small.stats()["pending_extractions"] == 0
+    assert disabled.lookup(solid_7z, "p1.jpg") is None
+    assert not os.path.exists(tmp_path / "off")
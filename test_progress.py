@@ -0,0 +1,92 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy import text as sa_text
+
+from database import ReadingProgress, SessionLocal
+from progress import UPSERT_SQL, ProgressRecord, ProgressStore
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'progress.db'}")
+    ReadingProgress.__table__.create(bind=engine)
+    return engine
+
+
+def rows(engine):
+    with engine.begin() as connection:
+        result = connection.execute(sa_text(
+            "SELECT comic_id, page, page_count, updated_at FROM reading_progress ORDER BY comic_id"))
+        return [tuple(row) for row in result]
+
+
+def upsert(engine, *records):
+    with engine.begin() as connection:
+        connection.execute(UPSERT_SQL, [r._asdict() for r in records])
+
+
+def test_upsert_inserts_and_updates(engine):
+    upsert(engine, ProgressRecord(1, 3, 20, 100.0), ProgressRecord(2, 0, None, 100.0))
+    upsert(engine, ProgressRecord(1, 7, 20, 200.0))
+    assert rows(engine) == [(1, 7, 20, 200.0), (2, 0, None, 100.0)]
+
+
+def test_upsert_ignores_older_records(engine):
+    # 其他工作进程晚到的旧进度不能覆盖更新的
+    upsert(engine, ProgressRecord(1, 7, 20, 200.0))
+    upsert(engine, ProgressRecord(1, 3, 20, 150.0))
+    assert rows(engine) == [(1, 7, 20, 200.0)]
+
+
+def test_upsert_applies_same_timestamp(engine):
+    upsert(engine, ProgressRecord(1, 7, 20, 200.0))
+    upsert(engine, ProgressRecord(1, 8, 20, 200.0))
+    assert rows(engine) == [(1, 8, 20, 200.0)]
+
+
+@pytest.fixture
+def store():
+    store = ProgressStore(flush_interval=60, max_pending=1000)
+    yield store
+    db = SessionLocal()
+    db.query(ReadingProgress).filter(ReadingProgress.comic_id.in_([901, 902, 903])).delete(synchronize_session=False)
+    db.commit()
+    db.close()
+
+
+def saved(comic_ids):
+    db = SessionLocal()
+    try:
+        result = db.query(ReadingProgress.comic_id, ReadingProgress.page).filter(
+            ReadingProgress.comic_id.in_(comic_ids)).order_by(ReadingProgress.comic_id)
+        return [tuple(row) for row in result]
+    finally:
+        db.close()
+
+
+def test_store_batches_updates_until_flush(store):
+    for page in range(5):
+        store.record(901, page, 10)
+    store.record(902, -3)
+    assert store.get(902).page == 0
+    assert saved([901, 902]) == []
+    assert store.stats()["pending"] == 2
+
+    # 同一本漫画多次翻页只写最后一次
+    assert store.flush() == 2
+    assert saved([901, 902]) == [(901, 4), (902, 0)]
+    assert store.flush() == 0
+    assert store.stats()["rows_written"] == 2
+
+
+def test_store_recent_and_retain(store):
+    store.record(901, 1)
+    store.record(902, 1)
+    store.record(903, 1)
+    store._records[902] = store._records[902]._replace(updated_at=store._records[903].updated_at + 1)
+    assert [r.comic_id for r in store.recent()] == [902, 903, 901]
+
+    store.retain({901, 902})
+    assert store.get(903) is None
+    store.flush()
+    assert saved([901, 902, 903]) == [(901, 1), (902, 1)]
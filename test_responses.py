@@ -0,0 +1,180 @@
+import asyncio
+import os
+from email.utils import formatdate
+
+import pytest
+from fastapi import Request
+
+import responses
+from responses import (FileSliceResponse, cache_headers, etag_matches, file_slice_response, is_not_modified,
+                       not_modified_response, parse_range)
+
+
+def make_request(headers=None):
+    raw = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "headers": raw})
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=10-", (10, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-500", (0, 99)),
+    ("bytes=90-500", (90, 99)),
+    ("bytes=99-99", (99, 99)),
+])
+def test_parse_range_single(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "bytes=100-",
+    "bytes=20-10",
+    "bytes=-0",
+    "bytes=a-b",
+    "bytes=5-x",
+])
+def test_parse_range_unsatisfiable(header):
+    assert parse_range(header, 100) == "invalid"
+
+
+@pytest.mark.parametrize("header", [None, "", "items=0-9", "bytes=0-9,20-29", "bytes=10"])
+def test_parse_range_ignored(header):
+    # 不支持的写法按没有 Range 处理，返回完整内容
+    assert parse_range(header, 100) is None
+
+
+def test_parse_range_empty_file():
+    assert parse_range("bytes=0-9", 0) is None
+
+
+def test_file_slice_response_full(tmp_path):
+    path = tmp_path / "member.bin"
+    path.write_bytes(bytes(range(100)))
+    response = file_slice_response(make_request(), str(path), 10, 50, media_type="image/jpeg", etag='"abc"')
+    assert isinstance(response, FileSliceResponse)
+    assert response.status_code == 200
+    assert (response.offset, response.length) == (10, 50)
+    assert response.headers["content-length"] == "50"
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["etag"] == '"abc"'
+
+
+def test_file_slice_response_partial(tmp_path):
+    path = tmp_path / "member.bin"
+    path.write_bytes(bytes(range(100)))
+    response = file_slice_response(make_request({"Range": "bytes=5-14"}), str(path), 10, 50)
+    assert response.status_code == 206
+    # 区间相对成员数据计算，偏移加上成员在文件里的起点
+    assert (response.offset, response.length) == (15, 10)
+    assert response.headers["content-range"] == "bytes 5-14/50"
+
+
+def test_file_slice_response_unsatisfiable(tmp_path):
+    path = tmp_path / "member.bin"
+    path.write_bytes(b"x" * 10)
+    response = file_slice_response(make_request({"Range": "bytes=50-"}), str(path), 0, 10)
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */10"
+
+
+def test_file_slice_response_if_range_mismatch(tmp_path):
+    path = tmp_path / "member.bin"
+    path.write_bytes(b"x" * 10)
+    request = make_request({"Range": "bytes=0-4", "If-Range": '"old"'})
+    response = file_slice_response(request, str(path), 0, 10, etag='"new"')
+    assert response.status_code == 200
+    assert response.length == 10
+
+
+def stream(response, method="GET"):
+    messages = []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(response({"type": "http", "method": method, "headers": []}, receive, send))
+    return messages
+
+
+@pytest.fixture
+def without_pread(monkeypatch):
+    # Windows 上没有 os.pread，输出不能依赖它
+    monkeypatch.delattr(os, "pread", raising=False)
+
+
+def test_file_slice_response_streams_body(tmp_path, monkeypatch, without_pread):
+    monkeypatch.setattr(responses, "CHUNK_SIZE", 7)
+    path = tmp_path / "member.bin"
+    data = bytes(range(100))
+    path.write_bytes(data)
+    messages = stream(file_slice_response(make_request({"Range": "bytes=3-32"}), str(path), 10, 50))
+
+    assert messages[0]["type"] == "http.response.start"
+    assert messages[0]["status"] == 206
+    bodies = messages[1:]
+    assert b"".join(m["body"] for m in bodies) == data[13:43]
+    assert [len(m["body"]) for m in bodies] == [7, 7, 7, 7, 2]
+    assert [m["more_body"] for m in bodies] == [True, True, True, True, False]
+
+
+def test_file_slice_response_truncated_file(tmp_path, without_pread):
+    path = tmp_path / "member.bin"
+    path.write_bytes(b"x" * 10)
+    messages = stream(FileSliceResponse(str(path), 5, 20))
+    assert b"".join(m["body"] for m in messages[1:]) == b"x" * 5
+    assert messages[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+
+
+def test_file_slice_response_head(tmp_path):
+    path = tmp_path / "member.bin"
+    path.write_bytes(b"x" * 10)
+    messages = stream(FileSliceResponse(str(path), 0, 10), method="HEAD")
+    assert (b"content-length", b"10") in messages[0]["headers"]
+    assert messages[1:] == [{"type": "http.response.body", "body": b"", "more_body": False}]
+
+
+@pytest.mark.parametrize("header, matches", [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"x", "abc"', True),
+    ('"x",W/"abc"', True),
+    ("*", True),
+    ('"abcd"', False),
+    ("abc", False),
+])
+def test_etag_matches(header, matches):
+    assert etag_matches(make_request({"If-None-Match": header}), '"abc"') is matches
+
+
+def test_etag_matches_without_header():
+    assert etag_matches(make_request(), '"abc"') is False
+
+
+def test_is_not_modified_prefers_etag():
+    # 有 If-None-Match 时不再看 If-Modified-Since
+    since = formatdate(2000, usegmt=True)
+    request = make_request({"If-None-Match": '"other"', "If-Modified-Since": since})
+    assert is_not_modified(request, '"abc"', mtime=1000) is False
+
+
+def test_is_not_modified_since():
+    since = formatdate(2000, usegmt=True)
+    assert is_not_modified(make_request({"If-Modified-Since": since}), '"abc"', mtime=2000.5) is True
+    assert is_not_modified(make_request({"If-Modified-Since": since}), '"abc"', mtime=2001) is False
+    assert is_not_modified(make_request({"If-Modified-Since": "garbage"}), '"abc"', mtime=1000) is False
+    assert is_not_modified(make_request({"If-Modified-Since": since}), '"abc"') is False
+
+
+def test_cache_headers_and_not_modified():
+    headers = cache_headers('"abc"', mtime=0, max_age=60)
+    assert headers == {"ETag": '"abc"', "Cache-Control": "public, max-age=60",
+                       "Last-Modified": "Thu, 01 Jan 1970 00:00:00 GMT"}
+    response = not_modified_response('"abc"', headers)
+    assert response.status_code == 304
+    assert response.body == b""
+    assert response.headers["etag"] == '"abc"'
+    assert response.headers["cache-control"] == "public, max-age=60"
@@ -0,0 +1,172 @@
+import os
+import shutil
+
+import pytest
+
+import scanner
+from database import SessionLocal, Library, Comic, ScanDirectory
+from scanner import scan_library
+
+
+@pytest.fixture
+def indexed(monkeypatch):
+    # 压缩包索引由进程池完成，这里只记录扫描交出去的路径
+    paths = []
+
+    def index_archives(archive_paths, job=None):
+        paths.extend(archive_paths)
+        return len(archive_paths), []
+
+    monkeypatch.setattr(scanner.archive_indexer, "index_archives", index_archives)
+    return paths
+
+
+@pytest.fixture
+def library(tmp_path, indexed):
+    root = tmp_path / "lib"
+    for rel in ("Flat", "Series/ch1", "Series/ch2"):
+        (root / rel).mkdir(parents=True)
+    (root / "vol1.zip").write_bytes(b"")
+    (root / "Series" / "extra.cbz.txt").write_bytes(b"")
+
+    db = SessionLocal()
+    lib = Library(name=f"scan-{tmp_path.name}", path=str(root))
+    db.add(lib)
+    db.commit()
+    yield db, lib, root
+    db.query(Comic).filter(Comic.library_id == lib.id).delete()
+    db.query(ScanDirectory).filter(ScanDirectory.library_id == lib.id).delete()
+    db.delete(lib)
+    db.commit()
+    db.close()
+
+
+def comics(db, lib):
+    rows = db.query(Comic).filter(Comic.library_id == lib.id).all()
+    by_id = {c.id: c.title for c in rows}
+    return {c.title: (by_id.get(c.parent_id), bool(c.is_archive)) for c in rows}
+
+
+def test_first_scan_adds_folders_and_archives(library, indexed):
+    db, lib, root = library
+    result = scan_library(db, lib)
+
+    assert comics(db, lib) == {
+        "Flat": (None, False),
+        "Series": (None, False),
+        os.path.join("Series", "ch1"): ("Series", False),
+        os.path.join("Series", "ch2"): ("Series", False),
+        "vol1.zip": (None, True),
+    }
+    assert len(result.added) == 5
+    assert result.removed_ids == []
+    assert indexed == [str(root / "vol1.zip")]
+
+
+def test_unchanged_rescan_reuses_directory_states(library):
+    db, lib, _ = library
+    scan_library(db, lib)
+    before = comics(db, lib)
+
+    result = scan_library(db, lib)
+    assert result.added == [] and result.removed_ids == [] and result.updated == []
+    assert result.directories_skipped == result.directories_visited == 5
+    assert comics(db, lib) == before
+
+
+def test_rescan_applies_filesystem_changes(library):
+    db, lib, root = library
+    scan_library(db, lib)
+    ids = {c.title: c.id for c in db.query(Comic).filter(Comic.library_id == lib.id)}
+
+    shutil.rmtree(root / "Series" / "ch2")
+    (root / "Series" / "ch3" / "part").mkdir(parents=True)
+    (root / "Flat" / "bonus.7z").write_bytes(b"")
+    result = scan_library(db, lib)
+
+    assert sorted(c.title for c in result.added) == sorted([
+        os.path.join("Flat", "bonus.7z"), os.path.join("Series", "ch3"), os.path.join("Series", "ch3", "part")])
+    assert result.removed_ids == [ids[os.path.join("Series", "ch2")]]
+    current = comics(db, lib)
+    assert os.path.join("Series", "ch2") not in current
+    assert current[os.path.join("Series", "ch3", "part")] == (os.path.join("Series", "ch3"), False)
+    assert current[os.path.join("Flat", "bonus.7z")] == ("Flat", True)
+    # 没有变化的记录保留原来的 id
+    kept = {c.title: c.id for c in db.query(Comic).filter(Comic.library_id == lib.id)}
+    assert all(kept[title] == comic_id for title, comic_id in ids.items() if title in kept)
+    paths = {s.path for s in db.query(ScanDirectory).filter(ScanDirectory.library_id == lib.id)}
+    assert os.path.join("Series", "ch2") not in paths
+
+
+def test_dirty_scan_only_visits_reported_directories(library):
+    db, lib, root = library
+    scan_library(db, lib)
+
+    (root / "Series" / "ch1" / "sub").mkdir()
+    result = scan_library(db, lib, dirty=[os.path.join("Series", "ch1")])
+
+    assert [c.title for c in result.added] == [os.path.join("Series", "ch1", "sub")]
+    assert result.removed_ids == []
+    # 根目录、Series 和 ch1 各访问一次，新子目录也要进去；Flat 和 ch2 直接沿用
+    assert result.directories_visited == 4
+
+
+def test_unreadable_directory_keeps_its_comics(library, monkeypatch):
+    db, lib, root = library
+    scan_library(db, lib)
+    before = comics(db, lib)
+
+    os.utime(root / "Series", ns=(0, 0))
+    series = str(root / "Series")
+    real_stat = os.stat
+
+    def stat(path, *args, **kwargs):
+        if path == series:
+            raise PermissionError(13, "Permission denied", path)
+        return real_stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(scanner.os, "stat", stat)
+    result = scan_library(db, lib)
+    assert result.removed_ids == []
+    assert comics(db, lib) == before
+
+    # 库根目录也读不到（例如网络盘断开）时同样保留全部记录
+    root_path = str(root)
+    monkeypatch.setattr(scanner.os, "stat",
+                        lambda path, *args, **kwargs: stat(series if path == root_path else path, *args, **kwargs))
+    result = scan_library(db, lib)
+    assert result.removed_ids == []
+    assert comics(db, lib) == before
+
+
+def test_unlistable_directory_keeps_its_comics(library, monkeypatch):
+    db, lib, root = library
+    scan_library(db, lib)
+    before = comics(db, lib)
+
+    # stat 成功但列目录失败（权限不足、扫描途中被删除）
+    os.utime(root / "Series", ns=(0, 0))
+    series = str(root / "Series")
+    real_scandir = os.scandir
+
+    def scandir(path):
+        if path == series:
+            raise PermissionError(13, "Permission denied", path)
+        return real_scandir(path)
+
+    monkeypatch.setattr(scanner.os, "scandir", scandir)
+    result = scan_library(db, lib)
+    assert result.removed_ids == []
+    assert comics(db, lib) == before
+    # 目录状态没有更新，下次扫描还会重新列目录
+    state = db.query(ScanDirectory).filter(ScanDirectory.library_id == lib.id, ScanDirectory.path == "Series").one()
+    assert state.mtime_ns != 0
+
+    # 库根目录列不出来时同样保留全部记录
+    root_path = str(root)
+    os.utime(root, ns=(0, 0))
+    monkeypatch.setattr(scanner.os, "scandir", lambda path: scandir(series if path == root_path else path))
+    result = scan_library(db, lib)
+    assert result.removed_ids == []
+    assert comics(db, lib) == before
+    assert db.query(ScanDirectory).filter(ScanDirectory.library_id == lib.id).count() == 5
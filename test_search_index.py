@@ -0,0 +1,91 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import search_index
+from catalog import Catalog, LibraryEntry, make_entry
+from database import Comic, Library
+from search_index import ensure_search_index, index_comics, remove_comics, search
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    # ensure_search_index 会改模块级的 fts_available，测试结束后还原
+    monkeypatch.setattr(search_index, "fts_available", False)
+    engine = create_engine(f"sqlite:///{tmp_path / 'search.db'}")
+    Library.__table__.create(bind=engine)
+    Comic.__table__.create(bind=engine)
+    return engine
+
+
+def add_comics(engine, titles_by_library):
+    db = sessionmaker(bind=engine)()
+    for library_id, titles in titles_by_library.items():
+        db.add(Library(id=library_id, name=f"lib{library_id}", path=f"/lib{library_id}"))
+        db.add_all(Comic(title=title, path=f"/lib{library_id}/{title}", library_id=library_id) for title in titles)
+    db.commit()
+    catalog = Catalog(snapshot_path=None)
+    catalog._replace([make_entry(c.id, c.title, c.library_id, None, False) for c in db.query(Comic)],
+                     [LibraryEntry(i, f"lib{i}", f"/lib{i}") for i in titles_by_library])
+    return db, catalog
+
+
+def titles(results):
+    return [entry.title for entry in results]
+
+
+def test_fts_search_ranks_and_filters_library_before_limit(engine):
+    # 另一个资料库里大量同名结果不能把候选占满
+    db, catalog = add_comics(engine, {
+        1: ["Dragon Ball/vol1", "Dragon Quest", "My Dragon", "Other"],
+        2: [f"Dragon {n}" for n in range(300)],
+    })
+    assert ensure_search_index(engine)
+
+    assert titles(search(db, catalog, "dragon", limit=10, library_id=1)) == \
+        ["Dragon Quest", "Dragon Ball/vol1", "My Dragon"]
+    assert titles(search(db, catalog, "  DRAGON   vol1 ", library_id=1)) == ["Dragon Ball/vol1"]
+    assert len(search(db, catalog, "dragon", limit=10)) == 10
+    assert search(db, catalog, "missing") == []
+    db.close()
+
+
+def test_short_terms_fall_back_to_catalog_scan(engine):
+    db, catalog = add_comics(engine, {1: ["ab", "abc", "xaby"], 2: ["ab2"]})
+    assert ensure_search_index(engine)
+
+    # 两个字符的词 trigram 匹配不到，逐条比较内存目录
+    assert titles(search(db, catalog, "ab", library_id=1)) == ["ab", "abc", "xaby"]
+    assert titles(search(db, catalog, "ab")) == ["ab", "abc", "ab2", "xaby"]
+    db.close()
+
+
+def test_index_updates_follow_comic_changes(engine):
+    db, catalog = add_comics(engine, {1: ["One Piece"]})
+    ensure_search_index(engine)
+    comic = Comic(title="Piece of Cake", path="/lib1/Piece of Cake", library_id=1)
+    db.add(comic)
+    db.flush()
+    index_comics(db, [comic])
+    catalog.add_comic(comic)
+    assert titles(search(db, catalog, "piece")) == ["Piece of Cake", "One Piece"]
+
+    remove_comics(db, [comic.id])
+    assert titles(search(db, catalog, "piece")) == ["One Piece"]
+    db.close()
+
+
+def test_missing_fts5_falls_back_to_catalog_scan(engine, monkeypatch):
+    db, catalog = add_comics(engine, {1: ["Dragon Quest", "Other"], 2: ["Dragon 2"]})
+
+    # 模拟 SQLite 编译时没有 trigram 分词器
+    sa_text = search_index.sa_text
+    monkeypatch.setattr(search_index, "sa_text", lambda sql: sa_text(sql.replace("trigram", "no_such_tokenizer")))
+    assert ensure_search_index(engine) is False
+    monkeypatch.setattr(search_index, "sa_text", sa_text)
+
+    # 没有 FTS 表时 index_comics/remove_comics 什么都不做，搜索走内存目录
+    index_comics(db, db.query(Comic).all())
+    assert titles(search(db, catalog, "dragon")) == ["Dragon 2", "Dragon Quest"]
+    assert titles(search(db, catalog, "dragon", library_id=1)) == ["Dragon Quest"]
+    db.close()
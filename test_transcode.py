@@ -0,0 +1,79 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import transcode
+from transcode import DerivedImageStore, Transform
+
+
+def jpeg_bytes(width, height):
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), "white").save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # 用线程池代替进程池，测试里可以替换 render_derived
+    store = DerivedImageStore(root=str(tmp_path / "derived"), max_bytes=1 << 20, workers=1, max_pending=4)
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(store, "_get_executor", lambda: executor)
+    yield store
+    executor.shutdown(wait=True)
+
+
+def test_get_or_create_renders_once(store):
+    loads = []
+
+    async def load_source():
+        loads.append(1)
+        return ("bytes", jpeg_bytes(200, 100))
+
+    async def main():
+        transform = Transform(50, "jpeg", 80)
+        return await asyncio.gather(*(store.get_or_create("c1/p1", transform, load_source) for _ in range(3)))
+
+    paths = asyncio.run(main())
+    assert len(set(paths)) == 1 and loads == [1]
+    with Image.open(paths[0]) as img:
+        assert img.size == (50, 25)
+    assert store.stats()["generated"] == 1
+    assert os.listdir(store.root) == [os.path.basename(paths[0])]
+
+
+def test_cancelled_render_removes_output(store, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+
+    def render_derived(source, out_path, *transform):
+        started.set()
+        release.wait(5)
+        with open(out_path, "wb") as f:
+            f.write(b"late output")
+        return True
+
+    monkeypatch.setattr(transcode, "render_derived", render_derived)
+
+    async def load_source():
+        return ("bytes", b"")
+
+    async def main():
+        task = asyncio.ensure_future(store.get_or_create("c1/p1", Transform(50, "jpeg", 80), load_source))
+        while not started.is_set():
+            await asyncio.sleep(0.01)
+        # 客户端断开：渲染已经在跑，取消后它仍会写出文件
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert store.stats()["pending"] == 0
+    release.set()
+    store._get_executor().submit(lambda: None).result(5)
+    assert os.listdir(store.root) == []
+    assert store.stats()["generated"] == 0
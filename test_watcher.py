@@ -0,0 +1,105 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from watcher import IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_Q_OVERFLOW, LibraryWatcher, WatchedLibrary
+
+
+@pytest.fixture
+def watcher(tmp_path):
+    # 不启动监视线程，直接驱动事件处理和 _flush
+    watcher = LibraryWatcher(backend="poll", debounce=1.0, max_delay=5.0)
+    library = WatchedLibrary(1, str(tmp_path))
+    watcher._libraries[1] = library
+    watcher._watches[7] = (1, library.root)
+    changes = []
+    watcher._on_change = lambda *args: changes.append(args)
+    return watcher, library, changes
+
+
+def test_events_are_coalesced_until_quiet(watcher):
+    watcher, library, changes = watcher
+    sub = os.path.join(library.root, "sub")
+    watcher._watches[8] = (1, sub)
+    watcher._handle_event(7, IN_CREATE, "p1.jpg")
+    watcher._handle_event(8, IN_DELETE, "p2.png")
+    watcher._handle_event(7, IN_CLOSE_WRITE, "vol.zip")
+    watcher._handle_event(7, IN_CLOSE_WRITE, "vol.zip")
+    watcher._handle_event(7, IN_CREATE, "notes.txt")
+
+    # 最后一个事件之后还没安静够 debounce 秒
+    watcher._flush(library.last_event + 0.5)
+    assert changes == []
+    watcher._flush(library.last_event + 1.0)
+    assert changes == [(1, ["", "sub"], [os.path.join(library.root, "vol.zip")])]
+    assert watcher.updates == 1
+
+    watcher._flush(time.monotonic() + 10)
+    assert len(changes) == 1
+
+
+def test_continuous_events_flush_after_max_delay(watcher):
+    watcher, library, changes = watcher
+    library.mark(library.root)
+    start = library.first_event
+    # 每 0.5 秒都有新事件，debounce 永远等不到，最晚 max_delay 后也要更新一次
+    for step in range(1, 20):
+        library.last_event = start + step * 0.5
+        watcher._flush(library.last_event)
+        if changes:
+            break
+    assert step * 0.5 == watcher.max_delay
+    assert changes == [(1, [""], [])]
+    assert library.first_event is None
+
+
+def test_queue_overflow_requests_full_scan(watcher):
+    watcher, library, changes = watcher
+    watcher._handle_event(7, IN_CREATE, "p1.jpg")
+    watcher._handle_event(-1, IN_Q_OVERFLOW, "")
+    watcher._flush(library.last_event + 1.0)
+    assert changes == [(1, None, [])]
+
+
+def test_poll_marks_changed_directories(watcher, tmp_path):
+    watcher, library, changes = watcher
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    library.polling = True
+    watcher._poll(library)
+    library.take()
+
+    (tmp_path / "a" / "new").mkdir()
+    (tmp_path / "b").rmdir()
+    watcher._poll(library)
+    watcher._flush(library.last_event + 1.0)
+    assert changes == [(1, ["", "a"], [])]
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+def test_inotify_burst_produces_one_update(tmp_path):
+    (tmp_path / "sub").mkdir()
+    watcher = LibraryWatcher(backend="inotify", debounce=0.3, max_delay=5.0)
+    changes = []
+    changed = threading.Event()
+
+    def on_change(*args):
+        changes.append(args)
+        changed.set()
+
+    watcher.start([(1, str(tmp_path))], on_change)
+    try:
+        deadline = time.monotonic() + 5
+        while watcher.stats()["watched_directories"] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        for i in range(5):
+            (tmp_path / f"p{i}.jpg").write_bytes(b"page")
+            (tmp_path / "sub" / f"p{i}.jpg").write_bytes(b"page")
+        assert changed.wait(5)
+        time.sleep(0.5)
+    finally:
+        watcher.stop()
+    assert changes == [(1, ["", "sub"], [])]
@@ -0,0 +1,201 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+
+from archive_pool import open_archive
+from config import (THUMBNAIL_DIR, THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT, THUMBNAIL_FORMAT,
+                    THUMBNAIL_QUALITY, THUMBNAIL_CACHE_MAX_BYTES, THUMBNAIL_WORKERS)
+from disk_cache import DiskLRUCache, remove_path
+from executors import metadata_executor
+from metrics import span
+
+logger = logging.getLogger("uvicorn.info")
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+# 系列文件夹本身没有图片时，向下找第一个子文件夹的封面，最多找这么多层
+MAX_COVER_DEPTH = 3
+
+
+def _archive_names(archive):
+    if hasattr(archive, 'getnames'):
+        return archive.getnames()
+    return archive.namelist()
+
+
+def _read_archive_member(archive, name):
+    if hasattr(archive, 'getnames'):
+        return archive.read([name])[name].read()
+    return archive.read(name)
+
+
+def read_cover_bytes(source_path, is_archive, depth=0):
+    if is_archive:
+        with open_archive(source_path) as archive:
+            images = sorted(n for n in _archive_names(archive) if n.lower().endswith(IMAGE_EXTENSIONS))
+            if not images:
+                return None
+            return _read_archive_member(archive, images[0])
+
+    if not os.path.isdir(source_path):
+        return None
+    entries = sorted(os.scandir(source_path), key=lambda e: e.name)
+    for entry in entries:
+        if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(entry.path, 'rb') as f:
+                return f.read()
+    if depth >= MAX_COVER_DEPTH:
+        return None
+    for entry in entries:
+        if entry.is_dir():
+            data = read_cover_bytes(entry.path, False, depth + 1)
+        elif entry.name.lower().endswith(('.zip', '.rar', '.7z')):
+            data = read_cover_bytes(entry.path, True, depth + 1)
+        else:
+            continue
+        if data:
+            return data
+    return None
+
+
+def render_thumbnail(source_path, is_archive, out_path,
+                     width=THUMBNAIL_WIDTH, height=THUMBNAIL_HEIGHT,
+                     fmt=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY):
+    # 在进程池里运行：读取封面，缩小后写到 out_path。没有可用图片时返回 False
+    data = read_cover_bytes(source_path, is_archive)
+    if not data:
+        return False
+    with Image.open(BytesIO(data)) as img:
+        # JPEG 可以直接按缩小后的尺寸解码，省掉大部分解码开销
+        img.draft('RGB', (width, height))
+        img = img.convert('RGB')
+        img.thumbnail((width, height), Image.LANCZOS)
+        if fmt == 'webp':
+            img.save(out_path, 'WEBP', quality=quality, method=4)
+        else:
+            img.save(out_path, 'JPEG', quality=quality, optimize=True)
+    return True
+
+
+def thumbnail_key(source_path):
+    st = os.stat(source_path)
+    raw = f"{os.path.abspath(source_path)}|{st.st_mtime_ns}|{st.st_size}"
+    ext = 'webp' if THUMBNAIL_FORMAT == 'webp' else 'jpg'
+    return f"{hashlib.sha1(raw.encode('utf-8')).hexdigest()}.{ext}"
+
+
+class ThumbnailStore:
+    """按 源路径+mtime 做内容寻址的缩略图缓存，扫描时批量生成，请求未命中时现场生成。"""
+
+    def __init__(self, root=THUMBNAIL_DIR, max_bytes=THUMBNAIL_CACHE_MAX_BYTES, workers=THUMBNAIL_WORKERS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.media_type = 'image/webp' if THUMBNAIL_FORMAT == 'webp' else 'image/jpeg'
+        self._cache = None
+        self._executor = None
+        self._pending = {}
+        self._no_cover = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            with self._lock:
+                if self._cache is None:
+                    self._cache = DiskLRUCache(self.root, self.max_bytes)
+        return self._cache
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=max(1, self.workers))
+        return self._executor
+
+    def lookup(self, source_path):
+        try:
+            key = thumbnail_key(source_path)
+        except OSError:
+            return None, None
+        return key, self.cache.get(key)
+
+    def submit(self, source_path, is_archive, key=None):
+        if key is None:
+            key = thumbnail_key(source_path)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            if key in self._no_cover:
+                return None
+            temp_path = self.cache.temp_path_for(key)
+            future = self._get_executor().submit(render_thumbnail, source_path, is_archive, temp_path)
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._on_done(key, temp_path, source_path, f))
+        return future
+
+    def _on_done(self, key, temp_path, source_path, future):
+        if future.cancelled():
+            remove_path(temp_path)
+            with self._lock:
+                self._pending.pop(key, None)
+            return
+        try:
+            if future.result():
+                self.cache.commit(key, temp_path)
+            else:
+                with self._lock:
+                    self._no_cover.add(key)
+        except Exception as e:
+            logger.warning(f"Failed to generate thumbnail for {source_path}: {e}")
+            remove_path(temp_path)
+            with self._lock:
+                self._no_cover.add(key)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    async def get_or_create(self, source_path, is_archive):
+        # 首次访问缓存会遍历缓存目录，查找也要 stat，都放到线程池里
+        key, path = await metadata_executor.run(self.lookup, source_path)
+        if key is None or path is not None:
+            return path
+        future = self.submit(source_path, is_archive, key)
+        if future is None:
+            return None
+        try:
+            with span("thumbnail"):
+                await asyncio.wrap_future(future)
+        except Exception:
+            return None
+        return await metadata_executor.run(self._cached_path, key)
+
+    def _cached_path(self, key):
+        return self.cache.get(key)
+
+    def schedule(self, items):
+        # items 为 (源路径, 是否压缩包)；扫描后把还没有缩略图的漫画丢进进程池，不等待结果
+        scheduled = 0
+        for source_path, is_archive in items:
+            key, path = self.lookup(source_path)
+            if key is None or path is not None:
+                continue
+            if self.submit(source_path, is_archive, key) is not None:
+                scheduled += 1
+        if scheduled:
+            logger.info(f"Scheduled {scheduled} thumbnails for generation")
+        return scheduled
+
+    def shutdown(self):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+thumbnail_store = ThumbnailStore()
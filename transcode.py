@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from PIL import Image, features
+
+from config import (TRANSCODE_DIR, TRANSCODE_CACHE_MAX_BYTES, TRANSCODE_WORKERS, TRANSCODE_MAX_PENDING,
+                    TRANSCODE_MAX_WIDTH, TRANSCODE_DEFAULT_FORMAT, TRANSCODE_DEFAULT_QUALITY)
+from disk_cache import DiskLRUCache, remove_path
+from executors import metadata_executor
+from metrics import span
+
+logger = logging.getLogger("uvicorn.info")
+
+# 输出格式 -> (PIL 格式名, 扩展名, Content-Type)
+OUTPUT_FORMATS = {
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+    "webp": ("WEBP", "webp", "image/webp"),
+    "avif": ("AVIF", "avif", "image/avif"),
+}
+MIN_WIDTH = 16
+
+Transform = namedtuple("Transform", ["width", "format", "quality"])
+
+
+class TranscodeBusy(Exception):
+    pass
+
+
+def _avif_supported():
+    try:
+        return bool(features.check("avif"))
+    except Exception:
+        return False
+
+
+def parse_transform(width=None, fmt=None, quality=None):
+    """解析 ?w= / ?format= / ?q=，都没给时返回 None；参数不合法时抛出 ValueError。"""
+    if width is None and fmt is None and quality is None:
+        return None
+    fmt = (fmt or TRANSCODE_DEFAULT_FORMAT).lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {fmt}")
+    if fmt == "avif" and not _avif_supported():
+        raise ValueError("AVIF output is not supported by this server")
+    if width is not None:
+        width = max(MIN_WIDTH, min(width, TRANSCODE_MAX_WIDTH))
+    quality = TRANSCODE_DEFAULT_QUALITY if quality is None else max(1, min(quality, 100))
+    return Transform(width, fmt, quality)
+
+
+def _open_source(source):
+    # source 为 ("file", 路径, 偏移, 长度) 或 ("bytes", 数据)
+    if source[0] == "file":
+        _, path, offset, length = source
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+    else:
+        data = source[1]
+    return Image.open(BytesIO(data))
+
+
+def render_derived(source, out_path, width, fmt, quality):
+    # 在进程池里运行：按宽度等比缩小（不放大）并转成目标格式
+    pil_format = OUTPUT_FORMATS[fmt][0]
+    with _open_source(source) as img:
+        target = None
+        if width is not None and img.width > width:
+            target = (width, max(1, round(img.height * width / img.width)))
+            # JPEG 可以直接按缩小后的尺寸解码，省掉大部分解码开销
+            img.draft('RGB', target)
+        has_alpha = 'A' in img.getbands() or (img.mode == 'P' and 'transparency' in img.info)
+        img = img.convert('RGBA' if has_alpha and fmt != "jpeg" else 'RGB')
+        if target is not None and img.width > target[0]:
+            img = img.resize(target, Image.LANCZOS)
+        if pil_format == "JPEG":
+            img.save(out_path, pil_format, quality=quality, optimize=True, progressive=True)
+        elif pil_format == "WEBP":
+            img.save(out_path, pil_format, quality=quality, method=4)
+        else:
+            img.save(out_path, pil_format, quality=quality)
+    return True
+
+
+class DerivedImageStore:
+    """缩放/转码后的页面缓存：按 源标识+参数 做内容寻址，同一结果并发请求只生成一次。"""
+
+    def __init__(self, root=TRANSCODE_DIR, max_bytes=TRANSCODE_CACHE_MAX_BYTES,
+                 workers=TRANSCODE_WORKERS, max_pending=TRANSCODE_MAX_PENDING):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.max_pending = max_pending
+        self._cache = None
+        self._executor = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.generated = 0
+        self.rejected = 0
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            with self._lock:
+                if self._cache is None:
+                    self._cache = DiskLRUCache(self.root, self.max_bytes)
+        return self._cache
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=max(1, self.workers))
+        return self._executor
+
+    @staticmethod
+    def key(source_id, transform):
+        raw = f"{source_id}|{transform.width}|{transform.format}|{transform.quality}"
+        return f"{hashlib.sha1(raw.encode('utf-8')).hexdigest()}.{OUTPUT_FORMATS[transform.format][1]}"
+
+    @classmethod
+    def etag(cls, source_id, transform):
+        return f'"{cls.key(source_id, transform)}"'
+
+    @staticmethod
+    def media_type(transform):
+        return OUTPUT_FORMATS[transform.format][2]
+
+    async def get_or_create(self, source_id, transform, load_source):
+        """返回派生图片的缓存路径。load_source 为协程函数，只在缓存未命中时调用以取得源图。"""
+        key = self.key(source_id, transform)
+        # 首次访问缓存会遍历缓存目录，查找和登记也有文件系统调用，都放到线程池里
+        path = await metadata_executor.run(self._cached_path, key)
+        if path is not None:
+            return path
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            await asyncio.shield(pending)
+            return await metadata_executor.run(self._cached_path, key)
+        if len(self._pending) >= self.max_pending:
+            self.rejected += 1
+            raise TranscodeBusy()
+
+        pending = asyncio.get_running_loop().create_future()
+        self._pending[key] = pending
+        temp_path = self.cache.temp_path_for(key)
+        job = None
+        committed = False
+        try:
+            source = await load_source()
+            with span("transcode"):
+                job = self._get_executor().submit(render_derived, source, temp_path, *transform)
+                await asyncio.wrap_future(job)
+            job = metadata_executor.submit(self.cache.commit, key, temp_path)
+            await asyncio.wrap_future(job)
+            committed = True
+            self.generated += 1
+        finally:
+            self._pending.pop(key, None)
+            pending.set_result(None)
+            if not committed:
+                # 出错或客户端断开（CancelledError）：已经在跑的任务停不下来，等它结束后再删掉输出
+                if job is not None and not job.done() and not job.cancel():
+                    job.add_done_callback(lambda _: remove_path(temp_path))
+                else:
+                    remove_path(temp_path)
+        return await metadata_executor.run(self._cached_path, key)
+
+    def _cached_path(self, key):
+        return self.cache.get(key)
+
+    def shutdown(self):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        stats = self.cache.stats() if self._cache is not None else {}
+        stats.update({
+            "pending": len(self._pending),
+            "max_pending": self.max_pending,
+            "workers": self.workers,
+            "generated": self.generated,
+            "rejected": self.rejected,
+        })
+        return stats
+
+
+derived_images = DerivedImageStore()
@@ -0,0 +1,384 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from archive_index import ARCHIVE_EXTENSIONS, IMAGE_EXTENSIONS
+from config import (WATCH_BACKEND, WATCH_DEBOUNCE_SECONDS, WATCH_MAX_DELAY_SECONDS, WATCH_POLL_SECONDS)
+
+logger = logging.getLogger("uvicorn.info")
+
+# inotify 事件位（linux/inotify.h）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+ENTRY_EVENTS = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+
+_EVENT = struct.Struct("iIII")
+READ_BYTES = 256 * 1024
+
+
+class Inotify:
+    """通过 ctypes 调用 Linux inotify。inotify 不递归，每个目录需要单独添加 watch。"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.fd = fd
+
+    def add_watch(self, path):
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, READ_BYTES)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos + _EVENT.size <= len(data):
+            wd, mask, _cookie, length = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b"\0"))
+            pos += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class WatchedLibrary:
+    def __init__(self, library_id, path):
+        self.id = library_id
+        self.root = os.path.abspath(path)
+        self.polling = False
+        self.dir_mtimes = {}
+        self.dirty_dirs = set()
+        self.archives = set()
+        self.full = False
+        self.first_event = None
+        self.last_event = None
+
+    def mark(self, abs_dir=None, archive=None, full=False):
+        now = time.monotonic()
+        if abs_dir is not None:
+            rel_dir = os.path.relpath(abs_dir, self.root)
+            self.dirty_dirs.add("" if rel_dir == os.curdir else rel_dir)
+        if archive is not None:
+            self.archives.add(archive)
+        self.full = self.full or full
+        if self.first_event is None:
+            self.first_event = now
+        self.last_event = now
+
+    def take(self):
+        # 取出攒下的变化并清空；full 时返回 None 表示整库增量扫描
+        dirs = None if self.full else sorted(self.dirty_dirs)
+        archives = sorted(self.archives)
+        self.dirty_dirs = set()
+        self.archives = set()
+        self.full = False
+        self.first_event = None
+        self.last_event = None
+        return dirs, archives
+
+
+def _directory_mtimes(root):
+    # 轮询用：只 stat 目录，不看文件，开销与目录数成正比
+    mtimes = {}
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        try:
+            mtimes[path] = os.stat(path).st_mtime_ns
+            with os.scandir(path) as entries:
+                stack.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+        except OSError:
+            continue
+    return mtimes
+
+
+class LibraryWatcher:
+    """监视各资料库目录，把一段时间内的变化合并成一次更新回调。
+
+    Linux 上用 inotify，不可用（或 watch 数量超出系统上限）时对该资料库退回定时比较目录 mtime。
+    回调参数为 (资料库 id, 变化的相对目录列表或 None, 内容被改写的压缩包路径列表)，在监视线程里调用。
+    """
+
+    def __init__(self, backend=WATCH_BACKEND, debounce=WATCH_DEBOUNCE_SECONDS,
+                 max_delay=WATCH_MAX_DELAY_SECONDS, poll_interval=WATCH_POLL_SECONDS):
+        self.backend = backend
+        self.debounce = max(0.05, debounce)
+        self.max_delay = max(self.debounce, max_delay)
+        self.poll_interval = max(1.0, poll_interval)
+        self._libraries = {}
+        self._watches = {}
+        self._watched_dirs = {}
+        self._inotify = None
+        self._on_change = None
+        self._commands = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.events = 0
+        self.updates = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, libraries, on_change):
+        if self.running:
+            return
+        self._on_change = on_change
+        if self.backend in ("auto", "inotify") and sys.platform.startswith("linux"):
+            try:
+                self._inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                logger.warning(f"inotify unavailable, falling back to polling: {e}")
+        for library_id, path in libraries:
+            self.add_library(library_id, path)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="library-watcher", daemon=True)
+        self._thread.start()
+        mode = "inotify" if self._inotify is not None else f"polling every {self.poll_interval:g}s"
+        logger.info(f"Watching {len(libraries)} libraries ({mode})")
+
+    def add_library(self, library_id, path):
+        # 目录遍历和 watch 表只在监视线程里操作
+        with self._lock:
+            self._commands.append(("add", library_id, path))
+
+    def remove_library(self, library_id):
+        with self._lock:
+            self._commands.append(("remove", library_id, None))
+
+    def sync_libraries(self, libraries):
+        # 按给定的 [(id, 路径)] 调整监视范围：新增的开始监视，不在列表里的停止监视
+        with self._lock:
+            self._commands.append(("sync", None, list(libraries)))
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        self._watches.clear()
+        self._watched_dirs.clear()
+        self._libraries.clear()
+
+    def stats(self):
+        libraries = list(self._libraries.values())
+        return {
+            "backend": "inotify" if self._inotify is not None else "poll",
+            "running": self.running,
+            "libraries": len(libraries),
+            "polling_libraries": sum(1 for lib in libraries if lib.polling),
+            "watched_directories": len(self._watched_dirs),
+            "events": self.events,
+            "updates": self.updates,
+        }
+
+    # ---- 监视线程 ----
+
+    def _run(self):
+        next_poll = time.monotonic() + self.poll_interval
+        while not self._stop.is_set():
+            try:
+                self._apply_commands()
+                timeout = self.debounce / 2
+                if self._inotify is not None:
+                    for wd, mask, name in self._inotify.read_events(timeout):
+                        self.events += 1
+                        self._handle_event(wd, mask, name)
+                else:
+                    self._stop.wait(timeout)
+                now = time.monotonic()
+                if now >= next_poll:
+                    for library in list(self._libraries.values()):
+                        if library.polling:
+                            self._poll(library)
+                    next_poll = now + self.poll_interval
+                self._flush(time.monotonic())
+            except Exception as e:
+                logger.error(f"Library watcher error: {e}")
+                self._stop.wait(self.poll_interval)
+
+    def _apply_commands(self):
+        with self._lock:
+            commands, self._commands = self._commands, []
+        for action, library_id, path in commands:
+            if action == "sync":
+                wanted = {i: os.path.abspath(p) for i, p in path}
+                for known_id in [i for i in self._libraries if wanted.get(i) != self._libraries[i].root]:
+                    self._drop_library(known_id)
+                for wanted_id, wanted_path in wanted.items():
+                    if wanted_id not in self._libraries:
+                        self._add_library(wanted_id, wanted_path)
+                continue
+            self._drop_library(library_id)
+            if action == "add":
+                self._add_library(library_id, path)
+
+    def _add_library(self, library_id, path):
+        library = WatchedLibrary(library_id, path)
+        self._libraries[library_id] = library
+        if self._inotify is not None:
+            try:
+                self._watch_tree(library, library.root)
+                return
+            except OSError as e:
+                logger.warning(f"Cannot watch {library.root} with inotify, polling instead: {e}")
+                self._unwatch_under(library.root)
+        library.polling = True
+        library.dir_mtimes = _directory_mtimes(library.root)
+
+    def _drop_library(self, library_id):
+        library = self._libraries.pop(library_id, None)
+        if library is not None and not library.polling:
+            self._unwatch_under(library.root)
+
+    def _watch_tree(self, library, top):
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            if path in self._watched_dirs:
+                continue
+            try:
+                wd = self._inotify.add_watch(path)
+            except FileNotFoundError:
+                continue
+            self._watches[wd] = (library.id, path)
+            self._watched_dirs[path] = wd
+            try:
+                with os.scandir(path) as entries:
+                    stack.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+
+    def _unwatch_under(self, top):
+        prefix = os.path.join(top, "")
+        for path in [p for p in self._watched_dirs if p == top or p.startswith(prefix)]:
+            wd = self._watched_dirs.pop(path)
+            self._watches.pop(wd, None)
+            if self._inotify is not None:
+                self._inotify.rm_watch(wd)
+
+    def _handle_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            # 内核事件队列溢出，丢失了哪些变化无从得知，整库重新比对
+            for library in self._libraries.values():
+                library.mark(full=True)
+            return
+        watch = self._watches.get(wd)
+        if watch is None:
+            return
+        library_id, abs_dir = watch
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            if self._watched_dirs.get(abs_dir) == wd:
+                self._watched_dirs.pop(abs_dir)
+            return
+        library = self._libraries.get(library_id)
+        if library is None:
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            # 子目录自身的删除/移动由父目录的事件处理；资料库根目录本身消失时整库比对
+            if abs_dir == library.root:
+                library.mark(full=True)
+            return
+
+        path = os.path.join(abs_dir, name)
+        if mask & IN_ISDIR:
+            if mask & IN_MOVED_FROM:
+                self._unwatch_under(path)
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self._watch_tree(library, path)
+                except OSError as e:
+                    logger.warning(f"Cannot watch {path}, switching {library.root} to polling: {e}")
+                    self._unwatch_under(library.root)
+                    library.polling = True
+                    library.dir_mtimes = _directory_mtimes(library.root)
+            library.mark(abs_dir)
+            return
+
+        lower = name.lower()
+        if lower.endswith(ARCHIVE_EXTENSIONS):
+            if mask & IN_CLOSE_WRITE:
+                # 写完的压缩包（包括原地覆盖，目录 mtime 不变）需要重建索引
+                library.mark(archive=path)
+            if mask & ENTRY_EVENTS:
+                library.mark(abs_dir)
+        elif lower.endswith(IMAGE_EXTENSIONS) and mask & ENTRY_EVENTS:
+            library.mark(abs_dir)
+
+    def _poll(self, library):
+        mtimes = _directory_mtimes(library.root)
+        old = library.dir_mtimes
+        for path, mtime_ns in mtimes.items():
+            if old.get(path) != mtime_ns:
+                library.mark(path if path in old else os.path.dirname(path))
+        for path in old:
+            if path not in mtimes and path != library.root:
+                library.mark(os.path.dirname(path))
+        if library.root in old and library.root not in mtimes:
+            library.mark(full=True)
+        library.dir_mtimes = mtimes
+
+    def _flush(self, now):
+        for library in list(self._libraries.values()):
+            if library.last_event is None:
+                continue
+            if now - library.last_event < self.debounce and now - library.first_event < self.max_delay:
+                continue
+            dirs, archives = library.take()
+            self.updates += 1
+            logger.info(f"Library {library.id} changed: "
+                        f"{'full rescan' if dirs is None else f'{len(dirs)} directories'}, "
+                        f"{len(archives)} rewritten archives")
+            try:
+                self._on_change(library.id, dirs, archives)
+            except Exception as e:
+                logger.error(f"Failed to apply changes for library {library.id}: {e}")
+
+
+library_watcher = LibraryWatcher()